@@ -3,7 +3,7 @@ import logging
 import pandas
 
 from utils.gwas import get_topk_snps
-from utils.plink import run_plink
+from fl.datasets.view import VariantView, VIEW_EXTENSION
 
 
 def write_snplist(gwas_path: str, max_snp_count: int):
@@ -36,7 +36,7 @@ if __name__ == '__main__':
         Snakemake = namedtuple('Snakemake', ['input', 'output', 'params', 'threads', 'wildcards', 'resources', 'log'])
         snakemake = Snakemake(
             input={'phenotype': 'test.phenotype', 'gwas': 'test.gwas'},
-            output={'pgen': 'test.pfile.out.pgen'},
+            output={'view': 'test.pfile.out.view.npz'},
             params={'in_prefix': 'test.pfile.in', 'out_prefix': 'test.pfile.out'},
             wildcards={'snp_count': '1000'},
             resources={'mem_mb': 1000},
@@ -49,20 +49,14 @@ if __name__ == '__main__':
     input = snakemake.input[0]
 
     in_pfile = snakemake.params['in_prefix']
-    phenotype_path = snakemake.input['phenotype']
     gwas_path = snakemake.input['gwas']
     max_snp_count = int(snakemake.wildcards['snp_count'])
-    threads = str(snakemake.threads)
-    mem_mb = str(snakemake.resources['mem_mb'])
     out_pfile = snakemake.params['out_prefix']
 
-    write_temp_fid_iid(phenotype_path, out_pfile + '.samples')
-
-    snplist_path = write_snplist(gwas_path, max_snp_count)
-    args = ['--pfile', in_pfile,
-            '--extract', snplist_path, '--keep', out_pfile + '.samples', 
-            '--threads', threads, '--memory', mem_mb,
-            '--make-pgen', '--out', out_pfile]
-    run_plink(args)
+    # genotypes are not copied with plink --extract --make-pgen, loaders read top SNPs from {in_pfile} through the view.
+    # Samples are not filtered either, since loaders select them by IIDs of phenotype files
+    gwas = pandas.read_table(gwas_path).set_index('ID')
+    view = VariantView.from_ids(in_pfile, get_topk_snps(gwas, max_snp_count).index)
+    view.save(out_pfile)
 
-    print(f'Extracted {max_snp_count} SNPs from {in_pfile} to {out_pfile}')
\ No newline at end of file
+    print(f'Written view of {len(view)} SNPs from {in_pfile} to {out_pfile}{VIEW_EXTENSION}')
\ No newline at end of file
@@ -0,0 +1,193 @@
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import re
+import sys
+from typing import List, Optional, Tuple
+import numpy
+
+from fl.datasets.tables import atomic_save
+
+
+class GenotypeCache:
+    def __init__(self, cache_dir: str, max_size_gb: float = 64.0) -> None:
+        """Content-addressed on-disk cache of decoded int8 sample-major genotype matrices.
+        Matrices are stored as .npy files and returned as read-only numpy.memmap views.
+        When the total size of the cache exceeds {max_size_gb}, least recently used matrices are evicted.
+
+        Args:
+            cache_dir (str): Directory where cached matrices are stored. It is created if it does not exist.
+            max_size_gb (float, optional): Size cap of the cache directory in gigabytes. Defaults to 64.0.
+        """
+        self.cache_dir = cache_dir
+        self.max_size_bytes = int(max_size_gb * 1024**3)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, pfile_path: str, snp_indices: Optional[numpy.ndarray], sample_indices: Optional[numpy.ndarray], missing: str,
+            packed: bool = False) -> str:
+        """Calculates cache key from .pgen path and modification time, selected variant and sample indices,
+        missing values strategy and genotype format
+
+        Args:
+            pfile_path (str): Path to plink 2.0 dataset without .pgen extension
+            snp_indices (Optional[numpy.ndarray]): Indices of variants to load. None means all variants.
+            sample_indices (Optional[numpy.ndarray]): Indices of samples to load. None means all samples.
+            missing (str): Strategy of filling missing values
+            packed (bool, optional): Whether genotypes are stored as 2-bit packed codes. Defaults to False.
+
+        Returns:
+            str: Hex digest which is used as a file name of cached matrix
+        """
+        pgen_path = os.path.realpath(pfile_path + '.pgen')
+        stat = os.stat(pgen_path)
+        digest = hashlib.sha256()
+        digest.update(f'{pgen_path}:{stat.st_mtime_ns}:{stat.st_size}:{missing}'.encode('utf-8'))
+        if packed:
+            digest.update(b'packed')
+        for indices in [snp_indices, sample_indices]:
+            if indices is None:
+                digest.update(b'all')
+            else:
+                digest.update(b'list')
+                digest.update(numpy.ascontiguousarray(indices, dtype=numpy.uint32).tobytes())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.npy')
+
+    def get(self, key: str) -> Optional[numpy.ndarray]:
+        """Returns read-only memory-mapped view of cached matrix or None if it is not cached.
+        Packed matrices are returned as raw uint8 codes.
+
+        Args:
+            key (str): Cache key generated by {key} method
+
+        Returns:
+            Optional[numpy.ndarray]: numpy.memmap with genotypes or None
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            array = numpy.load(path, mmap_mode='r')
+        except (ValueError, OSError) as e:
+            logging.warning(f'genotype cache file {path} is corrupted and will be removed: {e}')
+            self._remove(path)
+            return None
+        # modification time is used as a last access time for LRU eviction
+        os.utime(path)
+        return array
+
+    def put(self, key: str, array: numpy.ndarray) -> numpy.ndarray:
+        """Writes {array} to the cache and returns a memory-mapped view of it
+
+        Args:
+            key (str): Cache key generated by {key} method
+            array (numpy.ndarray): Decoded genotype matrix
+
+        Returns:
+            numpy.ndarray: numpy.memmap view of cached matrix
+        """
+        path = self._path(key)
+        atomic_save(path, lambda file: numpy.save(file, array))
+        self.evict(keep=path)
+        return numpy.load(path, mmap_mode='r')
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _entries(self) -> List[Tuple[str, os.stat_result]]:
+        """Returns paths and stats of cached matrices, stat of each file is taken once.
+        Other node processes can evict matrices at the same time, so files which vanished are skipped."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.npy'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((entry.path, stat))
+        return entries
+
+    def size(self) -> int:
+        return sum(stat.st_size for _, stat in self._entries())
+
+    def evict(self, keep: str = None):
+        """Removes least recently used matrices until cache size is not greater than size cap
+
+        Args:
+            keep (str, optional): Path which should not be evicted, e.g. the matrix we have just written. Defaults to None.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[1].st_mtime_ns)
+        total = sum(stat.st_size for _, stat in entries)
+        keep = None if keep is None else os.path.abspath(keep)
+        for path, stat in entries:
+            if total <= self.max_size_bytes:
+                break
+            if os.path.abspath(path) == keep:
+                continue
+            logging.info(f'evicting {path} from genotype cache')
+            total -= stat.st_size
+            self._remove(path)
+
+
+def warm_split_cache(cache: GenotypeCache, split_dir: str, phenotype: str, snp_count: Optional[int],
+                     gwas_template: str = 'gwas/{phenotype}/node_{node}/fold_{fold}.gwas.tsv', missing: str = 'zero',
+                     packed: bool = False, threads: int = 1):
+    """Decodes genotypes for every node, fold and part of the split and stores them in the cache
+
+    Args:
+        cache (GenotypeCache): Cache to warm
+        split_dir (str): Split directory with genotypes/node_{node}.pgen and phenotypes/{phenotype}/node_{node}/fold_{fold}_{part}.tsv
+        phenotype (str): Name of phenotype
+        snp_count (Optional[int]): Number of most significant SNPs to load. If None then load all SNPs
+        gwas_template (str, optional): Path to GWAS results relative to {split_dir}. Defaults to node-level GWAS.
+        missing (str, optional): Strategy of filling missing values. Defaults to 'zero'.
+        packed (bool, optional): Whether to cache 2-bit packed genotypes. Defaults to False.
+        threads (int, optional): Number of threads which decode genotypes. Defaults to 1.
+    """
+    # memory imports GenotypeCache, so we import loaders here to avoid a circular import
+    from fl.datasets.memory import load_from_pgen, get_sample_indices
+
+    phenotype_files = glob.glob(os.path.join(split_dir, 'phenotypes', phenotype, 'node_*', 'fold_*_*.tsv'))
+    pattern = re.compile(r'node_(?P<node>[^/]+)/fold_(?P<fold>\d+)_(?P<part>train|val|test)\.tsv$')
+    for phenotype_path in sorted(phenotype_files):
+        match = pattern.search(phenotype_path)
+        if match is None:
+            continue
+        node, fold, part = match.group('node'), match.group('fold'), match.group('part')
+        pfile_path = os.path.join(split_dir, 'genotypes', f'node_{node}')
+        gwas_path = os.path.join(split_dir, gwas_template.format(phenotype=phenotype, node=node, fold=fold))
+        sample_indices = get_sample_indices(pfile_path, phenotype_path)
+        array = load_from_pgen(pfile_path, gwas_path, snp_count, sample_indices=sample_indices, missing=missing, cache=cache, packed=packed, threads=threads)
+        logging.info(f'node {node} fold {fold} {part}: cached {array.shape[0]} samples and {array.shape[1]} SNPs')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Warms genotype cache for every node and fold in a split directory')
+    parser.add_argument('--cache-dir', type=str, required=True, help='Genotype cache directory')
+    parser.add_argument('--max-size-gb', type=float, default=64.0, help='Size cap of genotype cache')
+    parser.add_argument('--split-dir', type=str, required=True, help='Split directory, e.g. /gpfs/gpfs0/ukb_data/test/ethnic_split')
+    parser.add_argument('--phenotype', type=str, default='standing_height')
+    parser.add_argument('--snp-count', type=int, nargs='+', default=[None], help='One or several numbers of top SNPs to cache')
+    parser.add_argument('--gwas-template', type=str, default='gwas/{phenotype}/node_{node}/fold_{fold}.gwas.tsv',
+                        help='GWAS path relative to split dir, may use {phenotype}, {node} and {fold}')
+    parser.add_argument('--missing', type=str, default='zero')
+    parser.add_argument('--packed', action='store_true', help='Cache 2-bit packed genotypes, see data.genotype_format')
+    parser.add_argument('--threads', type=int, default=1, help='Number of genotype decoding threads')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        stream=sys.stdout,
+                        format='%(asctime)s %(levelname)-8s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+
+    genotype_cache = GenotypeCache(args.cache_dir, args.max_size_gb)
+    for count in args.snp_count:
+        warm_split_cache(genotype_cache, args.split_dir, args.phenotype, count, args.gwas_template, args.missing, args.packed, args.threads)
@@ -0,0 +1,41 @@
+import os
+import numpy
+from fl.datasets.cache import GenotypeCache
+
+
+def _touch_pgen(tmp_path) -> str:
+    pfile_path = os.path.join(tmp_path, 'node_0')
+    with open(pfile_path + '.pgen', 'wb') as file:
+        file.write(b'pgen')
+    return pfile_path
+
+
+def test_GenotypeCache_roundtrip(tmp_path):
+    cache = GenotypeCache(os.path.join(tmp_path, 'cache'))
+    pfile_path = _touch_pgen(tmp_path)
+    array = numpy.random.randint(0, 3, size=(10, 5)).astype(numpy.int8)
+    key = cache.key(pfile_path, numpy.array([0, 2, 4], dtype=numpy.uint32), None, 'zero')
+    assert cache.get(key) is None
+    cache.put(key, array)
+    cached = cache.get(key)
+    assert isinstance(cached, numpy.memmap)
+    assert cached.dtype == numpy.int8
+    assert numpy.array_equal(cached, array)
+    assert key != cache.key(pfile_path, numpy.array([0, 2, 5], dtype=numpy.uint32), None, 'zero')
+    assert key != cache.key(pfile_path, numpy.array([0, 2, 4], dtype=numpy.uint32), numpy.arange(10), 'zero')
+
+
+def test_GenotypeCache_lru_eviction(tmp_path):
+    array = numpy.zeros((1024, 1024), dtype=numpy.int8)
+    # room for two matrices of 1MB plus .npy headers
+    cache = GenotypeCache(os.path.join(tmp_path, 'cache'), max_size_gb=2.5/1024)
+    cache.put('first', array)
+    cache.put('second', array)
+    os.utime(cache._path('first'), ns=(0, 0))
+    os.utime(cache._path('second'), ns=(1, 1))
+    # first becomes the most recently used one
+    cache.get('first')
+    cache.put('third', array)
+    assert cache.get('second') is None
+    assert cache.get('first') is not None
+    assert cache.get('third') is not None
@@ -0,0 +1,136 @@
+import argparse
+import logging
+import os
+import sys
+from typing import Dict, Iterable, Tuple
+import numpy
+import pandas
+
+from fl.datasets.tables import atomic_save
+
+
+CATALOG_EXTENSION = '.catalog.npz'
+
+
+def _as_ids(values: Iterable) -> numpy.ndarray:
+    # IDs are compared as ascii bytes, so numeric IIDs from phenotype files match string IIDs from .psam
+    return numpy.asarray(values).astype(str).astype(numpy.bytes_)
+
+
+class PfileCatalog:
+    def __init__(self, variant_ids: numpy.ndarray, variant_chrom: numpy.ndarray, variant_pos: numpy.ndarray,
+                 sample_iids: numpy.ndarray) -> None:
+        """Metadata of plink 2.0 dataset: variant IDs, CHROM and POS from .pvar and sample IIDs from .psam
+        stored as numpy arrays in file order, with hash indices from ID to row
+
+        Args:
+            variant_ids (numpy.ndarray): Variant IDs as bytes
+            variant_chrom (numpy.ndarray): Variant chromosomes as bytes
+            variant_pos (numpy.ndarray): Variant positions
+            sample_iids (numpy.ndarray): Sample IIDs as bytes
+        """
+        self.variant_ids = variant_ids
+        self.variant_chrom = variant_chrom
+        self.variant_pos = variant_pos
+        self.sample_iids = sample_iids
+        self._variant_index = pandas.Index(variant_ids)
+        self._sample_index = pandas.Index(sample_iids)
+
+    @property
+    def variant_count(self) -> int:
+        return self.variant_ids.shape[0]
+
+    @property
+    def sample_count(self) -> int:
+        return self.sample_iids.shape[0]
+
+    @staticmethod
+    def _rows(index: pandas.Index, ids: Iterable) -> numpy.ndarray:
+        rows = index.get_indexer(_as_ids(ids))
+        # unknown IDs are skipped, rows are returned in file order like pandas isin selection
+        return numpy.unique(rows[rows >= 0]).astype(numpy.uint32)
+
+    def variant_rows(self, ids: Iterable) -> numpy.ndarray:
+        """Returns sorted .pvar rows of variants with {ids}, unknown IDs are skipped"""
+        return self._rows(self._variant_index, ids)
+
+    def lookup_variants(self, ids: Iterable) -> numpy.ndarray:
+        """Returns .pvar rows of variants with {ids} in the order of {ids}, -1 for unknown IDs"""
+        return self._variant_index.get_indexer(_as_ids(ids))
+
+    def sample_rows(self, iids: Iterable) -> numpy.ndarray:
+        """Returns sorted .psam rows of samples with {iids}, unknown IIDs are skipped"""
+        return self._rows(self._sample_index, iids)
+
+    @classmethod
+    def from_pfile(cls, pfile_path: str) -> 'PfileCatalog':
+        """Parses .pvar and .psam of {pfile_path}"""
+        pvar = pandas.read_table(pfile_path + '.pvar', usecols=['#CHROM', 'POS', 'ID'], dtype={'#CHROM': str, 'ID': str})
+        psam = pandas.read_table(pfile_path + '.psam', dtype=str).rename(columns={'#IID': 'IID'})
+        return cls(_as_ids(pvar['ID'].values), _as_ids(pvar['#CHROM'].values),
+                   pvar['POS'].values.astype(numpy.int64), _as_ids(psam['IID'].values))
+
+    def save(self, path: str):
+        atomic_save(path, lambda file: numpy.savez(file, variant_ids=self.variant_ids, variant_chrom=self.variant_chrom,
+                                                   variant_pos=self.variant_pos, sample_iids=self.sample_iids))
+
+    @classmethod
+    def load(cls, path: str) -> 'PfileCatalog':
+        with numpy.load(path) as data:
+            return cls(data['variant_ids'], data['variant_chrom'], data['variant_pos'], data['sample_iids'])
+
+
+def _pfile_mtime_ns(pfile_path: str) -> int:
+    return max(os.stat(pfile_path + extension).st_mtime_ns for extension in ['.pvar', '.psam'])
+
+
+_catalogs: Dict[str, Tuple[int, PfileCatalog]] = {}
+
+
+def get_catalog(pfile_path: str) -> PfileCatalog:
+    """Returns catalog of {pfile_path}. It is parsed from .pvar and .psam only once and stored
+    next to them as {pfile_path}.catalog.npz, which is rebuilt if .pvar or .psam are newer.
+    Catalogs are also kept in memory, so loading of several splits and folds does not read them again.
+
+    Args:
+        pfile_path (str): Path to plink 2.0 dataset without extension
+
+    Returns:
+        PfileCatalog: Variant and sample metadata
+    """
+    mtime_ns = _pfile_mtime_ns(pfile_path)
+    key = os.path.realpath(pfile_path)
+    if key in _catalogs and _catalogs[key][0] == mtime_ns:
+        return _catalogs[key][1]
+
+    path = pfile_path + CATALOG_EXTENSION
+    catalog = None
+    if os.path.exists(path) and os.stat(path).st_mtime_ns >= mtime_ns:
+        try:
+            catalog = PfileCatalog.load(path)
+        except (ValueError, OSError, KeyError) as e:
+            logging.warning(f'catalog {path} is corrupted and will be rebuilt: {e}')
+    if catalog is None:
+        catalog = PfileCatalog.from_pfile(pfile_path)
+        try:
+            catalog.save(path)
+        except OSError as e:
+            # genotype directories can be read-only, then the catalog is kept only in memory
+            logging.warning(f'catalog {path} can not be saved: {e}')
+    _catalogs[key] = (mtime_ns, catalog)
+    return catalog
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds metadata catalogs of plink 2.0 datasets')
+    parser.add_argument('pfiles', type=str, nargs='+', help='Paths to plink 2.0 datasets without extension')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        stream=sys.stdout,
+                        format='%(asctime)s %(levelname)-8s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+
+    for pfile in args.pfiles:
+        catalog = get_catalog(pfile)
+        logging.info(f'{pfile}: {catalog.variant_count} variants and {catalog.sample_count} samples')
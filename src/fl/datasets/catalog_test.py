@@ -0,0 +1,27 @@
+import os
+import numpy
+import pandas
+from fl.datasets.catalog import PfileCatalog, get_catalog, CATALOG_EXTENSION
+
+
+def _write_pfile(tmp_path) -> str:
+    pfile_path = os.path.join(tmp_path, 'node_0')
+    pandas.DataFrame({'#CHROM': [1, 1, 2, 2], 'POS': [10, 20, 5, 7], 'ID': ['rs1', 'rs2', 'rs3', 'rs4'],
+                      'REF': ['A'] * 4, 'ALT': ['G'] * 4}).to_csv(pfile_path + '.pvar', sep='\t', index=False)
+    pandas.DataFrame({'#IID': [1001, 1002, 1003, 1004, 1005], 'SEX': [1, 2, 1, 2, 1]}).to_csv(pfile_path + '.psam', sep='\t', index=False)
+    return pfile_path
+
+
+def test_PfileCatalog_lookup(tmp_path):
+    pfile_path = _write_pfile(tmp_path)
+    catalog = get_catalog(pfile_path)
+    assert os.path.exists(pfile_path + CATALOG_EXTENSION)
+    assert catalog.variant_count == 4
+    assert numpy.array_equal(catalog.variant_rows(['rs4', 'rs2', 'rs_unknown']), [1, 3])
+    # IIDs from phenotype files are parsed as integers
+    assert numpy.array_equal(catalog.sample_rows(numpy.array([1005, 1001, 7])), [0, 4])
+
+    saved = PfileCatalog.load(pfile_path + CATALOG_EXTENSION)
+    assert numpy.array_equal(saved.variant_ids, catalog.variant_ids)
+    assert numpy.array_equal(saved.variant_pos, [10, 20, 5, 7])
+    assert numpy.array_equal(saved.sample_iids, catalog.sample_iids)
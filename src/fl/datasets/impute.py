@@ -0,0 +1,94 @@
+from typing import Tuple
+import numpy
+import pandas
+
+
+MISSING_GENOTYPE = -9
+
+
+def hardcall_means(array, block_size: int = 4096) -> numpy.ndarray:
+    """Calculates mean genotype of every SNP over non-missing samples, block of columns by block of columns
+
+    Args:
+        array: int8 sample-major genotypes with -9 for missing values or PackedGenotypes with nan for them
+        block_size (int, optional): Number of columns processed at once. Defaults to 4096.
+
+    Returns:
+        numpy.ndarray: float32 means. SNPs without any observed genotype have zero mean.
+    """
+    means = numpy.zeros(array.shape[1], dtype=numpy.float32)
+    for start in range(0, array.shape[1], block_size):
+        block = array[:, start: start + block_size]
+        observed = (block != MISSING_GENOTYPE) & ~numpy.isnan(block)
+        counts = observed.sum(axis=0)
+        sums = block.sum(axis=0, where=observed, dtype=numpy.float64)
+        means[start: start + block.shape[1]] = numpy.divide(sums, counts, out=numpy.zeros(block.shape[1]), where=counts > 0)
+    return means
+
+
+def impute_means_(x: numpy.ndarray, means: numpy.ndarray) -> numpy.ndarray:
+    """Replaces missing genotypes of float block {x} in place with exact means of its SNPs.
+    Missing genotypes are -9 in converted int8 genotypes and nan in unpacked PackedGenotypes.
+
+    Args:
+        x (numpy.ndarray): float sample-major block of genotypes
+        means (numpy.ndarray): Mean genotype of every column of {x}
+
+    Returns:
+        numpy.ndarray: {x} with imputed values
+    """
+    numpy.copyto(x, means.astype(x.dtype, copy=False), where=(x == MISSING_GENOTYPE) | numpy.isnan(x))
+    return x
+
+
+def impute_means(array, means: numpy.ndarray, block_size: int = 4096) -> numpy.ndarray:
+    """Converts genotypes to float32 matrix with missing genotypes replaced by exact means of their SNPs,
+    e.g. for models which take the whole feature matrix. Genotypes are converted block of columns by block of columns.
+
+    Args:
+        array: int8 sample-major genotypes with -9 for missing values or PackedGenotypes with nan for them
+        means (numpy.ndarray): Mean genotype of every SNP
+        block_size (int, optional): Number of columns processed at once. Defaults to 4096.
+
+    Returns:
+        numpy.ndarray: float32 genotypes without missing values
+    """
+    result = numpy.empty(array.shape, dtype=numpy.float32)
+    for start in range(0, array.shape[1], block_size):
+        block = result[:, start: start + block_size]
+        block[:] = array[:, start: start + block_size]
+        impute_means_(block, means[start: start + block.shape[1]])
+    return result
+
+
+def read_allele_counts(acount_path: str, variant_ids: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Reads plink 2.0 --freq counts output. It can be a node-level .acount file
+    or federated one, e.g. aggregated by FederatedPCASimulationRunner.compute_allele_frequencies
+
+    Args:
+        acount_path (str): Path to .acount file with ID, ALT_CTS and OBS_CT columns
+        variant_ids (numpy.ndarray): IDs of loaded SNPs in the order of genotype columns
+
+    Raises:
+        ValueError: If some of {variant_ids} are absent in .acount file
+
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray]: float64 ALT allele counts and observed allele counts of every SNP
+    """
+    acount = pandas.read_table(acount_path, usecols=['ID', 'ALT_CTS', 'OBS_CT'], dtype={'ID': str})
+    rows = pandas.Index(acount.ID.values.astype(numpy.bytes_)).get_indexer(numpy.asarray(variant_ids).astype(numpy.bytes_))
+    if (rows < 0).any():
+        raise ValueError(f'{(rows < 0).sum()} SNPs are absent in allele counts file {acount_path}')
+    return acount.ALT_CTS.values[rows].astype(numpy.float64), acount.OBS_CT.values[rows].astype(numpy.float64)
+
+
+def load_acount_means(acount_path: str, variant_ids: numpy.ndarray) -> numpy.ndarray:
+    """Calculates mean genotypes from plink 2.0 --freq counts output, see read_allele_counts
+
+    Returns:
+        numpy.ndarray: float32 mean genotype of every SNP, i.e. doubled ALT allele frequency
+    """
+    alt_counts, observed = read_allele_counts(acount_path, variant_ids)
+    # genotype is a number of ALT alleles, so its mean is 2 * ALT frequency = ALT_CTS / (OBS_CT / 2)
+    means = numpy.divide(2 * alt_counts, observed, out=numpy.zeros_like(alt_counts), where=observed > 0)
+    return means.astype(numpy.float32)
@@ -0,0 +1,32 @@
+import numpy
+import pandas
+from fl.datasets.impute import hardcall_means, impute_means, load_acount_means
+from fl.datasets.packed import PackedGenotypes
+from fl.datasets.standardize import Standardization
+
+
+def test_impute_means(tmp_path):
+    array = numpy.array([[0, 2, -9, -9],
+                         [1, 2, 0, -9],
+                         [-9, 1, 0, -9],
+                         [2, -9, 1, -9]], dtype=numpy.int8)
+    means = hardcall_means(array, block_size=3)
+    assert numpy.allclose(means, [1.0, 5 / 3, 1 / 3, 0.0])
+    packed = PackedGenotypes.from_hardcalls(array)
+    assert numpy.allclose(hardcall_means(packed, block_size=3), means)
+
+    # ALT allele counts and observed allele counts of plink 2.0 --freq counts
+    observed = (array != -9).sum(axis=0)
+    acount_path = tmp_path / 'ALL.acount'
+    pandas.DataFrame({'#CHROM': 1, 'ID': ['rs1', 'rs2', 'rs3', 'rs4'], 'REF': 'A', 'ALT': 'G',
+                      'ALT_CTS': numpy.where(array != -9, array, 0).sum(axis=0),
+                      'OBS_CT': 2 * observed}).to_csv(acount_path, sep='\t', index=False)
+    acount_means = load_acount_means(acount_path, numpy.array(['rs1', 'rs2', 'rs3', 'rs4']))
+
+    # imputed SNPs keep the mean of observed genotypes instead of the nearest hardcall
+    for imputed in [impute_means(array, acount_means, block_size=3),
+                    impute_means(packed, acount_means, block_size=3),
+                    Standardization.identity(4, acount_means).apply_(array.astype(numpy.float32))]:
+        assert imputed.dtype == numpy.float32
+        assert numpy.allclose(imputed.mean(axis=0), acount_means)
+        assert numpy.allclose(imputed[2, 0], 1.0) and numpy.allclose(imputed[0, 2], 1 / 3)
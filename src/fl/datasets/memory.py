@@ -1,69 +1,262 @@
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple, Union
 import numpy
 import pandas
 from pgenlib import PgenReader
 
+from fl.datasets.cache import GenotypeCache
+from fl.datasets.catalog import get_catalog
+from fl.datasets.packed import PackedGenotypes, pack_hardcalls, packed_width, GENOTYPES_PER_BYTE
+from fl.datasets.tables import read_table
+from fl.datasets.view import resolve_pfile
+from fl.datasets.impute import MISSING_GENOTYPE
 
-def load_from_pgen(pfile_path: str, gwas_path: str, snp_count: int, sample_indices=None, missing='zero') -> numpy.ndarray:
+
+def load_from_pgen(pfile_path: str, gwas_path: str, snp_count: int, sample_indices=None, missing='zero',
+                   cache: Optional[GenotypeCache] = None, packed: bool = False, threads: int = 1,
+                   block_size: int = 4096) -> Union[numpy.ndarray, PackedGenotypes]:
     """
     Loads genotypes from .pgen into numpy array and selects top {snp_count} snps
 
     Args:
-        pfile_path (str): Path to plink 2.0 .pgen, .pvar, .psam dataset. It should not have a .pgen extension.
+        pfile_path (str): Path to plink 2.0 .pgen, .pvar, .psam dataset or its VariantView. It should not have an extension.
         gwas_path (str): Path to plink 2.0 GWAS results file generated by plink 2.0 --glm. 
         snp_count (int): Number of most significant SNPs to load. If None then load all SNPs
         sample_indices (numpy.ndarray): Indices of which samples to load genotypes for. Default of None loads all indices.
-        missing (str): Strategy of filling missing values. Default is 'zero', i.e. homozygous reference value. Other is 'mean'.
+        missing (str): Strategy of filling missing values. Default is 'zero', i.e. homozygous reference value. 
+            Other is 'mean', then missing genotypes are kept as -9 and are replaced with exact SNP means
+            when genotypes are converted to float, see Standardization and impute_means.
+        cache (Optional[GenotypeCache]): If set, decoded genotypes are read from and written to this cache 
+            and a read-only numpy.memmap view is returned.
+        packed (bool): If True, genotypes are returned as PackedGenotypes with four genotypes per byte.
+        threads (int): If greater than 1, blocks of {block_size} variants are decoded in parallel by this number of threads.
+        block_size (int): Number of variants in one block decoded by a thread.
 
     Raises:
         ValueError: If snp_count is greated than number of SNPs in .pgen
 
     Returns:
-        numpy.ndarray: An int8 sample-major array with {snp_count} genotypes
+        Union[numpy.ndarray, PackedGenotypes]: An int8 sample-major array with {snp_count} genotypes or its packed version
     """    
-    reader = PgenReader((pfile_path + '.pgen').encode('utf-8'), sample_subset=sample_indices)
-    max_snp_count = reader.get_variant_ct()
+    _check_missing(missing)
+    if sample_indices is None:
+        # all samples of SampleView
+        sample_indices = resolve_pfile(pfile_path)[2]
+    pfile_path, snp_indices, snp_count = resolve_snp_indices(pfile_path, gwas_path, snp_count)
+
+    if cache is not None:
+        cache_key = cache.key(pfile_path, snp_indices, sample_indices, missing, packed)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return PackedGenotypes(cached, snp_count) if packed else cached
     
     if sample_indices is not None:
         sample_count = len(sample_indices)
-        sample_indices = numpy.arange(sample_count).astype(numpy.uint32)
     else:
-        sample_count = reader.get_raw_sample_ct()
-    
-    if snp_count is not None and snp_count > max_snp_count:
-        raise ValueError(f'snp_count {snp_count} should be not greater than max_snp_count {max_snp_count}')
+        sample_count = get_catalog(pfile_path).sample_count
     
-    snp_count = max_snp_count if snp_count is None else snp_count
     array = -numpy.ones((sample_count, snp_count), dtype=numpy.int8)
     
-    if snp_count is None or snp_count == max_snp_count:
-        reader.read_range(0, max_snp_count, array, sample_maj=True)
+    if threads > 1:
+        def copy_block(start: int, block: numpy.ndarray):
+            array[:, start: start + block.shape[1]] = block
+
+        _read_variant_blocks(pfile_path, sample_indices, snp_indices, snp_count, block_size, threads, copy_block)
     else:
-        snp_indices = get_snp_list(pfile_path, gwas_path, snp_count)
-        reader.read_list(snp_indices, array, sample_maj=True)
+        reader = PgenReader((pfile_path + '.pgen').encode('utf-8'), sample_subset=sample_indices)
+        try:
+            if snp_indices is None:
+                reader.read_range(0, snp_count, array, sample_maj=True)
+            else:
+                reader.read_list(snp_indices, array, sample_maj=True)
+        finally:
+            reader.close()
     if (array == -1).sum() > 0:
         raise ValueError('Not all requested SNPs were found in the genotype file')
+    array = _fill_missing(array, missing)
+
+    if packed:
+        packed_array = pack_hardcalls(array)
+        if cache is not None:
+            packed_array = cache.put(cache_key, packed_array)
+        return PackedGenotypes(packed_array, snp_count)
+    if cache is not None:
+        return cache.put(cache_key, array)
+    return array
+
+
+def _read_variant_blocks(pfile_path: str, sample_indices: Optional[numpy.ndarray], snp_indices: Optional[numpy.ndarray],
+                         snp_count: int, block_size: int, threads: int, consume: Callable[[int, numpy.ndarray], None]):
+    """Decodes consecutive blocks of variants on {threads} threads and passes each int8 sample-major block
+    with its first column index to {consume}. Every thread decodes a contiguous range of blocks with its own PgenReader.
+    pgenlib releases GIL while decoding, so threads run in parallel. {consume} is called from worker threads.
+
+    Args:
+        pfile_path (str): Path to plink 2.0 dataset without .pgen extension
+        sample_indices (Optional[numpy.ndarray]): Sorted indices of samples to decode. None means all samples.
+        snp_indices (Optional[numpy.ndarray]): Indices of variants to decode. None means all variants.
+        snp_count (int): Number of variants to decode
+        block_size (int): Number of variants in one block
+        threads (int): Number of decoding threads
+        consume (Callable[[int, numpy.ndarray], None]): Function which receives the first column index and a block
+    """
+    starts = numpy.arange(0, snp_count, block_size)
+    thread_starts = [chunk for chunk in numpy.array_split(starts, max(1, min(threads, len(starts)))) if len(chunk) > 0]
+
+    def decode(block_starts: numpy.ndarray):
+        reader = PgenReader((pfile_path + '.pgen').encode('utf-8'), sample_subset=sample_indices)
+        sample_count = reader.get_raw_sample_ct() if sample_indices is None else len(sample_indices)
+        buffer = numpy.empty((sample_count, min(block_size, snp_count)), dtype=numpy.int8)
+        try:
+            for start in block_starts:
+                stop = min(start + block_size, snp_count)
+                # pgenlib requires a C-contiguous output array
+                block = buffer if stop - start == buffer.shape[1] else numpy.empty((sample_count, stop - start), dtype=numpy.int8)
+                if snp_indices is None:
+                    reader.read_range(int(start), int(stop), block, sample_maj=True)
+                else:
+                    reader.read_list(snp_indices[start: stop], block, sample_maj=True)
+                consume(int(start), block)
+        finally:
+            reader.close()
+
+    if len(thread_starts) == 1:
+        decode(thread_starts[0])
+        return
+    with ThreadPoolExecutor(max_workers=len(thread_starts)) as executor:
+        # list re-raises exceptions of worker threads
+        list(executor.map(decode, thread_starts))
+
+
+def _check_missing(missing: str):
+    if missing not in ['zero', 'mean']:
+        raise ValueError(f'missing should be one of ["zero", "mean"]')
+
+
+def _fill_missing(array: numpy.ndarray, missing: str) -> numpy.ndarray:
+    """Fills missing genotypes in place for 'zero' strategy. For 'mean' strategy they are kept as -9,
+    since exact means can not be stored in int8 genotypes, and are imputed during conversion to float.
+
+    Args:
+        array (numpy.ndarray): int8 sample-major genotypes with -9 for missing values
+        missing (str): 'zero' or 'mean'
+
+    Returns:
+        numpy.ndarray: {array} with filled values
+    """
     if missing == 'zero':
-        array[array == -9] = 0
-    elif missing == 'mean':
-        array = numpy.where(numpy.isnan(array), numpy.nanmean(array, axis=0), array) 
+        array[array == MISSING_GENOTYPE] = 0
     return array
 
 
+def load_splits_from_pgen(pfile_path: str, gwas_path: str, snp_count: int, split_sample_indices: List[numpy.ndarray], 
+                          missing='zero', cache: Optional[GenotypeCache] = None, block_size: int = 4096,
+                          packed: bool = False, threads: int = 1) -> List[Union[numpy.ndarray, PackedGenotypes]]:
+    """
+    Loads genotypes of several sample splits (e.g. train, val, test) from .pgen in one pass. 
+    SNP list is resolved once, PgenReaders are opened over the union of split samples,
+    and each decoded block of variants is scattered into the split arrays.
+
+    Args:
+        pfile_path (str): Path to plink 2.0 .pgen, .pvar, .psam dataset. It should not have a .pgen extension.
+        gwas_path (str): Path to plink 2.0 GWAS results file generated by plink 2.0 --glm. 
+        snp_count (int): Number of most significant SNPs to load. If None then load all SNPs
+        split_sample_indices (List[numpy.ndarray]): Sorted indices of samples for each split, as returned by get_sample_indices.
+        missing (str): Strategy of filling missing values. Default is 'zero', i.e. homozygous reference value. 
+            Other is 'mean', then missing genotypes are kept as -9 and are replaced with exact SNP means
+            when genotypes are converted to float, see Standardization and impute_means.
+        cache (Optional[GenotypeCache]): If set, decoded genotypes of each split are read from and written to this cache.
+        block_size (int): Number of variants decoded by one read_list call. It bounds the size of the union buffer.
+        packed (bool): If True, each decoded block is packed right away, so int8 genotypes of the whole split 
+            are never held in memory, and PackedGenotypes are returned.
+        threads (int): Number of threads which decode blocks of variants in parallel, each with its own PgenReader.
+
+    Raises:
+        ValueError: If snp_count is greated than number of SNPs in .pgen
+
+    Returns:
+        List[Union[numpy.ndarray, PackedGenotypes]]: An int8 sample-major array with {snp_count} genotypes 
+            or its packed version for each split
+    """    
+    pfile_path, snp_indices, snp_count = resolve_snp_indices(pfile_path, gwas_path, snp_count)
+    return load_snps_from_pgen(pfile_path, snp_indices, snp_count, split_sample_indices, missing=missing, cache=cache,
+                               block_size=block_size, packed=packed, threads=threads)
+
+
+def load_snps_from_pgen(pfile_path: str, snp_indices: Optional[numpy.ndarray], snp_count: int,
+                        split_sample_indices: List[numpy.ndarray], missing='zero', cache: Optional[GenotypeCache] = None,
+                        block_size: int = 4096, packed: bool = False,
+                        threads: int = 1) -> List[Union[numpy.ndarray, PackedGenotypes]]:
+    """load_splits_from_pgen for already resolved variants. Columns follow the order of {snp_indices},
+    which do not have to be sorted, so genotypes are decoded directly into e.g. significance order.
+
+    Args:
+        pfile_path (str): Path to plink 2.0 dataset without .pgen extension, not a view
+        snp_indices (Optional[numpy.ndarray]): Indices of variants in .pgen, None means all variants
+        snp_count (int): Number of variants to load
+        Other arguments are the same as in load_splits_from_pgen
+
+    Returns:
+        List[Union[numpy.ndarray, PackedGenotypes]]: An int8 sample-major array with {snp_count} genotypes
+            or its packed version for each split
+    """
+    _check_missing(missing)
+    if packed and block_size % GENOTYPES_PER_BYTE != 0:
+        raise ValueError(f'block_size should be a multiple of {GENOTYPES_PER_BYTE} for packed genotypes')
+    union_indices = numpy.unique(numpy.concatenate(split_sample_indices)).astype(numpy.uint32)
+
+    if cache is not None:
+        cache_keys = [cache.key(pfile_path, snp_indices, indices, missing, packed) for indices in split_sample_indices]
+        cached = [cache.get(key) for key in cache_keys]
+        if all(array is not None for array in cached):
+            return [PackedGenotypes(array, snp_count) for array in cached] if packed else cached
+
+    # PgenReader returns samples in the increasing order of their indices
+    positions = [numpy.searchsorted(union_indices, indices) for indices in split_sample_indices]
+    if packed:
+        arrays = [numpy.empty((len(indices), packed_width(snp_count)), dtype=numpy.uint8) for indices in split_sample_indices]
+    else:
+        arrays = [-numpy.ones((len(indices), snp_count), dtype=numpy.int8) for indices in split_sample_indices]
+
+    def scatter(start: int, block: numpy.ndarray):
+        # blocks of different threads cover disjoint columns of split arrays
+        for array, position in zip(arrays, positions):
+            split_block = _fill_missing(block[position, :], missing)
+            if packed:
+                packed_start = start // GENOTYPES_PER_BYTE
+                array[:, packed_start: packed_start + packed_width(block.shape[1])] = pack_hardcalls(split_block)
+            else:
+                array[:, start: start + block.shape[1]] = split_block
+
+    _read_variant_blocks(pfile_path, union_indices, snp_indices, snp_count, block_size, threads, scatter)
+
+    if packed:
+        if cache is not None:
+            arrays = [cache.put(key, array) for key, array in zip(cache_keys, arrays)]
+        return [PackedGenotypes(array, snp_count) for array in arrays]
+
+    result = []
+    for i, array in enumerate(arrays):
+        if (array == -1).sum() > 0:
+            raise ValueError('Not all requested SNPs were found in the genotype file')
+        result.append(cache.put(cache_keys[i], array) if cache is not None else array)
+    return result
+
+
 def load_phenotype(phenotype_path: str, out_type = numpy.float32, encode = False) -> numpy.ndarray:
     """
     :param phenotype_path: Phenotypes location
     :param out_type: convert to type
     :param encode: whether phenotypes are strings and we want to code them as ints)
     """
-    data = pandas.read_table(phenotype_path)
+    data = read_table(phenotype_path)
     data = data.iloc[:, -1].values.astype(out_type)
     if encode:
         _, data = numpy.unique(data, return_inverse=True)
     return data
 
 def load_covariates(covariates_path: str, load_pcs: bool = False) -> numpy.ndarray:
-    data = pandas.read_table(covariates_path)
+    data = read_table(covariates_path)
     if load_pcs:
         to_load = [col for col in data.columns if col not in ['FID', 'IID']]        
     else:
@@ -84,21 +277,76 @@ def get_sample_indices(pfile_path: str, phenotype_path: str, indices_limit: Opti
         numpy.ndarray: Array with list of indices required to load samples present in
             the phenotype from the genotype file.
     """
-    psam = pandas.read_table(pfile_path + '.psam').rename(columns={'#IID': 'IID'})
-    pheno = pandas.read_table(phenotype_path)
-    psam['idx'] = numpy.arange(0, psam.shape[0])
-    indices = psam.loc[psam.IID.isin(pheno.IID), 'idx'].values.astype('uint32')
+    pheno = read_table(phenotype_path, usecols=['IID'])
+    pfile_path, _, view_indices = resolve_pfile(pfile_path)
+    indices = get_catalog(pfile_path).sample_rows(pheno.IID.values)
+    if view_indices is not None:
+        # indices always refer to samples of the source dataset
+        indices = indices[numpy.isin(indices, view_indices)]
     if indices_limit is not None and indices_limit < indices.shape[0]:
         # we do not care about random subsample for now
         return indices[:indices_limit]
     else:
         return indices 
 
-def get_snp_list(pfile_path: str, gwas_path: str, snp_count: int) -> numpy.ndarray:
-    pvar = pandas.read_table(pfile_path + '.pvar')
-    gwas = pandas.read_table(gwas_path)
-    gwas.sort_values(by='LOG10_P', axis='index', ascending=False, inplace=True)
-    snp_ids = set(gwas.ID.values[:snp_count])
-    snp_indices = numpy.arange(pvar.shape[0])[pvar.ID.isin(snp_ids)].astype(numpy.uint32)
-    return snp_indices
+def get_ranked_snp_list(pfile_path: str, gwas_path: str, snp_count: int,
+                        view_indices: Optional[numpy.ndarray] = None) -> numpy.ndarray:
+    """Returns .pvar rows of top {snp_count} GWAS SNPs which are present in plink 2.0 dataset {pfile_path}
+    and in {view_indices} if they are set, ordered by decreasing significance.
+    GWAS SNPs absent in the dataset or view are skipped before the top SNPs are taken.
+
+    Raises:
+        ValueError: If less than {snp_count} GWAS SNPs are present
+    """
+    gwas = pandas.read_table(gwas_path, usecols=['ID', 'LOG10_P'])
+    gwas.sort_values(by='LOG10_P', axis='index', ascending=False, inplace=True, kind='stable')
+    rows = get_catalog(pfile_path).lookup_variants(gwas.ID.values)
+    present = rows >= 0 if view_indices is None else numpy.isin(rows, view_indices)
+    rows = rows[present]
+    # an ID repeated in GWAS results keeps its most significant position
+    _, first = numpy.unique(rows, return_index=True)
+    rows = rows[numpy.sort(first)][:snp_count]
+    if rows.shape[0] < snp_count:
+        raise ValueError(f'only {rows.shape[0]} SNPs of {gwas_path} are present in {pfile_path}, {snp_count} are requested')
+    return rows.astype(numpy.uint32)
+
+
+def get_snp_list(pfile_path: str, gwas_path: str, snp_count: int, view_indices: Optional[numpy.ndarray] = None) -> numpy.ndarray:
+    """Returns sorted .pvar rows of top {snp_count} GWAS SNPs present in the dataset and view, like get_ranked_snp_list"""
+    return numpy.sort(get_ranked_snp_list(pfile_path, gwas_path, snp_count, view_indices))
+
+
+def resolve_snp_indices(pfile_path: str, gwas_path: str, snp_count: Optional[int]) -> Tuple[str, Optional[numpy.ndarray], int]:
+    """Resolves top {snp_count} SNPs of plink 2.0 dataset or its VariantView
+
+    Args:
+        pfile_path (str): Path to plink 2.0 dataset or variant view without extension
+        gwas_path (str): Path to plink 2.0 GWAS results
+        snp_count (Optional[int]): Number of most significant SNPs. If None then all SNPs.
+
+    Raises:
+        ValueError: If snp_count is greater than number of SNPs in the dataset or view
+            or than number of GWAS SNPs present in them
+
+    Returns:
+        Tuple[str, Optional[numpy.ndarray], int]: Path to plink 2.0 dataset, sorted indices of SNPs in it
+            or None for all SNPs of the dataset, and number of SNPs
+    """
+    pfile_path, view_indices, _ = resolve_pfile(pfile_path)
+    max_snp_count = get_catalog(pfile_path).variant_count if view_indices is None else len(view_indices)
+    if snp_count is not None and snp_count > max_snp_count:
+        raise ValueError(f'snp_count {snp_count} should be not greater than max_snp_count {max_snp_count}')
+
+    snp_count = max_snp_count if snp_count is None else snp_count
+    if snp_count == max_snp_count:
+        return pfile_path, view_indices, snp_count
+    # SNPs absent in the view are skipped before the top ones are taken, so there are always {snp_count} indices
+    return pfile_path, get_snp_list(pfile_path, gwas_path, snp_count, view_indices), snp_count
+
+
+def get_variant_ids(pfile_path: str, gwas_path: str, snp_count: Optional[int]) -> numpy.ndarray:
+    """Returns IDs of SNPs in the order of genotype columns loaded by load_from_pgen with the same arguments"""
+    pfile_path, snp_indices, _ = resolve_snp_indices(pfile_path, gwas_path, snp_count)
+    variant_ids = get_catalog(pfile_path).variant_ids
+    return variant_ids if snp_indices is None else variant_ids[snp_indices]
     
@@ -0,0 +1,32 @@
+import os
+import numpy
+import pandas
+import pytest
+from fl.datasets.memory import resolve_snp_indices, get_ranked_snp_list
+from fl.datasets.view import VariantView
+
+
+def _write_pfile(pfile_path: str):
+    ids = [f'rs{i}' for i in range(6)]
+    pandas.DataFrame({'#CHROM': [1] * 6, 'POS': numpy.arange(6) * 10, 'ID': ids,
+                      'REF': ['A'] * 6, 'ALT': ['G'] * 6}).to_csv(pfile_path + '.pvar', sep='\t', index=False)
+    pandas.DataFrame({'#IID': [1001, 1002]}).to_csv(pfile_path + '.psam', sep='\t', index=False)
+
+
+def test_resolve_snp_indices_view(tmp_path):
+    pfile_path = os.path.join(tmp_path, 'node_0')
+    _write_pfile(pfile_path)
+    gwas_path = os.path.join(tmp_path, 'gwas.tsv')
+    # the two most significant SNPs are not in the view and rs_unknown is not in the dataset
+    pandas.DataFrame({'ID': ['rs5', 'rs0', 'rs_unknown', 'rs2', 'rs4', 'rs1', 'rs3'],
+                      'LOG10_P': [9.0, 8.0, 7.0, 6.0, 5.0, 4.0, 3.0]}).to_csv(gwas_path, sep='\t', index=False)
+    view_path = os.path.join(tmp_path, 'view')
+    VariantView.from_ids(pfile_path, ['rs1', 'rs2', 'rs3', 'rs4']).save(view_path)
+
+    source, snp_indices, snp_count = resolve_snp_indices(view_path, gwas_path, 3)
+    assert snp_count == 3 and snp_indices.tolist() == [1, 2, 4]
+    assert get_ranked_snp_list(source, gwas_path, 3, VariantView.load(view_path).variant_indices).tolist() == [2, 4, 1]
+    # without the view SNPs absent in the dataset are skipped as well
+    assert resolve_snp_indices(pfile_path, gwas_path, 3)[1].tolist() == [0, 2, 5]
+    with pytest.raises(ValueError):
+        resolve_snp_indices(view_path, gwas_path, 5)
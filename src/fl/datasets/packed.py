@@ -0,0 +1,107 @@
+from typing import Union
+import numpy
+
+
+GENOTYPES_PER_BYTE = 4
+MISSING_CODE = 3
+
+
+def _unpack_table() -> numpy.ndarray:
+    # row b holds four float32 genotypes encoded in byte b, the lowest two bits come first
+    codes = (numpy.arange(256, dtype=numpy.uint8)[:, None] >> numpy.array([0, 2, 4, 6], dtype=numpy.uint8)) & 0b11
+    table = codes.astype(numpy.float32)
+    table[codes == MISSING_CODE] = numpy.nan
+    return table
+
+
+UNPACK_TABLE = _unpack_table()
+
+
+def packed_width(snp_count: int) -> int:
+    return (snp_count + GENOTYPES_PER_BYTE - 1) // GENOTYPES_PER_BYTE
+
+
+def pack_hardcalls(array: numpy.ndarray) -> numpy.ndarray:
+    """Packs int8 hardcall genotypes into 2-bit codes, four genotypes per byte
+
+    Args:
+        array (numpy.ndarray): int8 sample-major array with values 0, 1, 2 or -9 for missing genotypes
+
+    Raises:
+        ValueError: If array has values other than 0, 1, 2 and -9
+
+    Returns:
+        numpy.ndarray: uint8 array of shape (sample_count, ceil(snp_count / 4))
+    """
+    sample_count, snp_count = array.shape
+    codes = numpy.zeros((sample_count, packed_width(snp_count) * GENOTYPES_PER_BYTE), dtype=numpy.uint8)
+    codes[:, :snp_count] = array
+    codes[:, :snp_count][array == -9] = MISSING_CODE
+    if (codes > MISSING_CODE).any():
+        raise ValueError('Only 0, 1, 2 and -9 hardcall genotypes can be packed')
+    codes = codes.reshape(sample_count, -1, GENOTYPES_PER_BYTE)
+    return codes[:, :, 0] | (codes[:, :, 1] << 2) | (codes[:, :, 2] << 4) | (codes[:, :, 3] << 6)
+
+
+class PackedGenotypes:
+    def __init__(self, packed: numpy.ndarray, snp_count: int) -> None:
+        """Sample-major genotype matrix stored as 2-bit codes, four genotypes per byte.
+        It is indexed like a numpy array and returns float32 genotypes unpacked with a lookup table,
+        missing genotypes are returned as nan. It can be used instead of int8 genotypes in XyCovDataset.
+
+        Args:
+            packed (numpy.ndarray): uint8 array of shape (sample_count, ceil(snp_count / 4)) created by pack_hardcalls
+            snp_count (int): Number of genotypes in each row
+        """
+        if packed.shape[1] != packed_width(snp_count):
+            raise ValueError(f'packed array with {packed.shape[1]} bytes per row can not hold {snp_count} SNPs')
+        self.packed = packed
+        self.snp_count = snp_count
+
+    @classmethod
+    def from_hardcalls(cls, array: numpy.ndarray) -> 'PackedGenotypes':
+        return cls(pack_hardcalls(array), array.shape[1])
+
+    @property
+    def shape(self):
+        return self.packed.shape[0], self.snp_count
+
+    @property
+    def dtype(self):
+        return UNPACK_TABLE.dtype
+
+    @property
+    def nbytes(self) -> int:
+        return self.packed.nbytes
+
+    def __len__(self) -> int:
+        return self.packed.shape[0]
+
+    def __getitem__(self, key) -> Union[numpy.ndarray, float]:
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        if isinstance(columns, slice) and columns.step in (None, 1):
+            # only bytes of a contiguous block of columns are unpacked
+            start, stop, _ = columns.indices(self.snp_count)
+            stop = max(start, stop)
+            first_byte = start // GENOTYPES_PER_BYTE
+            unpacked = UNPACK_TABLE[self.packed[rows, first_byte: packed_width(stop)]]
+            unpacked = unpacked.reshape(*unpacked.shape[:-2], -1)
+            offset = start - first_byte * GENOTYPES_PER_BYTE
+            return unpacked[..., offset: offset + stop - start]
+        if isinstance(columns, (list, numpy.ndarray)):
+            # only the codes of selected columns are looked up in bytes which hold them
+            columns = numpy.asarray(columns)
+            columns = numpy.flatnonzero(columns) if columns.dtype == bool else columns % self.snp_count
+            selected = self.packed[rows][..., columns // GENOTYPES_PER_BYTE]
+            return UNPACK_TABLE[selected, columns % GENOTYPES_PER_BYTE]
+        # one table lookup unpacks all bytes of the selected rows at once
+        unpacked = UNPACK_TABLE[self.packed[rows]]
+        unpacked = unpacked.reshape(*unpacked.shape[:-2], -1)[..., :self.snp_count]
+        return unpacked[..., columns]
+
+    def __array__(self, dtype=None) -> numpy.ndarray:
+        array = self[:, :]
+        return array if dtype is None else array.astype(dtype)
+
+    def astype(self, dtype) -> numpy.ndarray:
+        return numpy.asarray(self, dtype=dtype)
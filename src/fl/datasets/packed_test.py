@@ -0,0 +1,18 @@
+import numpy
+from fl.datasets.packed import PackedGenotypes
+
+
+def test_PackedGenotypes_unpack():
+    array = numpy.random.randint(0, 3, size=(7, 10)).astype(numpy.int8)
+    array[3, 9] = -9
+    genotypes = PackedGenotypes.from_hardcalls(array)
+    assert genotypes.shape == (7, 10)
+    assert genotypes.nbytes == 7 * 3
+    expected = array.astype(numpy.float32)
+    expected[3, 9] = numpy.nan
+    assert numpy.array_equal(numpy.asarray(genotypes), expected, equal_nan=True)
+    assert numpy.array_equal(genotypes[2], expected[2])
+    assert numpy.array_equal(genotypes[[5, 0], :], expected[[5, 0], :])
+    assert numpy.array_equal(genotypes[1:4, 2:5], expected[1:4, 2:5])
+    assert numpy.array_equal(genotypes[:, 5:], expected[:, 5:], equal_nan=True)
+    assert numpy.array_equal(genotypes[:, [9, 0, 6]], expected[:, [9, 0, 6]], equal_nan=True)
@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple
+import numpy
+
+from fl.datasets.impute import read_allele_counts, impute_means_
+
+
+@dataclass
+class Standardization:
+    """Per-feature shift and scale which are applied to float32 batches as (x - shift) * scale.
+    It replaces input batch normalization with statistics computed once before training,
+    so batches of every node are normalized identically regardless of their size and composition.
+    If {fill} is set, missing genotypes of the first len(fill) features are replaced with these exact SNP means
+    before shift and scale, since int8 and packed genotypes keep them as missing codes.
+    """
+    shift: numpy.ndarray
+    scale: numpy.ndarray
+    fill: Optional[numpy.ndarray] = None
+
+    @classmethod
+    def from_moments(cls, means: numpy.ndarray, stds: numpy.ndarray, fill: Optional[numpy.ndarray] = None) -> 'Standardization':
+        # monomorphic SNPs and constant covariates have zero std, they are only centered
+        scale = numpy.divide(1.0, stds, out=numpy.ones(stds.shape[0]), where=stds > 0)
+        return cls(numpy.asarray(means, dtype=numpy.float32), scale.astype(numpy.float32), fill)
+
+    @classmethod
+    def identity(cls, feature_count: int, fill: Optional[numpy.ndarray] = None) -> 'Standardization':
+        """Standardization which only imputes missing genotypes with {fill}"""
+        return cls(numpy.zeros(feature_count, dtype=numpy.float32), numpy.ones(feature_count, dtype=numpy.float32), fill)
+
+    def concatenate(self, other: 'Standardization') -> 'Standardization':
+        """Standardization of features which are genotypes followed by covariates"""
+        return Standardization(numpy.concatenate([self.shift, other.shift]), numpy.concatenate([self.scale, other.scale]), self.fill)
+
+    def __len__(self) -> int:
+        return self.shift.shape[0]
+
+    def apply_(self, x: numpy.ndarray) -> numpy.ndarray:
+        """Standardizes float32 batch {x} in place"""
+        if self.fill is not None:
+            impute_means_(x[:, :self.fill.shape[0]], self.fill)
+        x -= self.shift
+        x *= self.scale
+        return x
+
+
+def feature_moments(array, block_size: int = 4096, fill: Optional[numpy.ndarray] = None) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Calculates mean and standard deviation of every column, block of columns by block of columns,
+    so int8 or packed genotypes are never converted to float matrix as a whole
+
+    Args:
+        array: Sample-major matrix, e.g. int8 genotypes, PackedGenotypes or float32 covariates
+        block_size (int, optional): Number of columns processed at once. Defaults to 4096.
+        fill (Optional[numpy.ndarray], optional): Means which replace missing genotypes, see Standardization. Defaults to None.
+
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray]: float64 means and standard deviations
+    """
+    means = numpy.zeros(array.shape[1])
+    stds = numpy.zeros(array.shape[1])
+    for start in range(0, array.shape[1], block_size):
+        block = numpy.asarray(array[:, start: start + block_size], dtype=numpy.float64)
+        if fill is not None:
+            impute_means_(block, fill[start: start + block.shape[1]])
+        means[start: start + block.shape[1]] = block.mean(axis=0)
+        stds[start: start + block.shape[1]] = block.std(axis=0)
+    return means, stds
+
+
+def load_acount_moments(acount_path: str, variant_ids: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Calculates genotype means and standard deviations from plink 2.0 --freq counts output.
+    ALT_CTS and OBS_CT are sufficient statistics which are summed over nodes, therefore federated
+    .acount file gives the same standardization to all nodes. Standard deviation of genotype with
+    ALT frequency p is sqrt(2p(1 - p)) under Hardy-Weinberg equilibrium, as in plink variance standardization.
+
+    Args:
+        acount_path (str): Path to .acount file with ID, ALT_CTS and OBS_CT columns
+        variant_ids (numpy.ndarray): IDs of loaded SNPs in the order of genotype columns
+
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray]: float64 means and standard deviations
+    """
+    alt_counts, observed = read_allele_counts(acount_path, variant_ids)
+    frequencies = numpy.divide(alt_counts, observed, out=numpy.zeros_like(alt_counts), where=observed > 0)
+    return 2 * frequencies, numpy.sqrt(2 * frequencies * (1 - frequencies))
@@ -0,0 +1,23 @@
+import numpy
+import pandas
+from fl.datasets.standardize import Standardization, feature_moments, load_acount_moments
+
+
+def test_Standardization(tmp_path):
+    genotypes = numpy.array([[0, 2, 1],
+                             [1, 2, 0],
+                             [2, 2, 1],
+                             [1, 2, 0]], dtype=numpy.int8)
+    means, stds = feature_moments(genotypes, block_size=2)
+    standardization = Standardization.from_moments(means, stds)
+    x = standardization.apply_(genotypes.astype(numpy.float32))
+    assert numpy.allclose(x.mean(axis=0), 0, atol=1e-6)
+    # monomorphic SNP is only centered
+    assert numpy.allclose(x.std(axis=0), [1, 0, 1], atol=1e-6)
+
+    acount_path = tmp_path / 'ALL.acount'
+    pandas.DataFrame({'#CHROM': [1, 1], 'ID': ['rs1', 'rs2'], 'REF': ['A', 'A'], 'ALT': ['G', 'G'],
+                      'ALT_CTS': [25, 0], 'OBS_CT': [100, 100]}).to_csv(acount_path, sep='\t', index=False)
+    means, stds = load_acount_moments(acount_path, numpy.array(['rs2', 'rs1']))
+    assert numpy.allclose(means, [0, 0.5])
+    assert numpy.allclose(stds, [0, numpy.sqrt(2 * 0.25 * 0.75)])
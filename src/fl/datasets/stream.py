@@ -0,0 +1,64 @@
+from dataclasses import dataclass
+from typing import Iterator, Optional, Tuple
+import numpy
+from pgenlib import PgenReader
+
+from fl.datasets.memory import resolve_snp_indices, _fill_missing
+
+
+@dataclass
+class GenotypeStream:
+    """Genotypes of one split which are decoded from .pgen block by block during training
+    instead of being loaded into memory. It is used in place of genotype matrix in X.
+    """
+    pfile_path: str
+    sample_indices: numpy.ndarray
+    snp_indices: Optional[numpy.ndarray]
+    snp_count: int
+    missing: str = 'zero'
+    block_size: int = 8192
+    prefetch_blocks: int = 1
+
+    @classmethod
+    def from_pgen(cls, pfile_path: str, gwas_path: str, snp_count: Optional[int], sample_indices: numpy.ndarray,
+                  missing: str = 'zero', block_size: int = 8192, prefetch_blocks: int = 1) -> 'GenotypeStream':
+        """Resolves top {snp_count} SNPs like load_from_pgen, but does not decode any genotypes.
+
+        Raises:
+            ValueError: If snp_count is greater than number of SNPs in .pgen
+        """
+        pfile_path, snp_indices, snp_count = resolve_snp_indices(pfile_path, gwas_path, snp_count)
+        return cls(pfile_path, numpy.asarray(sample_indices, dtype=numpy.uint32), snp_indices, snp_count,
+                   missing, block_size, prefetch_blocks)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self.sample_indices), self.snp_count
+
+    def __len__(self) -> int:
+        return len(self.sample_indices)
+
+    def read_blocks(self, positions: numpy.ndarray, block_size: int) -> Iterator[Tuple[numpy.ndarray, numpy.ndarray]]:
+        """Decodes genotypes of consecutive blocks of {positions}
+
+        Args:
+            positions (numpy.ndarray): Positions of samples in {sample_indices} in the order they should be read
+            block_size (int): Number of samples in one block
+
+        Yields:
+            Tuple[numpy.ndarray, numpy.ndarray]: Sorted positions of block samples and their int8 sample-major genotypes
+        """
+        reader = PgenReader((self.pfile_path + '.pgen').encode('utf-8'))
+        try:
+            for start in range(0, len(positions), block_size):
+                # PgenReader requires increasing sample indices and returns samples in this order
+                block_positions = numpy.sort(positions[start: start + block_size])
+                reader.change_sample_subset(self.sample_indices[block_positions])
+                genotypes = numpy.empty((len(block_positions), self.snp_count), dtype=numpy.int8)
+                if self.snp_indices is None:
+                    reader.read_range(0, self.snp_count, genotypes, sample_maj=True)
+                else:
+                    reader.read_list(self.snp_indices, genotypes, sample_maj=True)
+                yield block_positions, _fill_missing(genotypes, self.missing)
+        finally:
+            reader.close()
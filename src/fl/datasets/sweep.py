@@ -0,0 +1,63 @@
+from dataclasses import dataclass
+from typing import List, Union
+import numpy
+
+from fl.datasets.catalog import get_catalog
+from fl.datasets.memory import load_snps_from_pgen, get_ranked_snp_list
+from fl.datasets.packed import PackedGenotypes, packed_width
+from fl.datasets.view import resolve_pfile
+
+
+@dataclass
+class SnpCountSweep:
+    """Genotypes of top {max_snp_count} SNPs of one GWAS ranking with columns ordered by significance.
+    Top-k SNP sets are nested, so genotypes of every smaller snp_count are the first columns of the same arrays
+    and are served as views without copying or reading .pgen again.
+    Like resolve_snp_indices, top SNPs are taken among GWAS SNPs present in the dataset.
+    """
+    parts: List[Union[numpy.ndarray, PackedGenotypes]]
+    variant_ids: numpy.ndarray
+    max_snp_count: int
+
+    def column_count(self, snp_count: int) -> int:
+        """Number of genotype columns of top {snp_count} SNPs"""
+        if snp_count > self.max_snp_count:
+            raise ValueError(f'snp_count {snp_count} should be not greater than max snp_count {self.max_snp_count} of the sweep')
+        return snp_count
+
+    def top(self, snp_count: int) -> List[Union[numpy.ndarray, PackedGenotypes]]:
+        """Returns train, val and test genotypes of top {snp_count} SNPs as views of the sweep arrays"""
+        count = self.column_count(snp_count)
+        result = []
+        for part in self.parts:
+            if isinstance(part, PackedGenotypes):
+                # codes of the extra SNPs in the last byte are cut off during unpacking
+                result.append(PackedGenotypes(part.packed[:, :packed_width(count)], count))
+            else:
+                result.append(part[:, :count])
+        return result
+
+    def top_variant_ids(self, snp_count: int) -> numpy.ndarray:
+        return self.variant_ids[:self.column_count(snp_count)]
+
+    @classmethod
+    def from_pgen(cls, pfile_path: str, gwas_path: str, max_snp_count: int, split_sample_indices: List[numpy.ndarray],
+                  packed: bool = False, **kwargs) -> 'SnpCountSweep':
+        """Loads genotypes of top {max_snp_count} SNPs once. Variants are decoded in the order of significance,
+        so every block of columns is written (or packed) straight into its place and genotypes are never reordered.
+
+        Args:
+            pfile_path (str): Path to plink 2.0 dataset or its VariantView without extension
+            gwas_path (str): Path to plink 2.0 GWAS results with LOG10_P values
+            max_snp_count (int): The largest snp_count of the sweep
+            split_sample_indices (List[numpy.ndarray]): Sample indices of train, val and test
+            packed (bool, optional): Whether to pack genotypes block by block. Defaults to False.
+            **kwargs: Other arguments of load_snps_from_pgen
+
+        Returns:
+            SnpCountSweep: Genotypes of the sweep
+        """
+        source, view_indices, _ = resolve_pfile(pfile_path)
+        rows = get_ranked_snp_list(source, gwas_path, max_snp_count, view_indices)
+        parts = load_snps_from_pgen(source, rows, max_snp_count, split_sample_indices, packed=packed, **kwargs)
+        return cls(parts, get_catalog(source).variant_ids[rows], max_snp_count)
@@ -0,0 +1,46 @@
+import os
+import numpy
+import pandas
+from pgenlib import PgenWriter
+from fl.datasets.packed import PackedGenotypes
+from fl.datasets.sweep import SnpCountSweep
+
+
+def test_SnpCountSweep_top():
+    genotypes = numpy.random.randint(0, 3, size=(5, 9)).astype(numpy.int8)
+    ids = numpy.array([f'rs{rank}' for rank in range(9)]).astype(numpy.bytes_)
+    sweep = SnpCountSweep([genotypes], ids, max_snp_count=9)
+    packed_sweep = SnpCountSweep([PackedGenotypes.from_hardcalls(genotypes)], ids, max_snp_count=9)
+
+    top = sweep.top(4)[0]
+    assert numpy.shares_memory(top, genotypes)
+    assert numpy.array_equal(top, genotypes[:, :4])
+    assert numpy.array_equal(sweep.top_variant_ids(3), [b'rs0', b'rs1', b'rs2'])
+    for snp_count in range(1, 10):
+        assert numpy.array_equal(packed_sweep.top(snp_count)[0][:, :], sweep.top(snp_count)[0])
+
+
+def test_SnpCountSweep_from_pgen(tmp_path):
+    pfile_path = os.path.join(tmp_path, 'node_0')
+    genotypes = numpy.random.randint(0, 3, size=(6, 10)).astype(numpy.int8)
+    genotypes[0, 3] = -9
+    writer = PgenWriter((pfile_path + '.pgen').encode('utf-8'), 6, 10, False)
+    for variant in genotypes.T:
+        writer.append_biallelic(numpy.ascontiguousarray(variant))
+    writer.close()
+    ids = [f'rs{i}' for i in range(10)]
+    pandas.DataFrame({'#CHROM': [1] * 10, 'POS': numpy.arange(10) * 10, 'ID': ids,
+                      'REF': ['A'] * 10, 'ALT': ['G'] * 10}).to_csv(pfile_path + '.pvar', sep='\t', index=False)
+    pandas.DataFrame({'#IID': numpy.arange(6) + 1001}).to_csv(pfile_path + '.psam', sep='\t', index=False)
+    gwas_path = os.path.join(tmp_path, 'gwas.tsv')
+    pandas.DataFrame({'ID': ['rs7', 'rs3', 'rs9', 'rs0', 'rs5'],
+                      'LOG10_P': [9.0, 8.0, 7.0, 6.0, 5.0]}).to_csv(gwas_path, sep='\t', index=False)
+
+    splits = [numpy.array([0, 2, 5], dtype=numpy.uint32), numpy.array([1, 3, 4], dtype=numpy.uint32)]
+    sweep = SnpCountSweep.from_pgen(pfile_path, gwas_path, 4, splits, missing='mean')
+    packed_sweep = SnpCountSweep.from_pgen(pfile_path, gwas_path, 4, splits, packed=True, missing='mean', block_size=4)
+    assert sweep.top_variant_ids(4).tolist() == [b'rs7', b'rs3', b'rs9', b'rs0']
+    for part, packed_part, samples in zip(sweep.parts, packed_sweep.parts, splits):
+        # columns are decoded in the order of significance and missing genotypes stay -9
+        assert numpy.array_equal(part, genotypes[samples][:, [7, 3, 9, 0]])
+        assert numpy.array_equal(packed_part[:, :], numpy.where(part == -9, numpy.nan, part), equal_nan=True)
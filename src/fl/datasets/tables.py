@@ -0,0 +1,93 @@
+import logging
+import os
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+import numpy
+import pandas
+
+
+TABLE_CACHE_EXTENSION = '.table.npz'
+
+
+def atomic_save(path: str, write: Callable[[BinaryIO], None]):
+    """Writes file {path} with {write} function, which receives a binary file object, e.g. numpy.save or numpy.savez.
+    Several node processes can build the same table cache, catalog, view or cached genotypes simultaneously
+    and read them meanwhile, so the file is written to a temporary file of the process first
+    and atomically moved into place. Readers see either the previous file or the complete new one.
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as file:
+            write(file)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _columns_to_arrays(frame: pandas.DataFrame) -> Optional[Dict[str, numpy.ndarray]]:
+    arrays = {'columns': frame.columns.to_numpy(dtype=str)}
+    for i, column in enumerate(frame.columns):
+        values = frame[column]
+        if not pandas.api.types.is_numeric_dtype(values.dtype) and not pandas.api.types.is_bool_dtype(values.dtype):
+            # only string columns are stored as fixed width unicode, mixed columns can not be saved without pickle
+            if pandas.api.types.infer_dtype(values, skipna=False) != 'string':
+                return None
+            arrays[f'column_{i}'] = values.to_numpy(dtype=str)
+        else:
+            arrays[f'column_{i}'] = values.to_numpy()
+    return arrays
+
+
+def _save_table(frame: pandas.DataFrame, path: str) -> bool:
+    arrays = _columns_to_arrays(frame)
+    if arrays is None:
+        return False
+    atomic_save(path, lambda file: numpy.savez(file, **arrays))
+    return True
+
+
+def _load_table(path: str) -> pandas.DataFrame:
+    with numpy.load(path) as data:
+        columns = data['columns']
+        return pandas.DataFrame({column: data[f'column_{i}'] for i, column in enumerate(columns)}, columns=list(columns))
+
+
+_tables: Dict[str, Tuple[int, pandas.DataFrame]] = {}
+
+
+def read_table(table_path: str, usecols: Optional[List[str]] = None) -> pandas.DataFrame:
+    """Reads tab-separated table with header, e.g. phenotypes, covariates, sample weights or plink PCs.
+    It is parsed from text only once and stored next to it as {table_path}.table.npz with one array per column,
+    which is rebuilt if the table is newer. Tables are also kept in memory, so they are read from disk
+    once per process even if several loaders need them.
+
+    Args:
+        table_path (str): Path to tab-separated table
+        usecols (Optional[List[str]], optional): Columns to return. Defaults to None, i.e. all columns.
+
+    Returns:
+        pandas.DataFrame: Table with columns in file order, or {usecols} order if they are set
+    """
+    mtime_ns = os.stat(table_path).st_mtime_ns
+    key = os.path.realpath(table_path)
+    if key not in _tables or _tables[key][0] != mtime_ns:
+        path = table_path + TABLE_CACHE_EXTENSION
+        table = None
+        if os.path.exists(path) and os.stat(path).st_mtime_ns >= mtime_ns:
+            try:
+                table = _load_table(path)
+            except (ValueError, OSError, KeyError) as e:
+                logging.warning(f'table cache {path} is corrupted and will be rebuilt: {e}')
+        if table is None:
+            table = pandas.read_table(table_path)
+            try:
+                if not _save_table(table, path):
+                    logging.info(f'table {table_path} has mixed type columns and is cached only in memory')
+            except OSError as e:
+                # phenotype directories can be read-only, then the table is kept only in memory
+                logging.warning(f'table cache {path} can not be saved: {e}')
+        _tables[key] = (mtime_ns, table)
+
+    table = _tables[key][1]
+    # callers rename, reindex and sort tables, so they get a shallow copy of the cached one
+    return table.loc[:, usecols] if usecols is not None else table.copy(deep=False)
@@ -0,0 +1,41 @@
+import os
+import numpy
+import pandas
+import pytest
+from fl.datasets.tables import atomic_save, read_table, TABLE_CACHE_EXTENSION
+
+
+def test_read_table(tmp_path):
+    table_path = os.path.join(tmp_path, 'fold_0_train.tsv')
+    pandas.DataFrame({'FID': [1, 2, 3], 'IID': [1, 2, 3], 'ancestry': ['AFR', 'EUR', 'EUR'],
+                      'height': [1.5, 1.7, 1.8]}).to_csv(table_path, sep='\t', index=False)
+    table = read_table(table_path)
+    assert os.path.exists(table_path + TABLE_CACHE_EXTENSION)
+    # renaming a returned table does not change the cached one
+    table.rename(columns={'IID': 'ID'}, inplace=True)
+
+    cached = read_table(table_path)
+    assert list(cached.columns) == ['FID', 'IID', 'ancestry', 'height']
+    assert cached.IID.dtype == numpy.int64
+    assert numpy.array_equal(read_table(table_path, usecols=['ancestry']).ancestry.values, ['AFR', 'EUR', 'EUR'])
+
+    # table is parsed again when the file is updated
+    pandas.DataFrame({'IID': [4], 'height': [1.6]}).to_csv(table_path, sep='\t', index=False)
+    os.utime(table_path, ns=(os.stat(table_path).st_atime_ns, os.stat(table_path + TABLE_CACHE_EXTENSION).st_mtime_ns + 10**9))
+    assert list(read_table(table_path).columns) == ['IID', 'height']
+
+
+def test_atomic_save(tmp_path):
+    path = os.path.join(tmp_path, 'arrays.npz')
+    atomic_save(path, lambda file: numpy.savez(file, values=numpy.arange(3)))
+
+    def fail(file):
+        file.write(b'partial')
+        raise OSError('disk is full')
+
+    # a failed write keeps the previous file and removes the temporary one
+    with pytest.raises(OSError):
+        atomic_save(path, fail)
+    assert os.listdir(tmp_path) == ['arrays.npz']
+    with numpy.load(path) as data:
+        assert numpy.array_equal(data['values'], numpy.arange(3))
@@ -0,0 +1,180 @@
+import argparse
+import logging
+import os
+import sys
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy
+
+from fl.datasets.catalog import get_catalog
+from fl.datasets.tables import atomic_save
+
+
+VIEW_EXTENSION = '.view.npz'
+SAMPLE_VIEW_EXTENSION = '.samples.npz'
+KEEP_EXTENSION = '.keep'
+
+
+def _save_manifest(path: str, pfile_path: str, **arrays):
+    # source path is stored relative to the manifest, so a split directory can be moved as a whole
+    source = os.path.relpath(pfile_path, os.path.dirname(os.path.abspath(path)))
+    atomic_save(path, lambda file: numpy.savez(file, pfile_path=numpy.array(source), **arrays))
+
+
+def _load_manifest(path: str, names: List[str]) -> Tuple[str, Dict[str, numpy.ndarray]]:
+    with numpy.load(path) as data:
+        source = os.path.join(os.path.dirname(os.path.abspath(path)), str(data['pfile_path']))
+        return os.path.normpath(source), {name: data[name] for name in names}
+
+
+@dataclass
+class VariantView:
+    """Subset of variants of plink 2.0 dataset, e.g. top SNPs by GWAS, which is stored as a small manifest
+    with variant indices into the source dataset instead of a copy of genotypes made by plink --extract.
+    Its path without extension can be used in place of a plink 2.0 dataset path by genotype loaders.
+    The source can be a SampleView, then variant indices refer to the dataset of that view.
+    """
+    pfile_path: str
+    variant_indices: numpy.ndarray
+    variant_ids: numpy.ndarray
+
+    def __len__(self) -> int:
+        return self.variant_indices.shape[0]
+
+    @classmethod
+    def from_ids(cls, pfile_path: str, variant_ids: Iterable) -> 'VariantView':
+        """Creates a view of variants with {variant_ids}, unknown IDs are skipped like in plink --extract"""
+        catalog = get_catalog(resolve_pfile(pfile_path)[0])
+        indices = catalog.variant_rows(variant_ids)
+        return cls(pfile_path, indices, catalog.variant_ids[indices])
+
+    def save(self, view_path: str):
+        _save_manifest(view_path + VIEW_EXTENSION, self.pfile_path,
+                       variant_indices=self.variant_indices, variant_ids=self.variant_ids)
+
+    @classmethod
+    def load(cls, view_path: str) -> 'VariantView':
+        """Loads a view and checks that variants of the source dataset are still at the stored indices
+
+        Raises:
+            ValueError: If the source dataset was changed after the view was created
+        """
+        source, data = _load_manifest(view_path + VIEW_EXTENSION, ['variant_indices', 'variant_ids'])
+        view = cls(source, data['variant_indices'], data['variant_ids'])
+        catalog = get_catalog(resolve_pfile(source)[0])
+        if len(view) > 0 and (view.variant_indices[-1] >= catalog.variant_count or
+                              not numpy.array_equal(catalog.variant_ids[view.variant_indices], view.variant_ids)):
+            raise ValueError(f'variants of {view.pfile_path} do not match view {view_path}{VIEW_EXTENSION}, it should be recreated')
+        return view
+
+
+@dataclass
+class SampleView:
+    """Subset of samples of plink 2.0 dataset, e.g. train, val or test part of a fold of a node,
+    which is stored as a manifest with sample indices into the source dataset instead of a copy made by plink --keep.
+    Genotype loaders read only these samples of the source, plink gets the source with --keep file of the view.
+    """
+    pfile_path: str
+    sample_indices: numpy.ndarray
+    sample_iids: numpy.ndarray
+
+    def __len__(self) -> int:
+        return self.sample_indices.shape[0]
+
+    @classmethod
+    def from_iids(cls, pfile_path: str, sample_iids: Iterable) -> 'SampleView':
+        """Creates a view of samples with {sample_iids}, unknown IIDs are skipped like in plink --keep"""
+        catalog = get_catalog(pfile_path)
+        indices = catalog.sample_rows(sample_iids)
+        return cls(pfile_path, indices, catalog.sample_iids[indices])
+
+    def save(self, view_path: str):
+        _save_manifest(view_path + SAMPLE_VIEW_EXTENSION, self.pfile_path,
+                       sample_indices=self.sample_indices, sample_iids=self.sample_iids)
+        with open(view_path + KEEP_EXTENSION, 'w') as file:
+            file.write('\n'.join(['#IID'] + [iid.decode('utf-8') for iid in self.sample_iids]) + '\n')
+
+    @classmethod
+    def load(cls, view_path: str) -> 'SampleView':
+        """Loads a view and checks that samples of the source dataset are still at the stored indices
+
+        Raises:
+            ValueError: If the source dataset was changed after the view was created
+        """
+        source, data = _load_manifest(view_path + SAMPLE_VIEW_EXTENSION, ['sample_indices', 'sample_iids'])
+        view = cls(source, data['sample_indices'], data['sample_iids'])
+        catalog = get_catalog(source)
+        if len(view) > 0 and (view.sample_indices[-1] >= catalog.sample_count or
+                              not numpy.array_equal(catalog.sample_iids[view.sample_indices], view.sample_iids)):
+            raise ValueError(f'samples of {view.pfile_path} do not match view {view_path}{SAMPLE_VIEW_EXTENSION}, it should be recreated')
+        return view
+
+
+def is_variant_view(pfile_path: str) -> bool:
+    return os.path.exists(pfile_path + VIEW_EXTENSION)
+
+
+def is_sample_view(pfile_path: str) -> bool:
+    return os.path.exists(pfile_path + SAMPLE_VIEW_EXTENSION)
+
+
+def resolve_pfile(pfile_path: str) -> Tuple[str, Optional[numpy.ndarray], Optional[numpy.ndarray]]:
+    """Resolves {pfile_path}, which is either a plink 2.0 dataset, its SampleView, its VariantView
+    or a VariantView of a SampleView
+
+    Returns:
+        Tuple[str, Optional[numpy.ndarray], Optional[numpy.ndarray]]: Path to plink 2.0 dataset, sorted indices
+            of view variants and sorted indices of view samples in it. Indices are None if they are not restricted.
+    """
+    variant_indices, sample_indices = None, None
+    if is_variant_view(pfile_path):
+        view = VariantView.load(pfile_path)
+        pfile_path, variant_indices = view.pfile_path, view.variant_indices
+    if is_sample_view(pfile_path):
+        view = SampleView.load(pfile_path)
+        pfile_path, sample_indices = view.pfile_path, view.sample_indices
+    return pfile_path, variant_indices, sample_indices
+
+
+def get_variant_count(pfile_path: str) -> int:
+    """Returns number of variants in plink 2.0 dataset or its view"""
+    source, variant_indices, _ = resolve_pfile(pfile_path)
+    return get_catalog(source).variant_count if variant_indices is None else len(variant_indices)
+
+
+def get_sample_count(pfile_path: str) -> int:
+    """Returns number of samples in plink 2.0 dataset or its view"""
+    source, _, sample_indices = resolve_pfile(pfile_path)
+    return get_catalog(source).sample_count if sample_indices is None else len(sample_indices)
+
+
+def plink_pfile_args(pfile_path: str) -> List[str]:
+    """Returns plink 2.0 arguments which select {pfile_path}: --pfile of the source dataset and --keep file of SampleView
+
+    Raises:
+        ValueError: If {pfile_path} is a VariantView, since plink can not read variant indices
+    """
+    if is_variant_view(pfile_path):
+        raise ValueError(f'variant view {pfile_path} can not be passed to plink, use --extract with its variant IDs')
+    if is_sample_view(pfile_path):
+        return ['--pfile', SampleView.load(pfile_path).pfile_path, '--keep', pfile_path + KEEP_EXTENSION]
+    return ['--pfile', pfile_path]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes a variant view of plink 2.0 dataset instead of plink --extract --make-pgen')
+    parser.add_argument('--pfile', type=str, required=True, help='Path to source plink 2.0 dataset or its sample view without extension')
+    parser.add_argument('--extract', type=str, required=True, help='File with variant IDs, one per line')
+    parser.add_argument('--out', type=str, required=True, help=f'Path of the view without {VIEW_EXTENSION} extension')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        stream=sys.stdout,
+                        format='%(asctime)s %(levelname)-8s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+
+    with open(args.extract) as file:
+        ids = [line.strip() for line in file if line.strip()]
+    view = VariantView.from_ids(args.pfile, ids)
+    view.save(args.out)
+    logging.info(f'{args.out}{VIEW_EXTENSION}: {len(view)} of {len(ids)} variants of {args.pfile}')
@@ -0,0 +1,50 @@
+import os
+import numpy
+import pandas
+import pytest
+from fl.datasets.view import VariantView, SampleView, resolve_pfile, get_variant_count, get_sample_count, plink_pfile_args
+
+
+def _write_pfile(pfile_path: str) -> pandas.DataFrame:
+    pvar = pandas.DataFrame({'#CHROM': [1, 1, 2, 2], 'POS': [10, 20, 5, 7], 'ID': ['rs1', 'rs2', 'rs3', 'rs4'],
+                             'REF': ['A'] * 4, 'ALT': ['G'] * 4})
+    pvar.to_csv(pfile_path + '.pvar', sep='\t', index=False)
+    pandas.DataFrame({'#IID': [1001, 1002, 1003], 'SEX': [1, 2, 1]}).to_csv(pfile_path + '.psam', sep='\t', index=False)
+    return pvar
+
+
+def test_VariantView(tmp_path):
+    pfile_path = os.path.join(tmp_path, 'fold_0_train')
+    pvar = _write_pfile(pfile_path)
+
+    os.makedirs(os.path.join(tmp_path, 'union'))
+    view_path = os.path.join(tmp_path, 'union', 'top_2_train')
+    VariantView.from_ids(pfile_path, ['rs4', 'rs2', 'rs_unknown']).save(view_path)
+    source, indices, sample_indices = resolve_pfile(view_path)
+    assert os.path.samefile(source + '.pvar', pfile_path + '.pvar')
+    assert numpy.array_equal(indices, [1, 3]) and sample_indices is None
+    assert get_variant_count(view_path) == 2
+    assert resolve_pfile(pfile_path) == (pfile_path, None, None)
+
+    # view is stale if variants of the source dataset were reordered
+    pvar.iloc[::-1].to_csv(pfile_path + '.pvar', sep='\t', index=False)
+    os.utime(pfile_path + '.pvar', ns=(0, os.stat(pfile_path + '.pvar').st_mtime_ns + 10**9))
+    with pytest.raises(ValueError):
+        VariantView.load(view_path)
+
+
+def test_SampleView(tmp_path):
+    pfile_path = os.path.join(tmp_path, 'node_0_filtered')
+    _write_pfile(pfile_path)
+    fold_path = os.path.join(tmp_path, 'fold_0_val')
+    SampleView.from_iids(pfile_path, [1003, 1001, 7]).save(fold_path)
+    assert resolve_pfile(fold_path)[2].tolist() == [0, 2]
+    assert get_sample_count(fold_path) == 2
+    assert plink_pfile_args(fold_path)[-1] == fold_path + '.keep'
+
+    # top SNPs of a fold part are a variant view of its sample view
+    top_path = os.path.join(tmp_path, 'top_1_val')
+    VariantView.from_ids(fold_path, ['rs3']).save(top_path)
+    source, variant_indices, sample_indices = resolve_pfile(top_path)
+    assert os.path.samefile(source + '.pvar', pfile_path + '.pvar')
+    assert variant_indices.tolist() == [2] and sample_indices.tolist() == [0, 2]
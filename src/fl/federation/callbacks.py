@@ -12,6 +12,7 @@ from flwr.common import Weights, Scalar
 from fl.federation.utils import ModuleParams, weights_to_bytes
 from nn.models import BaseNet
 from utils.landscape import mse_on_beta_grid, add_beta_to_loss_landscape
+from nn.metrics_sink import get_metrics_sink
 
 
 class ClientCallback:
@@ -126,9 +127,9 @@ class ScaffoldCallback(Callback):
                 v.grad.data += self.grad_lr * (self.c_global[name].to(v.grad.data.device) - self.c_local[name].to(v.grad.data.device))
                 global_fl_step = trainer.max_steps*pl_module.fl_current_epoch()+trainer.global_step
                 if global_fl_step % 10 == 0 and self.log_grad:
-                    mlflow.log_metric(f'{name}.grad.l2', v.grad.data.norm().detach().item(), global_fl_step)
+                    get_metrics_sink().log_metric(f'{name}.grad.l2', v.grad.data.norm().detach(), global_fl_step)
                 if trainer.global_step == 0 and self.log_diff:
-                    mlflow.log_metric(f'{name}.c_diff.l2', (self.c_local[name] - self.c_global[name]).norm().item(), global_fl_step)
+                    get_metrics_sink().log_metric(f'{name}.c_diff.l2', (self.c_local[name] - self.c_global[name]).norm(), global_fl_step)
 
 
     def update_c_local(
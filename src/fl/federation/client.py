@@ -19,10 +19,12 @@ from flwr.common import Weights, parameters_to_weights
 from nn.models import BaseNet, LinearRegressor, MLPClassifier, MLPPredictor, LassoNetRegressor, LassoNetClassifier
 from nn.lightning import DataModule
 from fl.federation.callbacks import ClientCallback, ScaffoldCallback
+from fl.federation.trainer import ClientTrainer
 from fl.federation.utils import weights_to_module_params, bytes_to_weights
 from configs.phenotype_config import PHENO_TYPE_DICT, TYPE_LOSS_DICT
 from nn.metrics import ModelMetrics
 from local.experiment import LocalExperiment
+from nn.metrics_sink import get_metrics_sink
 
 
 class CallbackFactory:
@@ -54,14 +56,13 @@ class MetricsLogger(ABC):
 class MLFlowMetricsLogger(MetricsLogger):
     def log_eval_metric(self, metric: ModelMetrics):
         mm_dict = metric.to_dict()
-        mlflow.log_metrics(mm_dict, metric.epoch)
+        get_metrics_sink().log_metrics(mm_dict, metric.epoch)
 
     def log_weights(self, rnd: int, layers: List[str], old_weights: Weights, new_weights: Weights):
         # logging.info(f'weights shape: {[w.shape for w in new_weights]}')
 
-        client_diffs = {layer: numpy.linalg.norm(cw - aw).item() for layer, cw, aw in zip(layers, old_weights, new_weights)}
-        for layer, diff in client_diffs.items():
-            mlflow.log_metric(f'{layer}.l2', diff, rnd)
+        client_diffs = {f'{layer}.l2': numpy.linalg.norm(cw - aw).item() for layer, cw, aw in zip(layers, old_weights, new_weights)}
+        get_metrics_sink().log_metrics(client_diffs, rnd)
 
 
 class FLClient(NumPyClient):
@@ -84,6 +85,9 @@ class FLClient(NumPyClient):
         self.logger = logger
         self.metrics_logger = metrics_logger
         self.client_callbacks = callbacks
+        # lightning creates Trainer every round, persistent loop keeps optimizer, scheduler and train iterator between rounds
+        self.fit_loop = params.get('fit_loop', 'lightning')
+        self.client_trainer = None
         self.log(f'cuda device count: {torch.cuda.device_count()}')
 
     def log(self, msg):
@@ -117,6 +121,13 @@ class FLClient(NumPyClient):
                     new_params=weights_to_module_params(self._get_layer_names(), kwargs['new_params'])
                 )
 
+    def _get_client_trainer(self) -> ClientTrainer:
+        # optimizer of the trainer refers to parameters of the model, so the trainer is recreated with the model
+        if self.client_trainer is None or self.client_trainer.model is not self.experiment.model:
+            self.client_trainer = ClientTrainer(self.experiment.model, self.experiment.data_module,
+                                                callbacks=self.callbacks, **self.params.training)
+        return self.client_trainer
+
     def _reseed_torch(self):
         torch.manual_seed(hash(self.params.node.index) + self.experiment.model.current_round)
 
@@ -153,9 +164,11 @@ class FLClient(NumPyClient):
         self.experiment.model.current_round = config['current_round']
         # because train_dataloader will get the same seed and return the same permutation of training samples each federated round
         self._reseed_torch()
-        trainer = Trainer(logger=False, **{**self.params.training, **{'callbacks': self.callbacks}})
-            
-        trainer.fit(self.experiment.model, datamodule=self.experiment.data_module)
+        if self.fit_loop == 'lightning':
+            trainer = Trainer(logger=False, **{**self.params.training, **{'callbacks': self.callbacks}})
+            trainer.fit(self.experiment.model, datamodule=self.experiment.data_module)
+        else:
+            self._get_client_trainer().fit()
         end = time()
         self.log(f'node: {self.params.node.index}\tfit elapsed: {end-start:.2f}s')
         new_params = self.get_parameters()
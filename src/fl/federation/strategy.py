@@ -30,6 +30,7 @@ from fl.federation.utils import weights_to_bytes, bytes_to_weights
 #from nn.utils import ClfFederatedMetrics, ClfMetrics, LassoNetRegMetrics, Metrics, RegFederatedMetrics
 from nn.metrics import FederatedMetrics, ModelMetrics
 from utils.landscape import add_beta_to_loss_landscape
+from nn.metrics_sink import get_metrics_sink
 
 
 def fit_round(rnd: int):
@@ -71,7 +72,7 @@ class MlflowLogger(StrategyLogger):
         # logging.info(avg_metrics)
         logging.info(f'round {rnd}\t' + str(metrics))
         mm_dict = metrics.to_dict()
-        mlflow.log_metrics(mm_dict, metrics.epoch)
+        get_metrics_sink().log_metrics(mm_dict, metrics.epoch)
 
     def log_weights(self, rnd: int, layers: List[str], weights: List[Weights], aggregated_weights: Weights) -> None:
         pass
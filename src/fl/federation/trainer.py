@@ -0,0 +1,178 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+import torch
+from pytorch_lightning import Callback
+
+from nn.models import BaseNet
+from nn.lightning import DataModule
+
+
+# Trainer arguments which do not change training, everything else of training config requires fit_loop=lightning
+IGNORED_TRAINER_ARGS = {'enable_progress_bar', 'enable_model_summary', 'enable_checkpointing', 'num_sanity_val_steps'}
+
+
+def _device_ids(devices: Union[int, str, List[int]]) -> List[int]:
+    # the same formats as devices of Lightning Trainer: number of devices, "0,1" string or list of device indices
+    if isinstance(devices, str):
+        devices = [int(d) for d in devices.split(',') if d.strip()] if ',' in devices else int(devices)
+    if isinstance(devices, int):
+        return list(range(devices))
+    return [int(d) for d in devices]
+
+
+def resolve_device(accelerator: str, devices: Union[int, str, List[int]]) -> torch.device:
+    """Returns the device of ClientTrainer for {accelerator} and {devices} of Lightning Trainer
+
+    Raises:
+        ValueError: If more than one GPU is requested, since ClientTrainer trains on one device
+    """
+    if accelerator == 'cpu' or (accelerator == 'auto' and not torch.cuda.is_available()):
+        return torch.device('cpu')
+    ids = _device_ids(devices)
+    if len(ids) > 1:
+        raise ValueError(f'ClientTrainer trains on one device, but devices {devices} are requested, use fit_loop=lightning for them')
+    return torch.device('cuda', ids[0] if ids else 0)
+
+
+class ClientTrainer:
+    """Trains a model of FL client for max_epochs or max_steps every round without Lightning Trainer.
+    Optimizer, learning rate scheduler, dataloaders and train iterator are created once and kept between rounds,
+    so a round does not pay for Trainer setup, configure_optimizers and new dataloaders. If a round stops after
+    max_steps in the middle of an epoch, the next round continues the same pass over the train samples.
+
+    Model hooks used by the models of this repository are called in the order of Lightning fit loop.
+    Callbacks get ClientTrainer in place of Trainer, it has max_steps, global_step and current_epoch attributes.
+    Unlike a new Trainer every round, optimizer state, e.g. momentum or AdamW moments, is carried over between rounds.
+    """
+    def __init__(self, model: BaseNet, datamodule: DataModule, max_epochs: int = 1, max_steps: int = -1,
+                 check_val_every_n_epoch: int = 1, accelerator: str = 'cpu', devices: Union[int, str, List[int]] = 1,
+                 callbacks: Optional[List[Callback]] = None, **kwargs: Any) -> None:
+        """
+        Args:
+            model (BaseNet): Model, the trainer should be recreated if it is replaced by another model object
+            datamodule (DataModule): Module with train and val dataloaders
+            max_epochs (int, optional): Number of epochs in one round. Defaults to 1.
+            max_steps (int, optional): Number of optimizer steps in one round, -1 means no limit. Defaults to -1.
+            check_val_every_n_epoch (int, optional): Frequency of validation epochs. Defaults to 1.
+            accelerator (str, optional): Accelerator of Lightning Trainer. Defaults to 'cpu'.
+            devices (Union[int, str, List[int]], optional): Devices of Lightning Trainer, only one is supported. Defaults to 1.
+            callbacks (Optional[List[Callback]], optional): Lightning callbacks, e.g. ScaffoldCallback. Defaults to None.
+            **kwargs: Other arguments of Lightning Trainer from training config, only IGNORED_TRAINER_ARGS are accepted
+
+        Raises:
+            ValueError: If {kwargs} have Trainer arguments which ClientTrainer does not implement, e.g. precision,
+                gradient_clip_val, strategy or logger
+        """
+        unsupported = sorted(set(kwargs) - IGNORED_TRAINER_ARGS)
+        if unsupported:
+            raise ValueError(f'ClientTrainer does not implement Trainer arguments {unsupported}, use fit_loop=lightning for them')
+        self.model = model
+        self.max_epochs = max_epochs
+        self.max_steps = max_steps
+        self.check_val_every_n_epoch = check_val_every_n_epoch
+        self.callbacks = callbacks if callbacks is not None else []
+        self.device = resolve_device(accelerator, devices)
+        self.global_step = 0
+        self.current_epoch = 0
+
+        self.train_loader = datamodule.train_dataloader()
+        self.val_loader = datamodule.val_dataloader()
+        self.train_iterator: Optional[Iterator] = None
+
+        # moving the model to device keeps its parameter objects, so the optimizer refers to them in every round
+        model.to(self.device)
+        optimizers, schedulers = model.configure_optimizers()
+        self.optimizer = optimizers[0]
+        self.scheduler = schedulers[0] if schedulers else None
+        # configure_optimizers sets scheduler epoch from current_round, it is tracked from here on
+        self.first_round = model.current_round
+        self.first_scheduler_epoch = self.scheduler.last_epoch if self.scheduler is not None else 0
+        self._update_model_lr()
+        if self.device.type != 'cpu':
+            model.cpu()
+
+    def _update_model_lr(self):
+        self.model.loop_lr = self.optimizer.param_groups[0]['lr']
+
+    def _catch_up_scheduler(self):
+        # rounds in which the client was not sampled by the strategy are skipped by the scheduler,
+        # so the learning rate of a round is the same as the one of scheduler configured for that round
+        if self.scheduler is None:
+            return
+        expected = self.first_scheduler_epoch + (self.model.current_round - self.first_round) * self.model.scheduler_params['epochs_in_round']
+        while self.scheduler.last_epoch < expected:
+            self.scheduler.step()
+        self._update_model_lr()
+
+    def _to_device(self, batch: Tuple[torch.Tensor, ...]) -> Tuple[torch.Tensor, ...]:
+        if self.device.type == 'cpu':
+            return batch
+        return tuple(t.to(self.device, non_blocking=True) for t in batch)
+
+    def _train_batches(self) -> Iterator:
+        if self.train_iterator is None:
+            self.train_iterator = iter(self.train_loader)
+        # if the round stops in the middle of the pass, the iterator stays and is continued by the next round
+        for batch in self.train_iterator:
+            yield batch
+        self.train_iterator = None
+
+    def _max_steps_reached(self) -> bool:
+        return 0 <= self.max_steps <= self.global_step
+
+    def _call_hook(self, name: str, *args: Any):
+        getattr(self.model, name)(*args)
+        for callback in self.callbacks:
+            getattr(callback, name)(self, self.model, *args)
+
+    def _train_step(self, batch: Tuple[torch.Tensor, ...], batch_idx: int) -> Dict[str, Any]:
+        output = self.model.training_step(batch, batch_idx)
+        self.optimizer.zero_grad(set_to_none=True)
+        output['loss'].backward()
+        self._call_hook('on_after_backward')
+        self.optimizer.step()
+        self.global_step += 1
+        # loss is detached like in outputs of Lightning, so epoch outputs do not keep autograd graphs
+        output = {**output, 'loss': output['loss'].detach()}
+        self._call_hook('on_train_batch_end', output, batch, batch_idx)
+        return output
+
+    def _validate(self):
+        self.model.eval()
+        with torch.no_grad():
+            outputs = [self.model.validation_step(self._to_device(batch), batch_idx)
+                       for batch_idx, batch in enumerate(self.val_loader)]
+        if len(outputs) > 0:
+            self.model.validation_epoch_end(outputs)
+        self.model.train()
+
+    def fit(self):
+        """Trains the model for one round, current_round of the model should be set before"""
+        model = self.model
+        self._catch_up_scheduler()
+        model.to(self.device)
+        model.train()
+        self.global_step = 0
+        self._call_hook('on_train_start')
+        with torch.enable_grad():
+            for epoch in range(self.max_epochs):
+                if self._max_steps_reached():
+                    break
+                self.current_epoch = model.loop_epoch = epoch
+                self._call_hook('on_train_epoch_start')
+                outputs = []
+                for batch_idx, batch in enumerate(self._train_batches()):
+                    outputs.append(self._train_step(self._to_device(batch), batch_idx))
+                    if self._max_steps_reached():
+                        break
+                if (epoch + 1) % self.check_val_every_n_epoch == 0:
+                    self._validate()
+                if len(outputs) > 0:
+                    model.training_epoch_end(outputs)
+                self._call_hook('on_train_epoch_end')
+                if self.scheduler is not None:
+                    self.scheduler.step()
+                self._update_model_lr()
+        self._call_hook('on_train_end')
+        # the model is returned to cpu like after Lightning fit, since evaluation loaders yield cpu batches
+        if self.device.type != 'cpu':
+            model.cpu()
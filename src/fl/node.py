@@ -15,6 +15,7 @@ import flwr
 from pytorch_lightning.loggers import TensorBoardLogger
 
 from datasets.memory import load_from_pgen, load_phenotype, load_covariates
+from datasets.impute import hardcall_means, impute_means
 from datasets.lightning import DataModule
 from nn.models import BaseNet, LinearRegressor, MLPPredictor
 from federation.client import FLClient
@@ -167,6 +168,10 @@ if __name__ == '__main__':
 
     X_train = load_from_pgen(pfile_train, gwas, None, missing=cfg.experiment.missing) # load all snps
     X_val = load_from_pgen(pfile_val, gwas, None, missing=cfg.experiment.missing) # load all snps
+    if cfg.experiment.missing == 'mean':
+        # missing genotypes are kept as -9 and replaced with exact means of train genotypes
+        snp_means = hardcall_means(X_train)
+        X_train, X_val = impute_means(X_train, snp_means), impute_means(X_val, snp_means)
     logging.info(f'We have {X_train.shape[1]} snps, {X_train.shape[0]} train samples and {X_val.shape[0]} val samples')
     
     X_cov_train = load_covariates(cov_train)
@@ -20,6 +20,7 @@ import torch
 from fl.federation.client import FLClient, MLFlowMetricsLogger, MetricsLogger
 from local.experiment import NNExperiment, TGNNExperiment
 from fl.federation.callbacks import PlotLandscapeCallback, CovariateWeightsCallback
+from nn.metrics_sink import get_metrics_sink
 
 
 @dataclass
@@ -188,3 +189,5 @@ class Node(Process):
                 self.experiment.data_module.update_y(residual)
             
             self._train_model(client)
+            # metrics are sent in background, the run should get all of them before it is ended
+            get_metrics_sink().flush()
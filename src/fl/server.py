@@ -6,6 +6,7 @@ import mlflow
 from socket import gethostname
 from flwr.server import start_server
 from flwr.server.strategy import FedAvg
+from nn.metrics_sink import get_metrics_sink
 from federation.strategy import Checkpointer, MCFedAvg, MCFedAdagrad, MCFedAdam, MCQFedAvg, MlflowLogger, fit_round
 
 
@@ -89,6 +90,7 @@ if __name__ == '__main__':
                     strategy=strategy,
                     config={"num_rounds": cfg.server.rounds}
         )
+        get_metrics_sink().flush()
     
     best_model_path = snakemake.output[0]
     strategy.checkpointer.copy_best_model(best_model_path)
@@ -8,6 +8,7 @@ from flwr.server import start_server
 from flwr.server.strategy import FedAvg
 
 from fl.federation.strategy import Checkpointer, MCFedAvg, MCFedAdagrad, MCFedAdam, MCQFedAvg, MCScaffold, MlflowLogger, fit_round, on_evaluate_config_fn
+from nn.metrics_sink import get_metrics_sink
 
 
 def get_strategy(strategy_params: DictConfig, epochs_in_round: int, node_count: int, checkpoint_dir: str, model_type: str) -> FedAvg:
@@ -93,5 +94,6 @@ class Server(Process):
                     config={"num_rounds": self.cfg.server.rounds},
                     force_final_distributed_eval=True
         )
+        get_metrics_sink().flush()
 
         strategy.checkpointer.copy_best_model(os.path.join(self.cfg.server.checkpoint_dir, self.params_hash, 'best_model.ckpt'))
@@ -1,7 +1,9 @@
+import copy
 import pickle
 from abc import abstractmethod
+from itertools import product
 import sys
-from typing import Type
+from typing import Any, Dict, List, Optional, Type
 
 
 sys.path.append('..')
@@ -12,12 +14,16 @@ from sys import stdout
 import numpy
 import pandas as pd
 from omegaconf import DictConfig
+from omegaconf.listconfig import ListConfig
 import mlflow
+from mlflow.entities import Param
+from mlflow.tracking.client import MlflowClient
+from mlflow.utils.mlflow_tags import MLFLOW_PARENT_RUN_ID
 from mlflow.xgboost import autolog
 from mlflow.types import Schema, TensorSpec
 from mlflow.models.signature import ModelSignature
 from numpy import argmax, amax
-from sklearn.linear_model import LassoCV, LinearRegression, LogisticRegressionCV, LogisticRegression
+from sklearn.linear_model import LinearRegression, LogisticRegression
 from xgboost import XGBRegressor
 from sklearn.metrics import r2_score, mean_squared_error, roc_auc_score, accuracy_score
 import torch
@@ -25,11 +31,13 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import cross_validate, train_test_split
 
 from local.config import node_size_dict, node_name_dict
+from local.glm import GenotypeGLMPath
 from fl.datasets.memory import load_covariates
 from nn.lightning import DataModule
-from nn.train import prepare_trainer
+from nn.train import prepare_trainer, BestStateCheckpoint, MemberBestStateCheckpoint
 from nn.utils import LassoNetRegMetrics
-from nn.models import MLPPredictor, LassoNetRegressor, LassoNetClassifier, MLPClassifier, LinearRegressor, LinearClassifier
+from nn.models import MLPPredictor, LassoNetRegressor, LassoNetClassifier, MLPClassifier, LinearRegressor, LinearClassifier, \
+    MLPEnsembleRegressor, MLPEnsembleClassifier
 from configs.phenotype_config import MEAN_PHENO_DICT, PHENO_TYPE_DICT, PHENO_NUMPY_DICT, TYPE_LOSS_DICT, \
     TYPE_METRIC_DICT
 from utils.metrics import get_accuracy
@@ -41,10 +49,12 @@ class LocalExperiment(object):
     """
     Base class for experiments in a local setting
     """
-    def __init__(self, cfg: DictConfig):
+    def __init__(self, cfg: DictConfig, loader: Optional[ExperimentDataLoader] = None):
         """
         Args:
             cfg: Configuration for experiments from hydra
+            loader: Data loader of {cfg}, e.g. the one which shares genotypes of snp_count sweep.
+                If None, a new loader is created.
         """
         self.cfg = cfg
         logging.basicConfig(level=logging.INFO,
@@ -52,7 +62,7 @@ class LocalExperiment(object):
                             format='%(asctime)s %(levelname)-8s %(message)s',
                              datefmt='%Y-%m-%d %H:%M:%S')
         self.logger = logging.getLogger()
-        self.loader = ExperimentDataLoader(cfg)
+        self.loader = loader if loader is not None else ExperimentDataLoader(cfg)
 
     def start_mlflow_run(self):
         split = self.cfg.split_dir.split('/')[-1]
@@ -134,8 +144,8 @@ def simple_estimator_factory(model):
         model_kwargs_dict: Dictionary of parameters passed during model initialization
     """
     class SimpleEstimatorExperiment(LocalExperiment):
-        def __init__(self, cfg):
-            LocalExperiment.__init__(self, cfg)
+        def __init__(self, cfg, loader=None):
+            LocalExperiment.__init__(self, cfg, loader)
             self.model = model(**self.cfg.model.params)
 
         def train(self):
@@ -145,9 +155,51 @@ def simple_estimator_factory(model):
     return SimpleEstimatorExperiment
 
 
+class GLMPathExperiment(LocalExperiment):
+    """Lasso or elastic net path fitted directly on int8 or packed genotypes with unpenalized covariates,
+    lambda is selected on validation split instead of cross-validation
+    """
+    family = 'gaussian'
+
+    def __init__(self, cfg, loader=None):
+        LocalExperiment.__init__(self, cfg, loader)
+        self.model = GenotypeGLMPath(family=self.family, **self.cfg.model.get('params', {}))
+
+    def load_data(self):
+        self.logger.info("Loading data")
+        # genotypes are not concatenated with covariates, so they are not upcast to float
+        self.x, self.x_cov, self.y = self.loader.load_blocks()
+        self.sw = self.loader.load_sample_weights()
+        self.logger.info(f"{self.x.train.shape[1]} features loaded")
+
+    def _covariates(self, part: str) -> Optional[numpy.ndarray]:
+        return getattr(self.x_cov, part) if self.x_cov is not None else None
+
+    def train(self):
+        self.logger.info("Training")
+        mlflow.log_params({'model': self.cfg.model})
+        self.model.fit(self.x.train, self.y.train, self._covariates('train'),
+                       self.x.val, self.y.val, self._covariates('val'), fill=self.loader.genotype_means)
+        mlflow.log_metrics({'lambda': self.model.lambda_,
+                            'best_lambda_index': self.model.best_index_,
+                            'active_snps': self.model.active_counts_[self.model.best_index_]})
+
+    def eval_and_log(self, metric_fun=r2_score, metric_name='r2'):
+        self.logger.info("Evaluating model")
+        for part in ['train', 'val', 'test']:
+            preds = self.model.predict(getattr(self.x, part), self._covariates(part))
+            metric = metric_fun(getattr(self.y, part), preds, sample_weight=getattr(self.sw, part))
+            print(f"{part.capitalize()} {metric_name}: {metric}")
+            mlflow.log_metric(f'{part}_{metric_name}', metric)
+
+
+class BinomialGLMPathExperiment(GLMPathExperiment):
+    family = 'binomial'
+
+
 class XGBExperiment(LocalExperiment):
-    def __init__(self, cfg):
-        LocalExperiment.__init__(self, cfg)
+    def __init__(self, cfg, loader=None):
+        LocalExperiment.__init__(self, cfg, loader)
         self.model = XGBRegressor(**self.cfg.model.params)
 
     def train(self):
@@ -158,8 +210,8 @@ class XGBExperiment(LocalExperiment):
 
 
 class RandomForestExperiment(LocalExperiment):
-    def __init__(self, cfg):
-        LocalExperiment.__init__(self, cfg)
+    def __init__(self, cfg, loader=None):
+        LocalExperiment.__init__(self, cfg, loader)
         self.model = RandomForestClassifier(**self.cfg.model.params)
 
     def train(self):
@@ -188,19 +240,37 @@ def get_model_class(model_name: str) -> Type:
 
 
 class NNExperiment(LocalExperiment):
-    def __init__(self, cfg):
-        LocalExperiment.__init__(self, cfg)
+    checkpoint_class = BestStateCheckpoint
+
+    def __init__(self, cfg, loader=None):
+        LocalExperiment.__init__(self, cfg, loader)
         self.model_class: Type = get_model_class(cfg.model.name)
+        self.standardization = None
 
     def load_data(self):
-        LocalExperiment.load_data(self)
+        self.logger.info("Loading data")
+        # genotypes and covariates are kept as separate int8 and float32 blocks
+        # and concatenated batch by batch in DataModule loaders
+        self.x, x_cov, self.y = self.loader.load_blocks()
+        self.sw = self.loader.load_sample_weights()
+
+        if self.cfg.study == 'ukb':
+            # covariates are used for pretraining even if they are not model features
+            self.x_cov = x_cov if x_cov is not None else self.loader.load_covariates()
+            self.logger.info(f"{self.x_cov.train.shape[1]} covariates loaded")
+        self.logger.info(f"{self.x.train.shape[1]} features loaded")
+        # precomputed standardization of batches, models can be trained without input batch normalization
+        self.standardization = self.loader.load_standardization(self.x, x_cov)
+
         self.data_module = DataModule(self.x,
                                       self.y.astype(PHENO_NUMPY_DICT[self.cfg.data.phenotype.name]),
+                                      x_cov=x_cov,
                                       sample_weights=self.sw,
-                                      batch_size=self.cfg.model.get('batch_size', len(self.x.train)))
+                                      batch_size=self.cfg.model.get('batch_size', len(self.x.train)),
+                                      standardization=self.standardization)
 
     def create_model(self):
-        self.model: self.model_class = self.model_class(input_size=self.x.train.shape[1],
+        self.model: self.model_class = self.model_class(input_size=self.data_module.feature_count(),
                                                         optim_params=self.cfg.optimizer,
                                                         scheduler_params=self.cfg.scheduler,
                                                         loss=TYPE_LOSS_DICT[PHENO_TYPE_DICT[self.cfg.data.phenotype.name]],
@@ -208,14 +278,8 @@ class NNExperiment(LocalExperiment):
                                                         )
 
     def load_best_model(self):
-        self.model = self.model_class.load_from_checkpoint(
-                self.trainer.checkpoint_callback.best_model_path,
-                input_size=self.x.train.shape[1],
-                optim_params=self.cfg.optimizer,
-                scheduler_params=self.cfg.scheduler,
-                loss=TYPE_LOSS_DICT[PHENO_TYPE_DICT[self.cfg.data.phenotype.name]],
-                **self.model.params
-            )
+        # the best state is kept in memory by BestStateCheckpoint, so the model is not read back from disk
+        self.trainer.checkpoint_callback.restore(self.model)
 
     def train(self):
         mlflow.log_params({'model': self.cfg.model})
@@ -230,6 +294,9 @@ class NNExperiment(LocalExperiment):
 
         if self.cfg.experiment.pretrain_on_cov == 'weights':
             cov_weights = self.pretrain()
+            if self.standardization is not None:
+                # weights are pretrained on raw covariates, while the model gets standardized ones
+                cov_weights = cov_weights / self.standardization.scale[-len(cov_weights):]
             self.model.set_covariate_weights(cov_weights)
         elif self.cfg.experiment.pretrain_on_cov == 'substract':
             residual = self.pretrain_and_substract()
@@ -242,18 +309,21 @@ class NNExperiment(LocalExperiment):
                                        weights_summary='full',
                                        patience=self.cfg.training.patience,
                                        log_every_n_steps=5,
-                                       enable_progress_bar=self.cfg.training.enable_progress_bar)
+                                       enable_progress_bar=self.cfg.training.enable_progress_bar,
+                                       save_best=self.cfg.training.get('save_best', True),
+                                       checkpoint_class=self.checkpoint_class)
 
         print("Fitting")
         self.trainer.fit(self.model, self.data_module)
         print("Fitted")
         self.load_best_model()
-        mlflow.log_param('model_saved', self.trainer.checkpoint_callback.best_model_path)
-        f = open(self.trainer.checkpoint_callback.best_model_path.replace('.ckpt', '.pkl'), 'wb')
-        pickle.dump(self.model, f)
-        f.close()
+        best_model_path = self.trainer.checkpoint_callback.best_model_path
+        if best_model_path:
+            mlflow.log_param('model_saved', best_model_path)
+            with open(best_model_path.replace('.ckpt', '.pkl'), 'wb') as f:
+                pickle.dump(self.model, f)
 
-        print(f'Loaded best model {self.trainer.checkpoint_callback.best_model_path}')
+        print(f'Loaded best model of epoch {self.trainer.checkpoint_callback.best_epoch} {best_model_path}')
 
     def eval_and_log(self, metric_fun=r2_score, metric_name='r2'):
         self.model.eval()
@@ -360,14 +430,6 @@ class TGNNExperiment(NNExperiment):
                                    )
 
 
-    def load_best_model(self):
-        self.model = MLPClassifier.load_from_checkpoint(self.trainer.checkpoint_callback.best_model_path,
-                                                        nclass=len(set(self.y.train)), nfeat=self.x.train.shape[1],
-                                                        optim_params=self.cfg.experiment.optimizer,
-                                                        scheduler_params=self.cfg.experiment.get('scheduler', None),
-                                                        loss=TYPE_LOSS_DICT[PHENO_TYPE_DICT[self.cfg.data.phenotype.name]]
-                                                        )
-
     def eval_and_log(self, metric_fun=get_accuracy, metric_name='accuracy'):
         self.model.eval()
 
@@ -390,10 +452,108 @@ class TGNNExperiment(NNExperiment):
         mlflow.log_metric(f'test_{metric_name}', metric_test)
 
 
+def ensemble_members(grid: DictConfig) -> List[Dict[str, Any]]:
+    """Returns hyperparameters of ensemble members for every combination of values of {grid},
+    lists are multiplied like in grid configs of local/wrapper.py and single values are used by all members
+    """
+    keys = list(grid.keys())
+    values = [list(value) if isinstance(value, ListConfig) else [value] for value in grid.values()]
+    return [dict(zip(keys, combination)) for combination in product(*values)]
+
+
+def ensemble_factory(experiment_class: Type[NNExperiment]) -> Type[NNExperiment]:
+    """Returns an EnsembleExperiment, which loads data like {experiment_class} once and trains
+    all members of model.ensemble grid as one MLPEnsembleRegressor or MLPEnsembleClassifier.
+    Every member gets its own mlflow run nested in the experiment run with its hyperparameters, losses and metrics.
+    """
+
+    class EnsembleExperiment(experiment_class):
+        # every member is restored to its own best epoch and the saved checkpoint has these weights
+        checkpoint_class = MemberBestStateCheckpoint
+
+        def __init__(self, cfg, loader=None):
+            experiment_class.__init__(self, cfg, loader)
+            self.members = ensemble_members(cfg.model.ensemble)
+            self.member_run_ids = []
+
+        def load_data(self):
+            experiment_class.load_data(self)
+            if self.cfg.study == 'ukb' and any('feature_count' in member for member in self.members) and self.loader.snp_sweep is None:
+                raise ValueError('feature_count of ensemble members requires SNPs ordered by significance, '
+                                 'set experiment.snp_counts to [experiment.snp_count]')
+
+        def start_mlflow_run(self):
+            experiment_class.start_mlflow_run(self)
+            client = MlflowClient()
+            tags = {key: value for key, value in self.run.data.tags.items() if not key.startswith('mlflow.')}
+            tags[MLFLOW_PARENT_RUN_ID] = self.run.info.run_id
+            self.member_run_ids = []
+            for index, member in enumerate(self.members):
+                run = client.create_run(self.run.info.experiment_id, tags=tags, run_name=f'member{index}')
+                client.log_batch(run.info.run_id, params=[Param(key, str(value)) for key, value in member.items()])
+                self.member_run_ids.append(run.info.run_id)
+
+        def _feature_count(self, member: Dict[str, Any]) -> Dict[str, Any]:
+            # for ukb feature_count is a number of top GWAS SNPs present in genotypes, it is checked against the sweep
+            if self.cfg.study == 'ukb' and 'feature_count' in member:
+                return {**member, 'feature_count': self.loader.snp_sweep.column_count(member['feature_count'])}
+            return member
+
+        def create_model(self):
+            if self.cfg.study == 'tg':
+                optim_params, scheduler_params = self.cfg.experiment.optimizer, self.cfg.experiment.get('scheduler', None)
+            else:
+                optim_params, scheduler_params = self.cfg.optimizer, self.cfg.scheduler
+            members = [self._feature_count(member) for member in self.members]
+            phenotype_type = PHENO_TYPE_DICT[self.cfg.data.phenotype.name]
+            if phenotype_type == 'continuous':
+                self.model = MLPEnsembleRegressor(input_size=self.data_module.feature_count(),
+                                                  members=members,
+                                                  hidden_size=self.cfg.model.hidden_size,
+                                                  optim_params=optim_params,
+                                                  scheduler_params=scheduler_params,
+                                                  l1=self.cfg.model.get('l1', 0.0),
+                                                  cov_count=self.data_module.covariate_count())
+            else:
+                self.model = MLPEnsembleClassifier(input_size=self.data_module.feature_count(),
+                                                   members=members,
+                                                   nclass=2 if phenotype_type == 'binary' else len(set(self.y.train)),
+                                                   optim_params=optim_params,
+                                                   scheduler_params=scheduler_params,
+                                                   hidden_size=self.cfg.model.get('hidden_size', 800),
+                                                   hidden_size2=self.cfg.model.get('hidden_size2', 200),
+                                                   l1=self.cfg.model.get('l1', 0.0),
+                                                   cov_count=self.data_module.covariate_count())
+            self.model.member_run_ids = self.member_run_ids
+
+        def eval_and_log(self, **kwargs):
+            self.model.eval()
+            metrics = self.model.predict_and_eval(self.data_module, test=True)
+            sink = self.model.metrics_sink
+            for index, run_id in enumerate(self.member_run_ids):
+                member_metrics = {'best_epoch': self.model.best_epochs[index]}
+                for part, part_metrics in zip(['train', 'val', 'test'], [metrics.train, metrics.val, metrics.test]):
+                    member_metrics.update({f'{part}_{name}': value for name, value in part_metrics[index].to_dict().items()})
+                print(f'Member {index} {self.members[index]}: {member_metrics}')
+                sink.log_metrics(member_metrics, run_id=run_id)
+            sink.flush()
+            client = MlflowClient()
+            for run_id in self.member_run_ids:
+                client.set_terminated(run_id)
+
+            best = int(metrics.best_col)
+            mlflow.log_param('best_member', best)
+            for part, part_metrics in zip(['train', 'val', 'test'], [metrics.train, metrics.val, metrics.test]):
+                mlflow.log_metrics({f'{part}_{name}': value for name, value in part_metrics[best].to_dict().items()})
+            print(f'Best member {best} {self.members[best]}')
+
+    return EnsembleExperiment
+
+
 # Dict of possible experiment types and their corresponding classes
 ukb_experiment_dict = {
-    'lasso': simple_estimator_factory(LassoCV),
-    'logistic_regression': simple_estimator_factory(LogisticRegressionCV),
+    'lasso': GLMPathExperiment,
+    'logistic_regression': BinomialGLMPathExperiment,
     'xgboost': XGBExperiment,
     'lassonet_regressor': NNExperiment,
     'lassonet_classifier': NNExperiment,
@@ -407,18 +567,41 @@ tg_experiment_dict = {
 }
 
 
+def run_snp_count_sweep(experiment_class: Type[LocalExperiment], cfg: DictConfig):
+    """Runs experiments for every value of experiment.snp_counts from the largest one.
+    Every experiment gets a copy of {cfg} with its snp_count and a loader which shares SnpCountSweep
+    of the first one, so genotypes are loaded from .pgen only once and every smaller snp_count
+    trains on a view of their first columns.
+    """
+    snp_sweep = None
+    for snp_count in sorted(cfg.experiment.snp_counts, reverse=True):
+        experiment_cfg = copy.deepcopy(cfg)
+        experiment_cfg.experiment.snp_count = snp_count
+        loader = ExperimentDataLoader(experiment_cfg, snp_sweep)
+        experiment_class(experiment_cfg, loader).run()
+        mlflow.end_run()
+        snp_sweep = loader.snp_sweep
+
+
 @hydra.main(config_path='configs', config_name='default')
 def local_experiment(cfg: DictConfig):
     print(cfg)
     assert cfg.study in ['tg', 'ukb']
     if cfg.study == 'ukb':
         assert cfg.model.name in ukb_experiment_dict.keys()
-        experiment = ukb_experiment_dict[cfg.model.name](cfg)
+        experiment_class = ukb_experiment_dict[cfg.model.name]
     elif cfg.study == 'tg':
         assert cfg.model.name in tg_experiment_dict.keys()
-        experiment = tg_experiment_dict[cfg.model.name](cfg)
+        experiment_class = tg_experiment_dict[cfg.model.name]
+
+    if cfg.model.get('ensemble', None) is not None:
+        assert cfg.model.name in ['mlp_regressor', 'mlp_classifier']
+        experiment_class = ensemble_factory(experiment_class)
 
-    experiment.run()
+    if cfg.study == 'ukb' and cfg.experiment.get('snp_counts', None) is not None:
+        run_snp_count_sweep(experiment_class, cfg)
+        return
+    experiment_class(cfg).run()
 
 
 if __name__ == '__main__':
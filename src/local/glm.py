@@ -0,0 +1,268 @@
+from typing import List, Optional, Tuple
+import logging
+import numpy
+from sklearn.metrics import r2_score, roc_auc_score
+
+from fl.datasets.standardize import feature_moments
+from fl.datasets.impute import impute_means_
+
+
+FAMILIES = ['gaussian', 'binomial']
+
+
+def column_dots(array, vector: numpy.ndarray, block_size: int = 4096, fill: Optional[numpy.ndarray] = None) -> numpy.ndarray:
+    """Calculates {array}.T @ {vector} block of columns by block of columns,
+    so int8 or packed genotypes are converted to float32 only one block at a time
+
+    Args:
+        array: Sample-major matrix, e.g. int8 genotypes or PackedGenotypes
+        vector (numpy.ndarray): Vector with one value per sample
+        block_size (int, optional): Number of columns processed at once. Defaults to 4096.
+        fill (Optional[numpy.ndarray], optional): SNP means which replace missing genotypes during conversion. Defaults to None.
+
+    Returns:
+        numpy.ndarray: float64 dot products of every column with {vector}
+    """
+    vector = numpy.asarray(vector, dtype=numpy.float32)
+    result = numpy.empty(array.shape[1])
+    for start in range(0, array.shape[1], block_size):
+        block = numpy.asarray(array[:, start: start + block_size], dtype=numpy.float32)
+        if fill is not None:
+            impute_means_(block, fill[start: start + block.shape[1]])
+        result[start: start + block.shape[1]] = block.T @ vector
+    return result
+
+
+def _sigmoid(eta: numpy.ndarray) -> numpy.ndarray:
+    return 0.5 * (1 + numpy.tanh(0.5 * eta))
+
+
+class GenotypeGLMPath:
+    def __init__(self, family: str = 'gaussian', l1_ratio: float = 1.0, n_lambdas: int = 100, eps: float = 1e-3,
+                 patience: int = 5, max_active: int = 4096, tol: float = 1e-5, max_iter: int = 100, block_size: int = 4096) -> None:
+        """Lasso or elastic net path of gaussian or binomial GLM fitted by coordinate descent directly on int8
+        or packed genotypes, similar to bigstatsr and snpnet. SNPs are standardized implicitly with their means
+        and standard deviations, full genotype matrix is only read block by block to calculate gradients.
+        Coordinate descent runs on a dense block of SNPs which passed the sequential strong rule,
+        and the solution of every lambda is checked with KKT conditions and used as a warm start for the next one.
+        Covariates and intercept are not penalized. The path is evaluated on validation split after every lambda,
+        it stops when validation score does not improve for {patience} lambdas.
+
+        Args:
+            family (str, optional): One of 'gaussian' and 'binomial'. Defaults to 'gaussian'.
+            l1_ratio (float, optional): Elastic net mixing parameter, 1 is lasso. Defaults to 1.0.
+            n_lambdas (int, optional): Number of lambdas on the path. Defaults to 100.
+            eps (float, optional): Ratio of the smallest lambda to the largest one. Defaults to 1e-3.
+            patience (int, optional): Number of lambdas without improvement of validation score before stopping. Defaults to 5.
+            max_active (int, optional): Path stops when number of SNPs with nonzero weights exceeds it. Defaults to 4096.
+            tol (float, optional): Tolerance of the largest weighted squared change of weights in a sweep. Defaults to 1e-5.
+            max_iter (int, optional): Maximum number of coordinate descent sweeps and IRLS steps. Defaults to 100.
+            block_size (int, optional): Number of genotype columns converted to float32 at once. Defaults to 4096.
+        """
+        if family not in FAMILIES:
+            raise ValueError(f'family should be one of {FAMILIES}')
+        self.family = family
+        self.l1_ratio = l1_ratio
+        self.n_lambdas = n_lambdas
+        self.eps = eps
+        self.patience = patience
+        self.max_active = max_active
+        self.tol = tol
+        self.max_iter = max_iter
+        self.block_size = block_size
+
+    def _columns(self, array, snps: numpy.ndarray) -> numpy.ndarray:
+        block = numpy.asarray(array[:, snps], dtype=numpy.float32)
+        if self.fill_ is not None:
+            impute_means_(block, self.fill_[snps])
+        return block
+
+    def _standardized(self, array, snps: numpy.ndarray) -> List[numpy.ndarray]:
+        block = self._columns(array, snps)
+        block -= self.means_[snps].astype(numpy.float32)
+        block *= self.scales_[snps].astype(numpy.float32)
+        return list(block.T.copy())
+
+    def _gradient(self, array, residual: numpy.ndarray) -> numpy.ndarray:
+        """Gradient of log-likelihood by weights of standardized SNPs divided by sample count"""
+        dots = column_dots(array, residual, self.block_size, self.fill_) - self.means_ * residual.sum()
+        return dots * self.scales_ / residual.shape[0]
+
+    def _descend(self, columns: List[numpy.ndarray], penalties: numpy.ndarray, beta: numpy.ndarray,
+                 residual: numpy.ndarray, weights: Optional[numpy.ndarray], lam: float) -> Tuple[float, numpy.ndarray]:
+        """Cyclic coordinate descent of weighted least squares on {columns} with intercept,
+        {residual} and {beta} are updated in place
+
+        Returns:
+            Tuple[float, numpy.ndarray]: Change of intercept and change of linear predictor
+        """
+        n = residual.shape[0]
+        weighted = [column if weights is None else column * weights for column in columns]
+        norms = numpy.array([wc @ column for wc, column in zip(weighted, columns)]) / n
+        l1 = lam * self.l1_ratio * penalties
+        l2 = lam * (1 - self.l1_ratio) * penalties
+        weight_sum = n if weights is None else weights.sum()
+        delta_eta = numpy.zeros(n)
+        intercept = 0.0
+        for _ in range(self.max_iter):
+            max_change = 0.0
+            for k, (column, wc) in enumerate(zip(columns, weighted)):
+                g = wc @ residual / n + norms[k] * beta[k]
+                new = numpy.sign(g) * max(abs(g) - l1[k], 0.0) / (norms[k] + l2[k]) if norms[k] > 0 else 0.0
+                change = new - beta[k]
+                if change != 0.0:
+                    beta[k] = new
+                    residual -= change * column
+                    delta_eta += change * column
+                    max_change = max(max_change, norms[k] * change ** 2)
+            shift = (residual @ weights if weights is not None else residual.sum()) / weight_sum
+            residual -= shift
+            delta_eta += shift
+            intercept += shift
+            if max_change < self.tol:
+                break
+        return intercept, delta_eta
+
+    def _solve(self, columns: List[numpy.ndarray], penalties: numpy.ndarray, beta: numpy.ndarray,
+               y: numpy.ndarray, eta: numpy.ndarray, lam: float) -> float:
+        """Fits weights of {columns} at {lam} starting from {beta} and linear predictor {eta}, both are updated in place
+
+        Returns:
+            float: Change of intercept
+        """
+        if self.family == 'gaussian':
+            residual = y - eta
+            intercept, delta_eta = self._descend(columns, penalties, beta, residual, None, lam)
+            eta += delta_eta
+            return intercept
+        intercept = 0.0
+        for _ in range(self.max_iter):
+            # IRLS step: weighted least squares on the quadratic approximation of binomial log-likelihood
+            p = _sigmoid(eta)
+            weights = numpy.maximum(p * (1 - p), 1e-5)
+            residual = (y - p) / weights
+            shift, delta_eta = self._descend(columns, penalties, beta, residual, weights, lam)
+            eta += delta_eta
+            intercept += shift
+            if numpy.abs(delta_eta).max() < numpy.sqrt(self.tol):
+                break
+        return intercept
+
+    def _score(self, y: numpy.ndarray, eta: numpy.ndarray) -> float:
+        return r2_score(y, eta) if self.family == 'gaussian' else roc_auc_score(y, eta)
+
+    def fit(self, X, y: numpy.ndarray, X_cov: Optional[numpy.ndarray] = None,
+            X_val=None, y_val: Optional[numpy.ndarray] = None, X_cov_val: Optional[numpy.ndarray] = None,
+            fill: Optional[numpy.ndarray] = None) -> 'GenotypeGLMPath':
+        """Fits the path on train genotypes {X} and selects lambda with the best score on validation split if it is given,
+        R2 for gaussian and ROC AUC for binomial family. Otherwise the last lambda of the path is selected.
+
+        Args:
+            X: int8 genotypes or PackedGenotypes, missing values are allowed only with {fill}
+            y (numpy.ndarray): Phenotype, 0 and 1 for binomial family
+            X_cov (Optional[numpy.ndarray], optional): Unpenalized covariates. Defaults to None.
+            X_val (optional): Validation genotypes. Defaults to None.
+            y_val (Optional[numpy.ndarray], optional): Validation phenotype. Defaults to None.
+            X_cov_val (Optional[numpy.ndarray], optional): Validation covariates. Defaults to None.
+            fill (Optional[numpy.ndarray], optional): SNP means which replace missing genotypes of train, validation
+                and predicted genotypes. Defaults to None.
+
+        Returns:
+            GenotypeGLMPath: Fitted path
+        """
+        y = numpy.asarray(y, dtype=numpy.float64)
+        n, snp_count = X.shape
+        self.fill_ = fill
+        self.means_, stds = feature_moments(X, self.block_size, fill)
+        # monomorphic SNPs are zero after standardization and never enter the model
+        self.scales_ = numpy.divide(1.0, stds, out=numpy.zeros(snp_count), where=stds > 0)
+        validate = X_val is not None and y_val is not None
+
+        cov_count = X_cov.shape[1] if X_cov is not None else 0
+        columns, val_columns = [], []
+        if cov_count > 0:
+            cov_means, cov_stds = feature_moments(X_cov)
+            cov_scales = numpy.divide(1.0, cov_stds, out=numpy.zeros(cov_count), where=cov_stds > 0)
+            columns = list(((X_cov - cov_means) * cov_scales).T)
+            if validate:
+                val_columns = list(((X_cov_val - cov_means) * cov_scales).T)
+        block_snps = numpy.empty(0, dtype=numpy.int64)
+        penalties = numpy.zeros(cov_count)
+        beta = numpy.zeros(cov_count)
+
+        intercept = y.mean() if self.family == 'gaussian' else numpy.log(y.mean() / (1 - y.mean()))
+        eta = numpy.full(n, intercept)
+        intercept += self._solve(columns, penalties, beta, y, eta, lam=0.0)
+        gradient = self._gradient(X, y - (eta if self.family == 'gaussian' else _sigmoid(eta)))
+        lambda_max = numpy.abs(gradient).max() / max(self.l1_ratio, 1e-3)
+        self.lambdas_ = lambda_max * numpy.logspace(0, numpy.log10(self.eps), self.n_lambdas)
+
+        path, self.val_scores_, self.active_counts_ = [], [], []
+        best_index, previous_lam = 0, lambda_max
+        for k, lam in enumerate(self.lambdas_):
+            # sequential strong rule, SNPs which fail it are checked with KKT conditions after the fit
+            candidates = numpy.abs(gradient) >= self.l1_ratio * (2 * lam - previous_lam)
+            while True:
+                candidates[block_snps] = False
+                new_snps = numpy.flatnonzero(candidates)
+                if new_snps.shape[0] > 0:
+                    columns += self._standardized(X, new_snps)
+                    if validate:
+                        val_columns += self._standardized(X_val, new_snps)
+                    block_snps = numpy.concatenate([block_snps, new_snps])
+                    penalties = numpy.concatenate([penalties, numpy.ones(new_snps.shape[0])])
+                    beta = numpy.concatenate([beta, numpy.zeros(new_snps.shape[0])])
+                intercept += self._solve(columns, penalties, beta, y, eta, lam)
+                gradient = self._gradient(X, y - (eta if self.family == 'gaussian' else _sigmoid(eta)))
+                candidates = numpy.abs(gradient) > self.l1_ratio * lam * (1 + 1e-6)
+                candidates[block_snps] = False
+                if not candidates.any():
+                    break
+                logging.info(f'lambda {k}: {candidates.sum()} SNPs violate KKT conditions')
+
+            active = beta[cov_count:] != 0
+            path.append((intercept, beta.copy()))
+            self.active_counts_.append(int(active.sum()))
+            if validate:
+                val_eta = intercept + sum(b * column for b, column in zip(beta, val_columns) if b != 0)
+                self.val_scores_.append(self._score(y_val, numpy.broadcast_to(val_eta, y_val.shape)))
+                if self.val_scores_[-1] > self.val_scores_[best_index]:
+                    best_index = k
+                elif k - best_index >= self.patience:
+                    break
+            else:
+                best_index = k
+            logging.info(f'lambda {k}: {lam:.5f}, active SNPs: {self.active_counts_[-1]}' +
+                         (f', val score: {self.val_scores_[-1]:.4f}' if validate else ''))
+            if self.active_counts_[-1] > self.max_active:
+                break
+            previous_lam = lam
+
+        self.best_index_ = best_index
+        self.lambda_ = self.lambdas_[best_index]
+        best_intercept, best_beta = path[best_index]
+        # SNPs are only appended to the block, so SNPs of the best lambda are the first ones
+        snps = block_snps[:best_beta.shape[0] - cov_count]
+        # weights of standardized features are converted to weights of raw genotypes and covariates
+        self.coef_ = numpy.zeros(snp_count)
+        self.coef_[snps] = best_beta[cov_count:] * self.scales_[snps]
+        self.intercept_ = best_intercept - self.coef_[snps] @ self.means_[snps]
+        self.cov_coef_ = None
+        if cov_count > 0:
+            self.cov_coef_ = best_beta[:cov_count] * cov_scales
+            self.intercept_ -= self.cov_coef_ @ cov_means
+        return self
+
+    def decision_function(self, X, X_cov: Optional[numpy.ndarray] = None) -> numpy.ndarray:
+        snps = numpy.flatnonzero(self.coef_)
+        eta = numpy.full(X.shape[0], self.intercept_)
+        if snps.shape[0] > 0:
+            eta += self._columns(X, snps) @ self.coef_[snps]
+        if self.cov_coef_ is not None:
+            eta += X_cov @ self.cov_coef_
+        return eta
+
+    def predict(self, X, X_cov: Optional[numpy.ndarray] = None) -> numpy.ndarray:
+        """Predicts phenotype for gaussian family and probability of case for binomial family"""
+        eta = self.decision_function(X, X_cov)
+        return eta if self.family == 'gaussian' else _sigmoid(eta)
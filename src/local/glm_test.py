@@ -0,0 +1,36 @@
+import numpy
+from local.glm import GenotypeGLMPath, column_dots
+from fl.datasets.packed import PackedGenotypes
+
+
+def _genotypes(sample_count: int, snp_count: int):
+    rng = numpy.random.default_rng(0)
+    array = rng.binomial(2, rng.uniform(0.1, 0.5, snp_count), size=(sample_count, snp_count)).astype(numpy.int8)
+    beta = numpy.zeros(snp_count)
+    beta[:5] = [1.0, -1.0, 0.8, 0.6, -0.5]
+    return rng, array, array @ beta
+
+
+def test_column_dots():
+    _, array, _ = _genotypes(50, 30)
+    vector = numpy.arange(50) / 50
+    assert numpy.allclose(column_dots(array, vector, block_size=7), array.T @ vector, rtol=1e-5)
+    assert numpy.allclose(column_dots(PackedGenotypes.from_hardcalls(array), vector, block_size=7), array.T @ vector, rtol=1e-5)
+
+
+def test_GenotypeGLMPath():
+    rng, array, eta = _genotypes(1500, 200)
+    y = eta + rng.normal(size=eta.shape[0]) * 0.5
+    train, val = slice(0, 1000), slice(1000, None)
+    model = GenotypeGLMPath(n_lambdas=50).fit(array[train], y[train], X_val=array[val], y_val=y[val])
+    assert set(numpy.flatnonzero(model.coef_)) >= set(range(5))
+    assert numpy.allclose(model.coef_[:5], [1.0, -1.0, 0.8, 0.6, -0.5], atol=0.15)
+    packed = PackedGenotypes.from_hardcalls(array)
+    packed_model = GenotypeGLMPath(n_lambdas=50).fit(PackedGenotypes(packed.packed[train], 200), y[train],
+                                                    X_val=PackedGenotypes(packed.packed[val], 200), y_val=y[val])
+    assert numpy.allclose(packed_model.coef_, model.coef_)
+
+    cases = (eta + rng.logistic(size=eta.shape[0]) > numpy.median(eta)).astype(numpy.float64)
+    classifier = GenotypeGLMPath(family='binomial', n_lambdas=50).fit(array[train], cases[train], X_val=array[val], y_val=cases[val])
+    assert max(classifier.val_scores_) > 0.7
+    assert set(numpy.flatnonzero(classifier.coef_)) >= set(range(5))
@@ -0,0 +1,221 @@
+import argparse
+import logging
+import sys
+import time
+from typing import Callable, Dict, Iterable, List
+
+import mlflow
+import numpy
+import scipy.sparse
+import torch
+from pytorch_lightning.trainer import Trainer
+from torch.utils.data import DataLoader, BatchSampler, RandomSampler
+
+from nn.memory import XyCovDataset, BatchXyCovDataset, SparseBatchXyCovDataset
+from nn.models import SparseLinear, LassoNetRegressor
+from nn.lightning import DataModule
+from nn.metrics_sink import get_metrics_sink
+from fl.federation.trainer import ClientTrainer
+from utils.loaders import X, Y
+
+
+def samples_per_second(loader_factory: Callable[[], Iterable], sample_count: int, epochs: int) -> float:
+    """Iterates over {epochs} epochs of freshly created loaders and returns loader throughput
+
+    Args:
+        loader_factory (Callable[[], Iterable]): Function which creates a loader yielding (x, y) batches
+        sample_count (int): Number of samples yielded by a loader in one epoch
+        epochs (int): Number of epochs
+
+    Returns:
+        float: Throughput in samples per second
+    """
+    start = time.perf_counter()
+    for _ in range(epochs):
+        for x, y in loader_factory():
+            pass
+    return sample_count * epochs / (time.perf_counter() - start)
+
+
+def benchmark_datasets(sample_count: int, snp_count: int, cov_count: int, batch_size: int, epochs: int):
+    rng = numpy.random.default_rng(0)
+    X = rng.integers(0, 3, size=(sample_count, snp_count), dtype=numpy.int8)
+    X_cov = rng.standard_normal(size=(sample_count, cov_count)).astype(numpy.float32)
+    y = rng.standard_normal(size=sample_count).astype(numpy.float32)
+    # both loaders drop the last incomplete batch, so they yield the same number of samples
+    epoch_samples = (sample_count // batch_size) * batch_size
+
+    sample_dataset = XyCovDataset(X, y, X_cov)
+    per_sample = samples_per_second(
+        lambda: DataLoader(sample_dataset, batch_size=batch_size, shuffle=True, drop_last=True),
+        epoch_samples, epochs
+    )
+    batch_dataset = BatchXyCovDataset(X, y, X_cov)
+    per_batch = samples_per_second(
+        lambda: DataLoader(batch_dataset, batch_size=None,
+                           sampler=BatchSampler(RandomSampler(batch_dataset), batch_size=batch_size, drop_last=True)),
+        epoch_samples, epochs
+    )
+    logging.info(f'{sample_count} samples, {snp_count} SNPs, {cov_count} covariates, batch size {batch_size}')
+    logging.info(f'XyCovDataset: {per_sample:.0f} samples/sec')
+    logging.info(f'BatchXyCovDataset: {per_batch:.0f} samples/sec, speedup {per_batch / per_sample:.1f}x')
+
+
+def _random_genotypes(rng: numpy.random.Generator, sample_count: int, snp_count: int, sparsity: float) -> numpy.ndarray:
+    # {sparsity} is a fraction of homozygous reference, i.e. zero, genotypes
+    genotypes = rng.integers(1, 3, size=(sample_count, snp_count), dtype=numpy.int8)
+    genotypes[rng.random(size=(sample_count, snp_count)) < sparsity] = 0
+    return genotypes
+
+
+def _first_layer_seconds(dataset: XyCovDataset, layer: SparseLinear, batch_size: int, epochs: int) -> float:
+    loader = DataLoader(dataset, batch_size=None,
+                        sampler=BatchSampler(RandomSampler(dataset), batch_size=batch_size, drop_last=True))
+    start = time.perf_counter()
+    for _ in range(epochs):
+        for x, y in loader:
+            layer.zero_grad()
+            layer(x).sum().backward()
+    return time.perf_counter() - start
+
+
+def benchmark_sparse(sample_count: int, snp_count: int, cov_count: int, hidden_size: int, batch_size: int, epochs: int,
+                     sparsities: List[float]):
+    """Measures training throughput of the first layer with dense and sparse genotype batches
+    for several sparsity levels and reports the sparsity from which sparse batches are faster
+    """
+    rng = numpy.random.default_rng(0)
+    X_cov = rng.standard_normal(size=(sample_count, cov_count)).astype(numpy.float32)
+    y = rng.standard_normal(size=sample_count).astype(numpy.float32)
+    layer = SparseLinear(snp_count + cov_count, hidden_size)
+    epoch_samples = (sample_count // batch_size) * batch_size
+    logging.info(f'{sample_count} samples, {snp_count} SNPs, {cov_count} covariates, hidden size {hidden_size}, batch size {batch_size}')
+
+    break_even = None
+    for sparsity in sorted(sparsities):
+        X = _random_genotypes(rng, sample_count, snp_count, sparsity)
+        X_sparse = scipy.sparse.csr_matrix(X)
+        dense_seconds = _first_layer_seconds(BatchXyCovDataset(X, y, X_cov), layer, batch_size, epochs)
+        sparse_seconds = _first_layer_seconds(SparseBatchXyCovDataset(X_sparse, y, X_cov), layer, batch_size, epochs)
+        memory_ratio = (X_sparse.data.nbytes + X_sparse.indices.nbytes + X_sparse.indptr.nbytes) / X.nbytes
+        logging.info(f'sparsity {sparsity:.3f}: dense {epoch_samples * epochs / dense_seconds:.0f} samples/sec, '
+                     f'sparse {epoch_samples * epochs / sparse_seconds:.0f} samples/sec, '
+                     f'CSR takes {memory_ratio:.2f} of int8 memory')
+        if break_even is None and sparse_seconds < dense_seconds:
+            break_even = sparsity
+    if break_even is None:
+        logging.info('sparse batches were not faster for any of the sparsity levels')
+    else:
+        logging.info(f'sparse batches are faster from {break_even:.3f} sparsity')
+
+
+def _round_model(input_size: int, cov_count: int, hidden_size: int, rounds: int) -> LassoNetRegressor:
+    torch.manual_seed(0)
+    return LassoNetRegressor(input_size, hidden_size,
+                             optim_params={'name': 'sgd', 'lr': 1e-3},
+                             scheduler_params={'rounds': rounds, 'epochs_in_round': 1, 'gamma': 0.999},
+                             cov_count=cov_count, alpha_start=-3, alpha_end=0.5)
+
+
+def _rounds_seconds(model: LassoNetRegressor, fit_round: Callable[[int], None], rounds: int) -> float:
+    model.train()
+    start = time.perf_counter()
+    for rnd in range(1, rounds + 1):
+        model.current_round = rnd
+        fit_round(rnd)
+    get_metrics_sink().flush()
+    return (time.perf_counter() - start) / rounds
+
+
+def _steps_seconds(model: LassoNetRegressor, batches: List, rounds: int) -> float:
+    # local steps alone, on batches gathered beforehand, are the compute part of a round
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-3)
+    model.train()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for batch_idx, batch in enumerate(batches):
+            optimizer.zero_grad(set_to_none=True)
+            model.training_step(batch, batch_idx)['loss'].backward()
+            optimizer.step()
+    return (time.perf_counter() - start) / rounds
+
+
+def benchmark_rounds(sample_count: int, snp_count: int, cov_count: int, hidden_size: int, batch_size: int,
+                     rounds: int, steps: int):
+    """Measures time of a federated round of LassoNetRegressor with {steps} local steps, when a new Lightning Trainer
+    is created every round as in FLClient with fit_loop=lightning and when ClientTrainer is kept between rounds,
+    and reports per-round overhead of both loops over the local steps themselves
+    """
+    rng = numpy.random.default_rng(0)
+    genotypes = rng.integers(0, 3, size=(sample_count, snp_count), dtype=numpy.int8)
+    covariates = rng.standard_normal(size=(sample_count, cov_count)).astype(numpy.float32)
+    target = rng.standard_normal(size=sample_count).astype(numpy.float32)
+    val_start, test_start = int(0.8*sample_count), int(0.9*sample_count)
+    if val_start < batch_size * steps:
+        logging.info(f'batch size {batch_size} is skipped, {val_start} train samples are less than {steps} batches')
+        return
+    split = lambda a: X(a[:val_start], a[val_start:test_start], a[test_start:])
+    datamodule = DataModule(split(genotypes), Y(target[:val_start], target[val_start:test_start], target[test_start:]),
+                            split(covariates), batch_size=batch_size)
+    # validation is excluded from both loops, one epoch of a round ends after {steps} steps
+    training = {'max_epochs': 1, 'max_steps': steps, 'check_val_every_n_epoch': 2, 'accelerator': 'cpu', 'devices': 1,
+                'enable_progress_bar': False, 'enable_model_summary': False, 'num_sanity_val_steps': 0,
+                'enable_checkpointing': False}
+    input_size = snp_count + cov_count
+    logging.info(f'{rounds} rounds of {steps} steps, {snp_count} SNPs, {cov_count} covariates, '
+                 f'hidden size {hidden_size}, batch size {batch_size}')
+
+    loader = iter(datamodule.train_dataloader())
+    batches = [next(loader) for _ in range(steps)]
+    steps_seconds = _steps_seconds(_round_model(input_size, cov_count, hidden_size, rounds), batches, rounds)
+
+    # training metrics are logged to an mlflow run of the configured tracking uri, like metrics of FL clients
+    with mlflow.start_run(run_name='benchmark_rounds'):
+        model = _round_model(input_size, cov_count, hidden_size, rounds)
+        lightning_seconds = _rounds_seconds(
+            model, lambda rnd: Trainer(logger=False, **training).fit(model, datamodule=datamodule), rounds
+        )
+        model = _round_model(input_size, cov_count, hidden_size, rounds)
+        trainer = ClientTrainer(model, datamodule, **training)
+        persistent_seconds = _rounds_seconds(model, lambda rnd: trainer.fit(), rounds)
+
+    logging.info(f'local steps: {1000*steps_seconds:.1f} ms/round')
+    logging.info(f'Lightning Trainer every round: {1000*lightning_seconds:.1f} ms/round, '
+                 f'overhead {1000*(lightning_seconds - steps_seconds):.1f} ms/round')
+    logging.info(f'persistent ClientTrainer: {1000*persistent_seconds:.1f} ms/round, '
+                 f'overhead {1000*(persistent_seconds - steps_seconds):.1f} ms/round, '
+                 f'speedup {lightning_seconds / persistent_seconds:.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of genotype datasets and models')
+    parser.add_argument('benchmark', choices=['datasets', 'sparse', 'rounds'],
+                        help='datasets compares per-sample and batch-level datasets, sparse finds break-even sparsity of sparse batches, '
+                             'rounds compares per-round overhead of Lightning Trainer and persistent ClientTrainer in FL client')
+    parser.add_argument('--sample-count', type=int, default=20000)
+    parser.add_argument('--snp-count', type=int, default=10000)
+    parser.add_argument('--cov-count', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[64, 1024, 20000],
+                        help='One or several batch sizes, the largest one corresponds to full-batch training')
+    parser.add_argument('--hidden-size', type=int, default=256, help='Output size of the first layer in sparse benchmark')
+    parser.add_argument('--sparsity', type=float, nargs='+', default=[0.5, 0.7, 0.8, 0.9, 0.95, 0.98, 0.99],
+                        help='Fractions of zero genotypes in sparse benchmark')
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--rounds', type=int, default=20, help='Number of FL rounds in rounds benchmark')
+    parser.add_argument('--steps', type=int, default=4, help='Number of local steps of a round in rounds benchmark')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        stream=sys.stdout,
+                        format='%(asctime)s %(levelname)-8s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+
+    for batch_size in args.batch_size:
+        if args.benchmark == 'datasets':
+            benchmark_datasets(args.sample_count, args.snp_count, args.cov_count, batch_size, args.epochs)
+        elif args.benchmark == 'rounds':
+            benchmark_rounds(args.sample_count, args.snp_count, args.cov_count, args.hidden_size, batch_size,
+                             args.rounds, args.steps)
+        else:
+            benchmark_sparse(args.sample_count, args.snp_count, args.cov_count, args.hidden_size, batch_size,
+                             args.epochs, args.sparsity)
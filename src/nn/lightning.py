@@ -1,10 +1,13 @@
-from typing import List
+from typing import Dict, List, Optional, Union
 import numpy
+import scipy.sparse
 from pytorch_lightning import LightningDataModule
-from torch.utils.data import TensorDataset, DataLoader, WeightedRandomSampler
+from torch.utils.data import TensorDataset, DataLoader, IterableDataset, WeightedRandomSampler, BatchSampler, RandomSampler, SequentialSampler, Sampler
 
 from utils.loaders import X, Y
-from .memory import XyCovDataset
+from fl.datasets.standardize import Standardization
+from fl.datasets.stream import GenotypeStream
+from .memory import XyCovDataset, BatchXyCovDataset, SparseBatchXyCovDataset, StreamingXyCovDataset, FullBatchLoader
 
 
 NArr = numpy.ndarray
@@ -12,15 +15,40 @@ NArr = numpy.ndarray
 
 class DataModule(LightningDataModule):
     def __init__(
-        self, x: X, y: Y, x_cov: X = None, sample_weights: Y = None, batch_size: int = None, drop_last: bool = True
+        self, x: X, y: Y, x_cov: X = None, sample_weights: Y = None, batch_size: int = None, drop_last: bool = True,
+        standardization: Optional[Standardization] = None
     ):
         super().__init__()
-        self.train_dataset = XyCovDataset(x.train, y.train, x_cov.train if x_cov is not None else None)
-        self.val_dataset = XyCovDataset(x.val, y.val, x_cov.val if x_cov is not None else None)
-        self.test_dataset = XyCovDataset(x.test, y.test, x_cov.test if x_cov is not None else None)
+        # standardization is computed once before training and applied to train, val and test batches during loading
+        if isinstance(x.train, GenotypeStream):
+            if sample_weights is not None and any(sw is not None for sw in [sample_weights.train, sample_weights.val, sample_weights.test]):
+                raise ValueError('sample weights are not supported for streamed genotypes')
+            if batch_size is None:
+                raise ValueError('streamed genotypes do not fit into one batch, batch_size is required for them')
+            self.train_dataset = StreamingXyCovDataset(x.train, y.train, x_cov.train if x_cov is not None else None,
+                                                       batch_size=batch_size, shuffle=True, drop_last=drop_last,
+                                                       standardization=standardization)
+            self.val_dataset = StreamingXyCovDataset(x.val, y.val, x_cov.val if x_cov is not None else None,
+                                                     batch_size=batch_size, drop_last=drop_last, standardization=standardization)
+            self.test_dataset = StreamingXyCovDataset(x.test, y.test, x_cov.test if x_cov is not None else None,
+                                                      batch_size=batch_size, drop_last=drop_last, standardization=standardization)
+        elif scipy.sparse.issparse(x.train):
+            # sparse genotypes are fed to models as torch sparse batches
+            if standardization is not None:
+                raise ValueError('centering densifies sparse genotypes, standardization is not supported for them')
+            self.train_dataset = SparseBatchXyCovDataset(x.train, y.train, x_cov.train if x_cov is not None else None)
+            self.val_dataset = SparseBatchXyCovDataset(x.val, y.val, x_cov.val if x_cov is not None else None)
+            self.test_dataset = SparseBatchXyCovDataset(x.test, y.test, x_cov.test if x_cov is not None else None)
+        else:
+            self.train_dataset = BatchXyCovDataset(x.train, y.train, x_cov.train if x_cov is not None else None, standardization)
+            self.val_dataset = BatchXyCovDataset(x.val, y.val, x_cov.val if x_cov is not None else None, standardization)
+            self.test_dataset = BatchXyCovDataset(x.test, y.test, x_cov.test if x_cov is not None else None, standardization)
         self.sw = sample_weights
+        # batch_size of None means full-batch training, i.e. each loader yields all samples of its dataset as one batch
         self.batch_size = batch_size
         self.drop_last = drop_last
+        # resident batches of datasets which fit into one batch, keys are ids of datasets
+        self.full_batch_loaders: Dict[int, FullBatchLoader] = {}
 
     def update_y(self, y: Y):
         assert self.train_dataset.y.shape[0] == y.train.shape[0]
@@ -30,37 +58,51 @@ class DataModule(LightningDataModule):
         self.train_dataset.y = y.train
         self.val_dataset.y = y.val
         self.test_dataset.y = y.test
-
-    def train_dataloader(self) -> DataLoader:
-        loader = DataLoader(
-            self.train_dataset, batch_size=self.batch_size, shuffle=True, num_workers=0, drop_last=self.drop_last
-        )
-        return loader
-
-    def val_dataloader(self) -> DataLoader:
+        self.full_batch_loaders = {}
+
+    def _is_full_batch(self, dataset: XyCovDataset, sampler: Sampler, drop_last: bool) -> bool:
+        # the only batch of the loader has all samples of the dataset, their order does not matter for full-batch training;
+        # weighted sampling draws a different multiset of samples every epoch, so it is not a full batch
+        if not isinstance(dataset, BatchXyCovDataset) or isinstance(sampler, WeightedRandomSampler) or len(dataset) == 0:
+            return False
+        batch_size = self._batch_size(dataset)
+        return batch_size == len(dataset) or (batch_size > len(dataset) and not drop_last)
+
+    def _batch_size(self, dataset: XyCovDataset) -> int:
+        return len(dataset) if self.batch_size is None else self.batch_size
+
+    def _batch_loader(self, dataset: XyCovDataset, sampler: Sampler, drop_last: bool) -> Union[DataLoader, FullBatchLoader]:
+        if isinstance(dataset, IterableDataset):
+            # streaming datasets batch, shuffle and drop samples themselves
+            return DataLoader(dataset, batch_size=None, num_workers=0)
+        if self._is_full_batch(dataset, sampler, drop_last):
+            if id(dataset) not in self.full_batch_loaders:
+                self.full_batch_loaders[id(dataset)] = FullBatchLoader(dataset)
+            return self.full_batch_loaders[id(dataset)]
+        # dataset is indexed by lists of indices from BatchSampler and returns whole batches,
+        # therefore automatic batching of DataLoader is disabled with batch_size=None
+        batch_sampler = BatchSampler(sampler, batch_size=max(1, self._batch_size(dataset)), drop_last=drop_last)
+        return DataLoader(dataset, batch_size=None, sampler=batch_sampler, num_workers=0)
+
+    def _weighted_sampler(self, sw: numpy.ndarray) -> WeightedRandomSampler:
+        return WeightedRandomSampler(sw, num_samples=int(sw.shape[0]*sw.mean()), replacement=True)
+
+    def train_dataloader(self) -> Union[DataLoader, FullBatchLoader]:
+        return self._batch_loader(self.train_dataset, RandomSampler(self.train_dataset), self.drop_last)
+
+    def val_dataloader(self) -> Union[DataLoader, FullBatchLoader]:
         if self.sw is not None and self.sw.val is not None:
-            sampler = WeightedRandomSampler(self.sw.val, num_samples=int(self.sw.val.shape[0]*self.sw.val.mean()), replacement=True)
-            loader = DataLoader(self.val_dataset, batch_size=self.batch_size, sampler=sampler)
-        else:
-            loader = DataLoader(
-                self.val_dataset, batch_size=self.batch_size, shuffle=False, num_workers=0, drop_last=self.drop_last
-            )
-        return loader
+            return self._batch_loader(self.val_dataset, self._weighted_sampler(self.sw.val), drop_last=False)
+        return self._batch_loader(self.val_dataset, SequentialSampler(self.val_dataset), self.drop_last)
 
-    def test_dataloader(self) -> DataLoader:
+    def test_dataloader(self) -> Union[DataLoader, FullBatchLoader]:
         if self.sw is not None and self.sw.test is not None:
-            sampler = WeightedRandomSampler(self.sw.test, num_samples=int(self.sw.test.shape[0]*self.sw.test.mean()), replacement=True)
-            loader = DataLoader(self.test_dataset, batch_size=self.batch_size, sampler=sampler)
-        else:
-            loader = DataLoader(
-                self.test_dataset, batch_size=self.batch_size, shuffle=False, num_workers=0, drop_last=self.drop_last
-            )
-        return loader
+            return self._batch_loader(self.test_dataset, self._weighted_sampler(self.sw.test), drop_last=False)
+        return self._batch_loader(self.test_dataset, SequentialSampler(self.test_dataset), self.drop_last)
 
     def predict_dataloader(self) -> List[DataLoader]:
         if self.sw is not None and self.sw.train is not None:
-            sampler = WeightedRandomSampler(self.sw.train, num_samples=int(self.sw.train.shape[0]*self.sw.train.mean()), replacement=True)
-            train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, sampler=sampler)
+            train_loader = self._batch_loader(self.train_dataset, self._weighted_sampler(self.sw.train), drop_last=False)
         else:
             train_loader = self.train_dataloader()
         val_loader = self.val_dataloader()
@@ -68,22 +110,27 @@ class DataModule(LightningDataModule):
         return [train_loader, val_loader, test_loader]
 
     def _dataset_len(self, dataset: TensorDataset):
-        return len(dataset) // self.batch_size + int(len(dataset) % self.batch_size > 0)
+        batch_size = max(1, self._batch_size(dataset))
+        return len(dataset) // batch_size + int(len(dataset) % batch_size > 0)
 
     def train_len(self):
         if self.sw is not None and self.sw.train is not None:
             return int(self.sw.train.shape[0]*self.sw.train.mean())
-        return len(self.train_dataset)
+        return self._sample_count(self.train_dataset)
 
     def val_len(self):
         if self.sw is not None and self.sw.val is not None:
             return int(self.sw.val.shape[0]*self.sw.val.mean())
-        return len(self.val_dataset)
+        return self._sample_count(self.val_dataset)
 
     def test_len(self):
         if self.sw is not None and self.sw.test is not None:
             return int(self.sw.test.shape[0]*self.sw.test.mean())
-        return len(self.test_dataset)
+        return self._sample_count(self.test_dataset)
+
+    def _sample_count(self, dataset: XyCovDataset) -> int:
+        # length of streaming datasets is a number of batches
+        return len(dataset.stream) if isinstance(dataset, StreamingXyCovDataset) else len(dataset)
 
     def feature_count(self):
         return self.train_dataset.feature_count()
@@ -0,0 +1,29 @@
+import numpy
+import torch
+
+from utils.loaders import X, Y
+from fl.datasets.standardize import Standardization
+from nn.lightning import DataModule
+from nn.memory import FullBatchLoader
+from nn.models import LinearClassifier
+
+
+def test_DataModule_full_batch():
+    random = numpy.random.RandomState(0)
+    genotypes = random.randint(0, 3, size=(50, 6)).astype(numpy.int8)
+    x = X(genotypes[:30], genotypes[30:40], genotypes[40:])
+    y = Y(*[(part[:, 0] > 0).astype(numpy.float32) for part in [x.train, x.val, x.test]])
+    x_cov = X(*[random.randn(len(part), 2).astype(numpy.float32) for part in [x.train, x.val, x.test]])
+    standardization = Standardization(numpy.ones(8, dtype=numpy.float32), numpy.full(8, 2.0, dtype=numpy.float32))
+    torch.manual_seed(0)
+    model = LinearClassifier(8, l1=0.0, lr=0.1, momentum=0.0, epochs=1)
+
+    # batch_size of None means one batch with all samples of the dataset
+    full_batch = DataModule(x, y, x_cov, standardization=standardization)
+    assert isinstance(full_batch.train_dataloader(), FullBatchLoader)
+    batched = DataModule(x, y, x_cov, batch_size=4, drop_last=False, standardization=standardization)
+    for full_batch_loader, batch_loader in zip(full_batch.predict_dataloader()[1:], batched.predict_dataloader()[1:]):
+        assert isinstance(full_batch_loader, FullBatchLoader) and len(batch_loader) == 3
+        full_batch_pred, full_batch_true = model.predict(full_batch_loader)
+        batch_pred, batch_true = model.predict(batch_loader)
+        assert torch.allclose(full_batch_pred, batch_pred) and torch.equal(full_batch_true, batch_true)
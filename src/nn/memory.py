@@ -1,5 +1,13 @@
+import queue
+import threading
 import numpy
-from typing import Tuple
+import scipy.sparse
+import torch
+from torch.utils.data import IterableDataset
+from typing import Iterator, List, Optional, Tuple
+
+from fl.datasets.standardize import Standardization
+from fl.datasets.stream import GenotypeStream
 
 
 class XyCovDataset:
@@ -16,9 +24,162 @@ class XyCovDataset:
             return numpy.hstack([self.X[idx, :].astype(numpy.float32), self.X_cov[idx, :].astype(numpy.float32)]), self.y[idx]
         else:
             return self.X[idx, :].astype(numpy.float32), self.y[idx]
-    
+
     def feature_count(self) -> int:
         return self.X.shape[1] if self.X_cov is None else self.X.shape[1] + self.X_cov.shape[1]
 
     def covariate_count(self) -> int:
-        return self.X_cov.shape[1] if self.X_cov is not None else 0
\ No newline at end of file
+        return self.X_cov.shape[1] if self.X_cov is not None else 0
+
+
+class BatchXyCovDataset(XyCovDataset):
+    """XyCovDataset which is indexed by a whole batch of sample indices, e.g. by torch BatchSampler.
+    A batch is gathered with one fancy-indexing operation per block and converted to float32
+    directly into the batch feature matrix, so there is no per-sample Python loop and no collation.
+    If {standardization} is set, the batch is standardized in place right after conversion.
+    """
+    def __init__(self, X: numpy.ndarray, y: numpy.ndarray, X_cov: numpy.ndarray = None,
+                 standardization: Optional[Standardization] = None) -> None:
+        super().__init__(X, y, X_cov)
+        if standardization is not None and len(standardization) != self.feature_count():
+            raise ValueError(f'standardization of {len(standardization)} features does not match {self.feature_count()} features')
+        self.standardization = standardization
+
+    def __getitem__(self, indices: List[int]) -> Tuple[torch.Tensor, torch.Tensor]:
+        indices = numpy.asarray(indices)
+        snp_count = self.X.shape[1]
+        # a new buffer for each batch, because lightning prefetches the next batch while the current one is in use
+        x = torch.empty((indices.shape[0], self.feature_count()), dtype=torch.float32)
+        x_numpy = x.numpy()
+        x_numpy[:, :snp_count] = self.X[indices, :]
+        if self.X_cov is not None:
+            x_numpy[:, snp_count:] = self.X_cov[indices, :]
+        if self.standardization is not None:
+            self.standardization.apply_(x_numpy)
+        return x, torch.as_tensor(self.y[indices])
+
+
+class FullBatchLoader:
+    """Loader which yields the whole BatchXyCovDataset as one batch. Float32 features and targets are gathered,
+    converted and standardized once and stay in memory, so epochs of full-batch training do not repeat it.
+    It is used in place of DataLoader, since there is nothing to sample, shuffle or collate.
+    """
+    def __init__(self, dataset: BatchXyCovDataset) -> None:
+        self.batch = dataset[numpy.arange(len(dataset))]
+
+    def __len__(self) -> int:
+        return 1
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+        yield self.batch
+
+
+class SparseBatchXyCovDataset(XyCovDataset):
+    """BatchXyCovDataset counterpart for genotypes stored as scipy.sparse.csr_matrix.
+    A batch of genotype rows is sliced from CSR matrix, dense covariates are appended as extra columns
+    and the batch is returned as a float32 torch sparse CSR tensor for sparse-aware first layers of models.
+    """
+    def __getitem__(self, indices: List[int]) -> Tuple[torch.Tensor, torch.Tensor]:
+        indices = numpy.asarray(indices)
+        rows = self.X[indices, :]
+        if self.X_cov is not None:
+            rows = scipy.sparse.hstack([rows, scipy.sparse.csr_matrix(self.X_cov[indices, :])], format='csr')
+        x = torch.sparse_csr_tensor(torch.from_numpy(rows.indptr.astype(numpy.int64)),
+                                    torch.from_numpy(rows.indices.astype(numpy.int64)),
+                                    torch.from_numpy(rows.data.astype(numpy.float32)),
+                                    size=rows.shape)
+        return x, torch.as_tensor(self.y[indices])
+
+
+class StreamingXyCovDataset(IterableDataset):
+    def __init__(self, stream: GenotypeStream, y: numpy.ndarray, X_cov: numpy.ndarray = None, batch_size: int = 1,
+                 shuffle: bool = False, drop_last: bool = False, standardization: Optional[Standardization] = None) -> None:
+        """Iterable dataset which yields float32 batches of genotypes decoded from .pgen on demand.
+        A background thread decodes the next sample blocks while batches of the current block are consumed,
+        so at most {stream.prefetch_blocks} + 2 blocks of int8 genotypes are held in memory.
+
+        Args:
+            stream (GenotypeStream): Genotypes of the split
+            y (numpy.ndarray): Targets
+            X_cov (numpy.ndarray, optional): Covariates which are appended to genotypes. Defaults to None.
+            batch_size (int, optional): Size of batches. Blocks are rounded up to a multiple of it. Defaults to 1.
+            shuffle (bool, optional): Whether to read samples in a random order in every epoch. Defaults to False.
+            drop_last (bool, optional): Whether to drop the last incomplete batch. Defaults to False.
+            standardization (Standardization, optional): Shift and scale of features applied to every batch. Defaults to None.
+        """
+        self.stream = stream
+        self.y = y
+        self.X_cov = X_cov
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.block_size = -(-stream.block_size // batch_size) * batch_size
+        if standardization is not None and len(standardization) != self.feature_count():
+            raise ValueError(f'standardization of {len(standardization)} features does not match {self.feature_count()} features')
+        self.standardization = standardization
+
+    def __len__(self) -> int:
+        # number of batches, since DataLoader does not batch this dataset
+        if self.drop_last:
+            return len(self.stream) // self.batch_size
+        return -(-len(self.stream) // self.batch_size)
+
+    def feature_count(self) -> int:
+        return self.stream.snp_count + self.covariate_count()
+
+    def covariate_count(self) -> int:
+        return self.X_cov.shape[1] if self.X_cov is not None else 0
+
+    def _read_blocks(self, positions: numpy.ndarray, blocks: queue.Queue, stop: threading.Event):
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    blocks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for block in self.stream.read_blocks(positions, self.block_size):
+                if not put(block):
+                    return
+            put(None)
+        except Exception as e:
+            put(e)
+
+    def _block_batches(self, block_positions: numpy.ndarray, genotypes: numpy.ndarray) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+        order = numpy.random.permutation(len(block_positions)) if self.shuffle else numpy.arange(len(block_positions))
+        snp_count = genotypes.shape[1]
+        for start in range(0, len(order), self.batch_size):
+            rows = order[start: start + self.batch_size]
+            if self.drop_last and len(rows) < self.batch_size:
+                return
+            positions = block_positions[rows]
+            x = torch.empty((len(rows), self.feature_count()), dtype=torch.float32)
+            x_numpy = x.numpy()
+            x_numpy[:, :snp_count] = genotypes[rows, :]
+            if self.X_cov is not None:
+                x_numpy[:, snp_count:] = self.X_cov[positions, :]
+            if self.standardization is not None:
+                self.standardization.apply_(x_numpy)
+            yield x, torch.as_tensor(self.y[positions])
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+        positions = numpy.random.permutation(len(self.stream)) if self.shuffle else numpy.arange(len(self.stream))
+        blocks = queue.Queue(maxsize=self.stream.prefetch_blocks)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read_blocks, args=(positions, blocks, stop), daemon=True)
+        reader.start()
+        try:
+            while True:
+                block = blocks.get()
+                if block is None:
+                    break
+                if isinstance(block, Exception):
+                    raise block
+                yield from self._block_batches(*block)
+        finally:
+            # iteration can be interrupted, e.g. by limit_train_batches, so the reader thread is stopped explicitly
+            stop.set()
+            reader.join()
@@ -3,6 +3,8 @@ from abc import ABC, abstractmethod
 from dataclasses import dataclass
 
 import numpy
+import torch
+from torch.nn.functional import binary_cross_entropy_with_logits, cross_entropy
 
 
 class DatasetMetrics(ABC):
@@ -41,6 +43,185 @@ class RegMetrics(DatasetMetrics):
         return f'loss={self.loss:.4f}\tr2={self.r2:.4f}'
 
 
+def roc_auc(scores: torch.Tensor, labels: torch.Tensor, block_size: int = 64) -> torch.Tensor:
+    """Calculates ROC AUC of every column of {scores} as normalized Mann-Whitney U statistic, like sklearn roc_auc_score.
+    Columns are sorted block by block with one torch.sort call per block, tied scores get their average rank.
+
+    Args:
+        scores (torch.Tensor): Scores or logits with shape (n, columns)
+        labels (torch.Tensor): Binary labels with shape (n,)
+        block_size (int, optional): Number of columns sorted at once. Defaults to 64.
+
+    Returns:
+        torch.Tensor: float64 AUC of every column, it is nan if {labels} have only one class
+    """
+    labels = labels.detach().reshape(-1).to(device=scores.device, dtype=torch.float64)
+    positives = labels.sum()
+    negatives = labels.shape[0] - positives
+    positions = torch.arange(scores.shape[0], device=scores.device).unsqueeze(1)
+    aucs = []
+    for start in range(0, scores.shape[1], block_size):
+        sorted_scores, order = torch.sort(scores[:, start: start + block_size].detach(), dim=0)
+        # first and last position of the group of equal scores for each sorted score
+        group_start = torch.ones_like(sorted_scores, dtype=torch.bool)
+        group_start[1:] = sorted_scores[1:] != sorted_scores[:-1]
+        group_end = torch.ones_like(group_start)
+        group_end[:-1] = group_start[1:]
+        first = torch.cummax(torch.where(group_start, positions, 0), dim=0).values
+        last = torch.cummin(torch.where(group_end, positions, scores.shape[0]).flip(0), dim=0).values.flip(0)
+        ranks = (first + last).double() / 2 + 1
+        positive_ranks = (ranks * labels[order]).sum(dim=0)
+        aucs.append((positive_ranks - positives * (positives + 1) / 2) / (positives * negatives))
+    return torch.cat(aucs)
+
+
+class RegMetricsAccumulator:
+    """Accumulates squared errors of every output column and moments of targets batch by batch,
+    so MSE and R2 of all LassoNet alphas are computed in one pass without tiling targets or concatenating predictions.
+    Sums stay on the device of predictions and are transferred once in {metrics}.
+    """
+    def __init__(self) -> None:
+        self.samples = 0
+        self.squared_errors = None
+        self.y_mean = None
+        # sum of squared deviations of targets from their mean, it is merged over batches like in Chan's algorithm
+        self.y_m2 = None
+
+    def update(self, y_pred: torch.Tensor, y_true: torch.Tensor):
+        """Adds batch of {y_pred} with shape (n, outputs) and targets {y_true} with shape (n,)"""
+        y_pred, y_true = y_pred.detach().double(), y_true.detach().double().reshape(-1)
+        batch_size = y_true.shape[0]
+        if batch_size == 0:
+            return
+        squared_errors = (y_pred - y_true.unsqueeze(1)).square_().sum(dim=0)
+        batch_mean = y_true.mean()
+        batch_m2 = (y_true - batch_mean).square_().sum()
+        if self.samples == 0:
+            self.squared_errors, self.y_mean, self.y_m2 = squared_errors, batch_mean, batch_m2
+        else:
+            total = self.samples + batch_size
+            delta = batch_mean - self.y_mean
+            self.squared_errors += squared_errors
+            self.y_mean += delta * batch_size / total
+            self.y_m2 += batch_m2 + delta.square() * self.samples * batch_size / total
+        self.samples += batch_size
+
+    def metrics(self, epoch: int) -> List[RegMetrics]:
+        losses = self.squared_errors / self.samples
+        r2s = 1 - self.squared_errors / self.y_m2
+        return [RegMetrics(loss, r2, epoch, self.samples) for loss, r2 in zip(losses.tolist(), r2s.tolist())]
+
+
+class AucSketch:
+    """Histograms of scores of positive and negative samples of every column with {bins} bins of equal width
+    in probability. Scores of a column are standardized by mean and std of the first batch before sigmoid,
+    so bins cover scores of any scale. ROC AUC is computed from the histograms in constant memory as if scores
+    in one bin were tied, so its error is at most a half of the fraction of positive-negative pairs which share a bin.
+    """
+    def __init__(self, bins: int = 4096) -> None:
+        self.bins = bins
+        self.center = None
+        self.scale = None
+        self.positives = None
+        self.negatives = None
+
+    def update(self, scores: torch.Tensor, labels: torch.Tensor):
+        """Adds batch of {scores} or logits with shape (n, columns) and binary {labels} with shape (n,)"""
+        scores = scores.detach().double()
+        columns = scores.shape[1]
+        if self.positives is None:
+            self.center = scores.mean(dim=0)
+            # std is nan for a batch of one sample and zero for constant scores, then scores are only centered
+            scale = scores.std(dim=0)
+            self.scale = torch.where(scale > 0, scale, torch.ones_like(scale))
+            self.positives = torch.zeros(columns * self.bins, dtype=torch.int64, device=scores.device)
+            self.negatives = torch.zeros_like(self.positives)
+        bins = (torch.sigmoid((scores - self.center) / self.scale) * self.bins).long().clamp_(max=self.bins - 1)
+        # bins of all columns are counted with one bincount call per class
+        index = bins + torch.arange(columns, device=scores.device) * self.bins
+        positive = labels.detach().reshape(-1).to(scores.device) > 0.5
+        self.positives += torch.bincount(index[positive].reshape(-1), minlength=self.positives.shape[0])
+        self.negatives += torch.bincount(index[~positive].reshape(-1), minlength=self.negatives.shape[0])
+
+    def auc(self) -> torch.Tensor:
+        """Returns float64 AUC of every column, it is nan if labels have only one class"""
+        positives = self.positives.view(-1, self.bins).double()
+        negatives = self.negatives.view(-1, self.bins).double()
+        negatives_below = torch.cumsum(negatives, dim=1) - negatives
+        pairs = (positives * (negatives_below + negatives / 2)).sum(dim=1)
+        return pairs / (positives.sum(dim=1) * negatives.sum(dim=1))
+
+
+class ClfMetricsAccumulator:
+    """Accumulates binary cross-entropy, number of correct predictions and AUC sketch of every output column
+    batch by batch. Loss and accuracy are the same as of LassoNetClassifier.loader_metrics, AUC is approximated by AucSketch.
+    """
+    def __init__(self, auc_bins: int = 4096) -> None:
+        self.samples = 0
+        self.losses = None
+        self.correct = None
+        self.auc_sketch = AucSketch(auc_bins)
+
+    def update(self, y_pred: torch.Tensor, y_true: torch.Tensor):
+        """Adds batch of logits {y_pred} with shape (n, outputs) and binary targets {y_true} with shape (n,)"""
+        y_pred, y_true = y_pred.detach(), y_true.detach().reshape(-1).to(y_pred.device)
+        batch_size = y_true.shape[0]
+        if batch_size == 0:
+            return
+        y = y_true.unsqueeze(1).expand_as(y_pred).double()
+        losses = binary_cross_entropy_with_logits(y_pred.double(), y, reduction='none').sum(dim=0)
+        correct = ((y_pred > 0.5).double() == y).sum(dim=0)
+        if self.samples == 0:
+            self.losses, self.correct = losses, correct
+        else:
+            self.losses += losses
+            self.correct += correct
+        self.auc_sketch.update(y_pred, y_true)
+        self.samples += batch_size
+
+    def metrics(self, epoch: int) -> List[ClfMetrics]:
+        losses = self.losses / self.samples
+        accuracies = self.correct / self.samples
+        aucs = self.auc_sketch.auc()
+        return [ClfMetrics(loss, accuracy, auc, epoch, self.samples)
+                for loss, accuracy, auc in zip(losses.tolist(), accuracies.tolist(), aucs.tolist())]
+
+
+class MulticlassMetricsAccumulator:
+    """Accumulates cross-entropy and number of correct predictions of every output column batch by batch,
+    e.g. of members of MLPEnsembleClassifier. AUC is not defined for many classes and is nan.
+    """
+    def __init__(self) -> None:
+        self.samples = 0
+        self.losses = None
+        self.correct = None
+
+    def update(self, y_pred: torch.Tensor, y_true: torch.Tensor):
+        """Adds batch of logits {y_pred} with shape (n, classes, outputs) or (n, classes) for a single output
+        and class indices {y_true} with shape (n,)"""
+        y_pred, y_true = y_pred.detach(), y_true.detach().reshape(-1).to(y_pred.device).long()
+        if y_pred.dim() == 2:
+            y_pred = y_pred.unsqueeze(2)
+        batch_size = y_true.shape[0]
+        if batch_size == 0:
+            return
+        y = y_true.unsqueeze(1).expand(batch_size, y_pred.shape[2])
+        losses = cross_entropy(y_pred.double(), y, reduction='none').sum(dim=0)
+        correct = (y_pred.argmax(dim=1) == y).double().sum(dim=0)
+        if self.samples == 0:
+            self.losses, self.correct = losses, correct
+        else:
+            self.losses += losses
+            self.correct += correct
+        self.samples += batch_size
+
+    def metrics(self, epoch: int) -> List[ClfMetrics]:
+        losses = self.losses / self.samples
+        accuracies = self.correct / self.samples
+        return [ClfMetrics(loss, accuracy, float('nan'), epoch, self.samples)
+                for loss, accuracy in zip(losses.tolist(), accuracies.tolist())]
+
+
 @dataclass
 class ModelMetrics:
 
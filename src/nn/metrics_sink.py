@@ -0,0 +1,133 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import mlflow
+from mlflow.entities import Metric
+from mlflow.tracking.client import MlflowClient
+
+
+# mlflow accepts at most 1000 metrics in one log_batch request
+MAX_BATCH_SIZE = 1000
+POLICIES = ['drop', 'block']
+# marker enqueued by flush, the batch with it is sent without waiting for flush_interval
+_FLUSH = object()
+
+
+class MetricsSink:
+    def __init__(self, max_queue_size: int = 100000, flush_interval: float = 1.0, policy: str = 'drop',
+                 client: Optional[MlflowClient] = None) -> None:
+        """Logs mlflow metrics from a bounded in-memory queue in a background thread with log_batch requests,
+        so training steps do not wait for a round-trip to tracking server for every metric.
+        Run of a metric is the active run at the moment of logging, unless run_id is given.
+
+        Args:
+            max_queue_size (int, optional): Maximum number of metrics waiting to be sent. Defaults to 100000.
+            flush_interval (float, optional): Maximum time in seconds a metric waits for a batch. Defaults to 1.0.
+            policy (str, optional): What to do with a metric when the queue is full: 'drop' it
+                or 'block' the caller until there is space in the queue. Defaults to 'drop'.
+            client (Optional[MlflowClient], optional): Client of tracking server. Defaults to None, i.e. a new client.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f'policy should be one of {POLICIES}')
+        self.policy = policy
+        self.flush_interval = flush_interval
+        self.client = client if client is not None else MlflowClient()
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        # number of metrics dropped since the queue was drained last time, it is reported and reset after draining
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def log_metric(self, key: str, value, step: Optional[int] = None, run_id: Optional[str] = None):
+        """Enqueues metric {key} of run {run_id} or of the active run. {value} can be a 0-dim torch tensor,
+        it is converted to float in the background thread, so the caller does not wait for device synchronization
+        """
+        self.log_metrics({key: value}, step, run_id)
+
+    def log_metrics(self, metrics: Dict[str, float], step: Optional[int] = None, run_id: Optional[str] = None):
+        if run_id is None:
+            run = mlflow.active_run()
+            if run is None:
+                # mlflow starts a run for metrics logged without one, it is done in the caller thread as before
+                mlflow.log_metrics({key: float(value) for key, value in metrics.items()}, step)
+                return
+            run_id = run.info.run_id
+        timestamp = int(time.time() * 1000)
+        for key, value in metrics.items():
+            item = (run_id, key, value, timestamp, step or 0)
+            if self.policy == 'block':
+                self.queue.put(item)
+                continue
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                with self.dropped_lock:
+                    self.dropped += 1
+                    first_dropped = self.dropped == 1
+                if first_dropped:
+                    logging.warning(f'metrics queue is full, metrics are dropped until it is drained')
+
+    def flush(self):
+        """Sends enqueued metrics without waiting for flush_interval and waits until they are sent"""
+        self.queue.put(_FLUSH)
+        self.queue.join()
+        self._report_dropped()
+
+    def _report_dropped(self):
+        with self.dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped > 0:
+            logging.warning(f'{dropped} metrics were dropped while metrics queue was full')
+
+    def _next_batch(self) -> List[Tuple]:
+        items = [self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while items[-1] is not _FLUSH and len(items) < MAX_BATCH_SIZE:
+            try:
+                items.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return items
+
+    def _drain(self):
+        while True:
+            items = self._next_batch()
+            try:
+                runs: Dict[str, List[Metric]] = {}
+                for item in items:
+                    if item is _FLUSH:
+                        continue
+                    run_id, key, value, timestamp, step = item
+                    runs.setdefault(run_id, []).append(Metric(key, float(value), timestamp, step))
+                for run_id, metrics in runs.items():
+                    self.client.log_batch(run_id, metrics=metrics)
+            except Exception as e:
+                # tracking server errors should not stop training, metrics of the batch are lost
+                logging.error(f'{len(items)} metrics were not logged to mlflow: {e}')
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+            if self.queue.empty():
+                # backlog is drained, the next overflow is warned about again
+                self._report_dropped()
+
+
+_sink: Optional[MetricsSink] = None
+_sink_pid: Optional[int] = None
+
+
+def get_metrics_sink() -> MetricsSink:
+    """Returns metrics sink of the current process, it is created on the first call.
+    FL nodes are forked processes, so every process gets its own sink and background thread.
+    """
+    global _sink, _sink_pid
+    if _sink is None or _sink_pid != os.getpid():
+        _sink = MetricsSink()
+        _sink_pid = os.getpid()
+        atexit.register(_sink.flush)
+    return _sink
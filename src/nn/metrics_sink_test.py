@@ -0,0 +1,39 @@
+import logging
+import mlflow
+import pytest
+import torch
+from nn.metrics_sink import MetricsSink
+
+
+def _file_store(tmp_path, monkeypatch):
+    monkeypatch.setenv('MLFLOW_ALLOW_FILE_STORE', 'true')
+    mlflow.set_tracking_uri(f'file://{tmp_path}')
+    mlflow.set_experiment('metrics_sink_test')
+
+
+def test_MetricsSink(tmp_path, monkeypatch):
+    _file_store(tmp_path, monkeypatch)
+    sink = MetricsSink(flush_interval=0.01)
+    with mlflow.start_run() as run:
+        for step in range(1500):
+            sink.log_metric('loss', torch.tensor(step / 10), step)
+        sink.log_metrics({'val_loss': 0.5, 'val_r2': 0.25}, step=3)
+        sink.flush()
+    client = mlflow.tracking.MlflowClient()
+    history = client.get_metric_history(run.info.run_id, 'loss')
+    assert sorted(m.step for m in history) == list(range(1500))
+    assert client.get_run(run.info.run_id).data.metrics == pytest.approx({'loss': 149.9, 'val_loss': 0.5, 'val_r2': 0.25})
+
+
+def test_MetricsSink_drop(tmp_path, monkeypatch, caplog):
+    _file_store(tmp_path, monkeypatch)
+    sink = MetricsSink(max_queue_size=1, flush_interval=0.5, policy='drop')
+    with caplog.at_level(logging.WARNING), mlflow.start_run() as run:
+        for step in range(100):
+            sink.log_metric('loss', step, step)
+        sink.flush()
+    # every dropped metric is reported once and the counter is reset after the queue is drained
+    reported = [int(record.getMessage().split()[0]) for record in caplog.records if 'metrics were dropped' in record.getMessage()]
+    history = mlflow.tracking.MlflowClient().get_metric_history(run.info.run_id, 'loss')
+    assert sum(reported) == 100 - len(history) > 0
+    assert sink.dropped == 0
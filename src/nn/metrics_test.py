@@ -0,0 +1,67 @@
+import numpy
+import torch
+from sklearn.metrics import mean_squared_error, r2_score, roc_auc_score
+from torch.nn.functional import binary_cross_entropy_with_logits, cross_entropy
+from nn.metrics import RegMetricsAccumulator, ClfMetricsAccumulator, MulticlassMetricsAccumulator, roc_auc
+
+
+def test_RegMetricsAccumulator():
+    generator = torch.Generator().manual_seed(0)
+    y_true = torch.randn(100, generator=generator) * 3 + 5
+    y_pred = y_true.unsqueeze(1) + torch.randn(100, 4, generator=generator) * torch.tensor([0.1, 1.0, 2.0, 10.0])
+    accumulator = RegMetricsAccumulator()
+    for start, end in [(0, 7), (7, 40), (40, 100)]:
+        accumulator.update(y_pred[start: end], y_true[start: end])
+    metrics = accumulator.metrics(epoch=3)
+    assert len(metrics) == 4 and all(m.samples == 100 and m.epoch == 3 for m in metrics)
+    for col, m in enumerate(metrics):
+        assert numpy.isclose(m.loss, mean_squared_error(y_true.numpy(), y_pred[:, col].numpy()), rtol=1e-5)
+        assert numpy.isclose(m.r2, r2_score(y_true.numpy(), y_pred[:, col].numpy()), rtol=1e-5)
+
+
+def test_roc_auc():
+    generator = torch.Generator().manual_seed(0)
+    labels = (torch.rand(200, generator=generator) > 0.7).float()
+    scores = labels.unsqueeze(1) * torch.tensor([0.0, 0.5, 1.0]) + torch.randn(200, 3, generator=generator)
+    # rounded scores have many ties
+    scores = torch.cat([scores, scores.round()], dim=1)
+    aucs = roc_auc(scores, labels, block_size=4)
+    expected = [roc_auc_score(labels.numpy(), scores[:, col].numpy()) for col in range(scores.shape[1])]
+    assert numpy.allclose(aucs.numpy(), expected)
+
+
+def test_ClfMetricsAccumulator():
+    generator = torch.Generator().manual_seed(0)
+    y_true = (torch.rand(1000, generator=generator) > 0.7).float()
+    y_pred = y_true.unsqueeze(1) * torch.tensor([0.0, 1.0, 3.0]) + torch.randn(1000, 3, generator=generator)
+    accumulator = ClfMetricsAccumulator()
+    for start, end in [(0, 64), (64, 500), (500, 1000)]:
+        accumulator.update(y_pred[start: end], y_true[start: end])
+    metrics = accumulator.metrics(epoch=2)
+    assert len(metrics) == 3 and all(m.samples == 1000 and m.epoch == 2 for m in metrics)
+    y = y_true.unsqueeze(1).expand_as(y_pred)
+    losses = binary_cross_entropy_with_logits(y_pred, y, reduction='none').mean(dim=0)
+    accuracies = ((y_pred > 0.5).float() == y).float().mean(dim=0)
+    aucs = roc_auc(y_pred, y_true)
+    for col, m in enumerate(metrics):
+        assert numpy.isclose(m.loss, losses[col].item(), rtol=1e-5)
+        assert numpy.isclose(m.accuracy, accuracies[col].item())
+        # ties within histogram bins change AUC only slightly
+        assert abs(m.auc - aucs[col].item()) < 1e-4
+
+
+def test_MulticlassMetricsAccumulator():
+    generator = torch.Generator().manual_seed(0)
+    y_true = torch.randint(0, 3, (500,), generator=generator)
+    # logits of 3 classes for 2 outputs, the second one is informative
+    y_pred = torch.randn(500, 3, 2, generator=generator)
+    y_pred[:, :, 1] += 2 * torch.nn.functional.one_hot(y_true, 3)
+    accumulator = MulticlassMetricsAccumulator()
+    for start, end in [(0, 100), (100, 500)]:
+        accumulator.update(y_pred[start: end], y_true[start: end])
+    metrics = accumulator.metrics(epoch=1)
+    assert len(metrics) == 2 and all(m.samples == 500 and m.epoch == 1 for m in metrics)
+    for col, m in enumerate(metrics):
+        assert numpy.isclose(m.loss, cross_entropy(y_pred[:, :, col], y_true).item(), rtol=1e-5)
+        assert numpy.isclose(m.accuracy, (y_pred[:, :, col].argmax(dim=1) == y_true).float().mean().item())
+    assert metrics[1].accuracy > metrics[0].accuracy
@@ -1,23 +1,58 @@
 from typing import Dict, Any, List, Tuple, Optional
+import math
 import numpy
+import scipy.sparse
 from pytorch_lightning import LightningModule
-from sklearn.metrics import roc_auc_score
 import torch
-from torch.nn import Linear, BatchNorm1d
+from torch.nn import Linear, BatchNorm1d, Module, Parameter
 from torch.nn.init import uniform_ as init_uniform_
-from torch.nn.functional import mse_loss, binary_cross_entropy_with_logits, relu6, softmax, relu, selu
+from torch.nn.functional import mse_loss, binary_cross_entropy_with_logits, cross_entropy, relu6, softmax, relu, selu, linear
 from torch.utils.data import DataLoader
 from torchmetrics import Accuracy, R2Score
 import mlflow
-from mlflow.tracking.client import MlflowClient
-from mlflow.entities import Metric
-import time
 import logging
 
 from configs.phenotype_config import TYPE_LOSS_DICT
 from nn.lightning import DataModule
+from nn.metrics_sink import MetricsSink, get_metrics_sink
 # from nn.utils import ClfLoaderMetrics, ClfMetrics, LassoNetRegMetrics, Metrics, RegLoaderMetrics, RegMetrics
-from nn.metrics import ModelMetrics, DatasetMetrics, RegMetrics, ClfMetrics, LassoNetModelMetrics
+from nn.metrics import ModelMetrics, DatasetMetrics, RegMetrics, ClfMetrics, LassoNetModelMetrics, RegMetricsAccumulator, ClfMetricsAccumulator, MulticlassMetricsAccumulator, roc_auc
+
+
+class _CpuCsrMatmul(torch.autograd.Function):
+    """Computes x @ weight.T for CPU torch sparse CSR x with scipy.sparse kernels,
+    which are considerably faster than torch sparse kernels on CPU. Gradient is calculated only for weight.
+    """
+    @staticmethod
+    def forward(ctx, x: torch.Tensor, weight: torch.Tensor) -> torch.Tensor:
+        x_csr = scipy.sparse.csr_matrix((x.values().numpy(), x.col_indices().numpy(), x.crow_indices().numpy()), shape=x.shape)
+        ctx.x_csr = x_csr
+        return torch.from_numpy(x_csr @ weight.detach().numpy().T)
+
+    @staticmethod
+    def backward(ctx, grad: torch.Tensor) -> Tuple[None, torch.Tensor]:
+        return None, torch.from_numpy(numpy.ascontiguousarray((ctx.x_csr.T @ grad.numpy()).T))
+
+
+class SparseLinear(Linear):
+    """Linear layer which also accepts torch sparse CSR inputs, e.g. sparse genotype batches.
+    Only nonzero genotypes contribute to FLOPs of sparse inputs.
+    It has the same parameters as Linear, therefore checkpoints and FL weights are interchangeable.
+    """
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if x.layout == torch.sparse_csr:
+            if x.device.type == 'cpu':
+                return _CpuCsrMatmul.apply(x, self.weight) + self.bias
+            return x @ self.weight.t() + self.bias
+        return super().forward(x)
+
+
+def soft_threshold_(weight: torch.Tensor, thresholds: torch.Tensor) -> torch.Tensor:
+    """Proximal operator of L1 penalty, shrinks {weight} towards zero by {thresholds} in place.
+    Weights smaller than their thresholds become exactly zero.
+    """
+    shrunk = weight.abs().sub_(thresholds).clamp_(min=0)
+    return weight.sign_().mul_(shrunk)
 
 
 class BaseNet(LightningModule):
@@ -33,30 +68,29 @@ class BaseNet(LightningModule):
         self.optim_params = optim_params
         self.scheduler_params = scheduler_params
         self.current_round = 1
-        self.mlflow_client = MlflowClient()
-        self.history: List[Metric] = []
-        self.logged_count = 0
+        # epoch and learning rate of ClientTrainer, which trains the model without Lightning Trainer
+        self.loop_epoch = 0
+        self.loop_lr = None
+
+    @property
+    def current_epoch(self) -> int:
+        return super().current_epoch if self._trainer is not None else self.loop_epoch
+
+    @property
+    def metrics_sink(self) -> MetricsSink:
+        # the sink is not an attribute, because models are pickled and the sink holds a thread
+        return get_metrics_sink()
 
     def _add_to_history(self, name: str, value, step: int):
-        timestamp = int(time.time() * 1000)
-        self.history.append(Metric(name, value, timestamp, step))
-        if len(self.history) % 50 == 0:
-            self.mlflow_client.log_batch(mlflow.active_run().info.run_id, self.history[-50:])
-            self.logged_count = len(self.history)
+        self.metrics_sink.log_metric(name, value, step)
 
     def on_train_end(self) -> None:
-        unlogged = len(self.history) - self.logged_count
-        if unlogged > 0:
-            self.mlflow_client.log_batch(mlflow.active_run().info.run_id, self.history[-unlogged:])
-            self.logged_count = len(self.history)
+        self.metrics_sink.flush()
         return super().on_train_end()
 
     def on_predict_end(self) -> None:
-        unlogged = len(self.history) - self.logged_count
-        if unlogged > 0:
-            self.mlflow_client.log_batch(mlflow.active_run().info.run_id, self.history[-unlogged:])
-            self.logged_count = len(self.history)
-        return super().on_validation_end()
+        self.metrics_sink.flush()
+        return super().on_predict_end()
 
     def training_step(self, batch: Tuple[torch.Tensor, torch.Tensor], batch_idx: int) -> Dict[str, Any]:
         x, y = batch
@@ -113,15 +147,18 @@ class BaseNet(LightningModule):
         avg_loss = self.calculate_avg_epoch_metric(outputs, 'val_loss')
         self._add_to_history('val_loss', avg_loss, step=self.fl_current_epoch())
         # mlflow.log_metric('val_loss', avg_loss, self.fl_current_epoch())
-        self.log('val_loss', avg_loss, prog_bar=True)
+        if self._trainer is not None:
+            self.log('val_loss', avg_loss, prog_bar=True)
 
     def fl_current_epoch(self):
         return (self.current_round - 1) * self.scheduler_params['epochs_in_round'] + self.current_epoch
 
     def get_current_lr(self):
-        if self.trainer is not None:
+        if self._trainer is not None:
             optim = self.trainer.optimizers[0]
             lr = optim.param_groups[0]['lr']
+        elif self.loop_lr is not None:
+            return self.loop_lr
         else:
             return self.optim_params['lr']
         return lr
@@ -190,14 +227,35 @@ class BaseNet(LightningModule):
     def loader_metrics(self, y_hat: torch.Tensor, y: torch.Tensor) -> DatasetMetrics:
         raise NotImplementedError('subclasses of BaseNet should implement loader_metrics')
 
-    def predict_and_eval(self, datamodule: DataModule, **kwargs: Any) -> ModelMetrics:
-        raise NotImplementedError('subclasses of BaseNet should implement predict_end_eval')
+    def metrics_accumulator(self):
+        """Returns an object with update(y_pred, y_true) and metrics(epoch) methods, which calculates metrics batch by batch"""
+        raise NotImplementedError('subclasses of BaseNet should implement metrics_accumulator')
+
+    def stream_metrics(self, loader: DataLoader) -> List[DatasetMetrics]:
+        """Calculates metrics of every output column on {loader} in one pass without collecting predictions,
+        so memory of evaluation does not depend on the number of samples
+        """
+        accumulator = self.metrics_accumulator()
+        with torch.inference_mode():
+            for x, y in loader:
+                accumulator.update(self(x), y)
+        return accumulator.metrics(self.fl_current_epoch())
+
+    def evaluate(self, loader: DataLoader) -> DatasetMetrics:
+        return self.stream_metrics(loader)[0]
+
+    def predict_and_eval(self, datamodule: DataModule, test=False) -> ModelMetrics:
+        train_loader, val_loader, test_loader = datamodule.predict_dataloader()
+        train_metrics = self.evaluate(train_loader)
+        val_metrics = self.evaluate(val_loader)
+        test_metrics = self.evaluate(test_loader) if test else None
+        return ModelMetrics(train_metrics, val_metrics, test_metrics)
 
 
 class LinearRegressor(BaseNet):
     def __init__(self, input_size: int, l1: float, optim_params: Dict, scheduler_params: Dict) -> None:
         super().__init__(input_size, optim_params, scheduler_params)
-        self.layer = Linear(input_size, 1)
+        self.layer = SparseLinear(input_size, 1)
         self.l1 = l1
         # TODO: move to callback
         # self.beta_history = []
@@ -220,7 +278,7 @@ class LinearRegressor(BaseNet):
     def on_after_backward(self) -> None:
         # print(w)
         # self.beta_history.append(self.layer.weight.detach().cpu().numpy().copy())
-        mlflow.log_metric('grad_norm', torch.norm(self.layer.weight.grad).item(), self.fl_current_epoch())
+        self.metrics_sink.log_metric('grad_norm', torch.norm(self.layer.weight.grad).detach(), self.fl_current_epoch())
         return super().on_after_backward()
 
     def loader_metrics(self, y_hat: torch.Tensor, y: torch.Tensor) -> RegMetrics:
@@ -228,26 +286,14 @@ class LinearRegressor(BaseNet):
         r2 = self.r2_score(y_hat.squeeze(1), y)
         return RegMetrics(mse.item(), r2.item(), self.fl_current_epoch(), y_hat.shape[0])
 
-    def predict_and_eval(self, datamodule: DataModule, test=False) -> ModelMetrics:
-        train_loader, val_loader, test_loader = datamodule.predict_dataloader()
-        y_train_pred, y_train = self.predict(train_loader)
-        y_val_pred, y_val = self.predict(val_loader)
-
-        train_metrics = self.loader_metrics(y_train_pred, y_train)
-        val_metrics = self.loader_metrics(y_val_pred, y_val)
-
-        if test:
-            y_test_pred, y_test = self.predict(test_loader)
-            test_metrics = self.loader_metrics(y_test_pred, y_test)
-        else:
-            test_metrics = None
-        metrics = ModelMetrics(train_metrics, val_metrics, test_metrics)
-        return metrics
+    def metrics_accumulator(self) -> RegMetricsAccumulator:
+        return RegMetricsAccumulator()
 
 
 class LinearClassifier(BaseNet):
     def __init__(self, input_size: int, l1: float, lr: float, momentum: float, epochs: float) -> None:
-        super().__init__()
+        # {epochs} are local epochs of a round, they define the epoch of metrics
+        super().__init__(input_size, optim_params=None, scheduler_params={'epochs_in_round': epochs})
         self.layer = Linear(input_size, 1)
         self.l1 = l1
         self.lr = lr
@@ -279,11 +325,14 @@ class LinearClassifier(BaseNet):
         accuracy = accuracy = (y_hat.argmax(dim=1) == y).float().mean()
         return ClfMetrics(bce.item(), accuracy.item(), self.fl_current_epoch(), y_hat.shape[0])
 
+    def metrics_accumulator(self) -> ClfMetricsAccumulator:
+        return ClfMetricsAccumulator()
+
 
 class MLPPredictor(BaseNet):
     def __init__(self, input_size: int, hidden_size: int, l1: float, optim_params: Dict, scheduler_params: Dict, loss = mse_loss) -> None:
         super().__init__(input_size, optim_params, scheduler_params)
-        self.input = Linear(input_size, hidden_size)
+        self.input = SparseLinear(input_size, hidden_size)
         self.bn = BatchNorm1d(hidden_size)
         self.hidden = Linear(hidden_size, hidden_size)
         self.hidden2 = Linear(hidden_size, 1)
@@ -310,6 +359,9 @@ class MLPPredictor(BaseNet):
         r2 = self.r2_score(y_hat.squeeze(1), y)
         return RegMetrics(mse.item(), r2.item(), self.fl_current_epoch(), y_hat.shape[0])
 
+    def metrics_accumulator(self) -> RegMetricsAccumulator:
+        return RegMetricsAccumulator()
+
 
 class MLPClassifier(BaseNet):
     def __init__(self, nclass, nfeat, optim_params, scheduler_params, loss, hidden_size=800, hidden_size2=200, binary=False) -> None:
@@ -376,13 +428,18 @@ class MLPClassifier(BaseNet):
         avg_accuracy = self.calculate_avg_epoch_metric(outputs, 'val_accuracy')
         self._add_to_history('val_loss', avg_loss, step=self.fl_current_epoch())
         self._add_to_history('val_accuracy', avg_accuracy, step=self.fl_current_epoch())
-        self.log('val_loss', avg_loss, prog_bar=True)
+        if self._trainer is not None:
+            self.log('val_loss', avg_loss, prog_bar=True)
 
     def loader_metrics(self, y_pred: torch.Tensor, y_true: torch.Tensor) -> ClfMetrics:
         loss = self.calculate_loss(y_pred, y_true)
         accuracy = Accuracy(num_classes=self.nclass)
         return ClfMetrics(loss.item(), accuracy(y_pred, y_true).item(), epoch=self.fl_current_epoch(), samples=y_pred.shape[0])
 
+    def metrics_accumulator(self):
+        # a single logit is a binary classifier, otherwise logits of classes have shape (n, nclass)
+        return ClfMetricsAccumulator() if self.nclass == 1 else MulticlassMetricsAccumulator()
+
 
 class LassoNetRegressor(BaseNet):
     def __init__(self, input_size: int, hidden_size: int,
@@ -390,7 +447,17 @@ class LassoNetRegressor(BaseNet):
                  cov_count: int = 0,
                  alpha_start: float = -1, alpha_end: float = -1, init_limit: float = 0.01, use_bn: bool = True,
                  loss = None,
-                 logger = None) -> None:
+                 logger = None,
+                 proximal: bool = False, screen_every: int = 0) -> None:
+        """LassoNet-like model with {hidden_size} linear models, each of them has its own L1 penalty alpha
+
+        Args:
+            proximal (bool, optional): Whether to apply L1 penalty of SNP weights with soft-thresholding after every
+                optimizer step instead of adding it to the loss, so weights become exactly zero. Defaults to False.
+            screen_every (int, optional): If positive and {proximal} is set, every {screen_every}-th epoch is trained
+                on all features and SNPs with zero weights, which stay zero by optimality condition for all alphas,
+                are excluded from the first layer matmul until the next screening epoch. Defaults to 0.
+        """
         super().__init__(input_size, optim_params, scheduler_params)
 
         assert alpha_end > alpha_start
@@ -399,19 +466,90 @@ class LassoNetRegressor(BaseNet):
         self.input_size = input_size
         self.cov_count = cov_count
         self.use_bn = use_bn
-        self.layer = Linear(self.input_size, self.hidden_size)
+        self.layer = SparseLinear(self.input_size, self.hidden_size)
         if self.use_bn:
             self.bn = BatchNorm1d(self.input_size)
         self.r2_score = R2Score(num_outputs=self.hidden_size, multioutput='raw_values')
         init_uniform_(self.layer.weight, a=-init_limit, b=init_limit)
         self.stdout_logger = logger
+        self.proximal = proximal
+        self.screen_every = screen_every if proximal else 0
+        # indices of features used in the first layer, weights of other features are zero;
+        # it is not a part of state_dict, so parameters exchanged in FL always have the full shape
+        self.register_buffer('active_features', None, persistent=False)
+        self.screening = False
+        self.gradient_sum = None
+        self.gradient_batches = 0
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         if self.use_bn:
+            if x.layout == torch.sparse_csr:
+                raise ValueError('batch normalization densifies inputs, set use_bn to False for sparse genotypes')
             x = self.bn(x)
+        if self.active_features is not None and not self.screening and x.layout == torch.strided:
+            return linear(x.index_select(1, self.active_features),
+                          self.layer.weight.index_select(1, self.active_features), self.layer.bias)
         out = self.layer(x)
         return out
 
+    def _l1_thresholds(self) -> torch.Tensor:
+        # penalty of each linear model is divided by hidden_size as in regularization
+        return torch.tensor(self.alphas / self.hidden_size, device=self.layer.weight.device, dtype=torch.float32).unsqueeze(1)
+
+    def proximal_step(self):
+        """Applies L1 penalty of SNP weights to the result of optimizer step with learning rate of the step"""
+        snp_count = self.input_size - self.cov_count
+        with torch.no_grad():
+            soft_threshold_(self.layer.weight[:, :snp_count], self.get_current_lr() * self._l1_thresholds())
+
+    def on_train_batch_end(self, *args, **kwargs) -> None:
+        if self.proximal:
+            self.proximal_step()
+        return super().on_train_batch_end(*args, **kwargs)
+
+    def on_train_epoch_start(self) -> None:
+        self.screening = self.screen_every > 0 and self.fl_current_epoch() % self.screen_every == self.screen_every - 1
+        self.gradient_sum, self.gradient_batches = None, 0
+        return super().on_train_epoch_start()
+
+    def on_after_backward(self) -> None:
+        if self.screening:
+            grad = self.layer.weight.grad.detach()
+            self.gradient_sum = grad.clone() if self.gradient_sum is None else self.gradient_sum.add_(grad)
+            self.gradient_batches += 1
+        return super().on_after_backward()
+
+    def on_train_epoch_end(self, *args, **kwargs) -> None:
+        if self.screening and self.gradient_batches > 0:
+            self.screen_features(self.gradient_sum / self.gradient_batches)
+        self.screening = False
+        self.gradient_sum = None
+        return super().on_train_epoch_end(*args, **kwargs)
+
+    def screen_features(self, gradient: torch.Tensor):
+        """Excludes SNPs, whose weights are zero and whose epoch mean {gradient} is below L1 threshold for all alphas,
+        from the first layer. Soft-thresholding keeps weights of such SNPs at zero, so they do not change predictions.
+        Covariates are not penalized and are always used.
+        """
+        snp_count = self.input_size - self.cov_count
+        weight = self.layer.weight.detach()[:, :snp_count]
+        violates = (gradient[:, :snp_count].abs() >= self._l1_thresholds()).any(dim=0)
+        active_snps = torch.nonzero((weight != 0).any(dim=0) | violates).squeeze(1)
+        if active_snps.shape[0] == snp_count:
+            self.active_features = None
+        else:
+            covariates = torch.arange(snp_count, self.input_size, device=active_snps.device)
+            self.active_features = torch.cat([active_snps, covariates])
+        self._add_to_history('active_snps', active_snps.shape[0], self.fl_current_epoch())
+
+    def load_state_dict(self, state_dict, *args, **kwargs):
+        result = super().load_state_dict(state_dict, *args, **kwargs)
+        if self.active_features is not None:
+            # weights from FL server or checkpoint can be nonzero for screened out SNPs, they are used again
+            nonzero = torch.nonzero((self.layer.weight.detach() != 0).any(dim=0)).squeeze(1)
+            self.active_features = torch.unique(torch.cat([self.active_features, nonzero.to(self.active_features.device)]))
+        return result
+
     def calculate_loss(self, y_hat: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
         y = y.unsqueeze(1).tile(dims=(1, self.hidden_size))
         # print(y.shape, y_hat.shape)
@@ -421,40 +559,31 @@ class LassoNetRegressor(BaseNet):
 
         alphas = torch.tensor(self.alphas, device=self.layer.weight.device, dtype=torch.float32)
         if self.cov_count == 0:
-            return torch.dot(alphas, torch.norm(self.layer.weight, p=1, dim=1))/self.hidden_size
+            penalty = torch.dot(alphas, torch.norm(self.layer.weight, p=1, dim=1))/self.hidden_size
         else:
             w = self.layer.weight[:, :self.layer.weight.shape[1] - self.cov_count]
-            return torch.dot(alphas, torch.norm(w, p=1, dim=1))/self.hidden_size
+            penalty = torch.dot(alphas, torch.norm(w, p=1, dim=1))/self.hidden_size
+        # with proximal steps penalty is only logged, it is applied to weights by soft-thresholding
+        return penalty.detach() if self.proximal else penalty
 
-    def _unreduced_mse_loss(self, y_pred: torch.Tensor, y_true: torch.Tensor) -> List[float]:
-        return [mse_loss(y_pred[:, i], y_true).item() for i in range(self.hidden_size)]
+    def loader_metrics(self, y_pred: torch.Tensor, y_true: torch.Tensor) -> List[RegMetrics]:
+        accumulator = RegMetricsAccumulator()
+        accumulator.update(y_pred, y_true)
+        return accumulator.metrics(self.fl_current_epoch())
 
-    def _unreduced_r2_score(self, y_pred: torch.Tensor, y_true: torch.Tensor) -> List[float]:
-        y = y_true.unsqueeze(1).tile(dims=(1, self.hidden_size))
-        r2 = [r.item() for r in self.r2_score(y_pred, y)]
-        return r2
+    def metrics_accumulator(self) -> RegMetricsAccumulator:
+        return RegMetricsAccumulator()
 
-    def loader_metrics(self, y_pred: torch.Tensor, y_true: torch.Tensor) -> List[RegMetrics]:
-        losses = self._unreduced_mse_loss(y_pred, y_true)
-        r2s = self._unreduced_r2_score(y_pred, y_true)
-        return [RegMetrics(loss, r2, self.fl_current_epoch(), samples=y_true.shape[0]) for loss, r2 in zip(losses, r2s)]
+    def evaluate(self, loader: DataLoader) -> List[RegMetrics]:
+        """Calculates metrics of all alphas"""
+        return self.stream_metrics(loader)
 
     def predict_and_eval(self, datamodule: DataModule, test=False) -> LassoNetModelMetrics:
         train_loader, val_loader, test_loader = datamodule.predict_dataloader()
-        y_train_pred, y_train = self.predict(train_loader)
-        y_val_pred, y_val = self.predict(val_loader)
-
-        train_metrics = self.loader_metrics(y_train_pred, y_train)
-        val_metrics = self.loader_metrics(y_val_pred, y_val)
-
-        if test:
-            y_test_pred, y_test = self.predict(test_loader)
-            test_metrics = self.loader_metrics(y_test_pred, y_test)
-        else:
-            test_metrics = None
-        metrics = LassoNetModelMetrics(train_metrics, val_metrics, test_metrics)
-
-        return metrics
+        train_metrics = self.evaluate(train_loader)
+        val_metrics = self.evaluate(val_loader)
+        test_metrics = self.evaluate(test_loader) if test else None
+        return LassoNetModelMetrics(train_metrics, val_metrics, test_metrics)
 
     def get_best_predictions(self, train_preds: torch.Tensor, val_preds: torch.Tensor, test_preds: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         best_col = torch.amax(self.r2_score(val_preds))
@@ -479,19 +608,263 @@ class LassoNetClassifier(LassoNetRegressor):
         return binary_cross_entropy_with_logits(y_hat, y, pos_weight=torch.Tensor([5.0]))
     
     
-    def one_col_metrics(self, y_pred: torch.Tensor, y_true: torch.Tensor) -> ClfMetrics:
-         
-        loss = binary_cross_entropy_with_logits(y_pred, y_true).item()
-        accuracy = ((y_pred > 0.5).float() == y_true).float().mean().item()
-        auc = roc_auc_score(y_true.detach().cpu().numpy(), y_pred.detach().cpu().numpy())
-        return ClfMetrics(loss, accuracy, auc, self.fl_current_epoch(), y_true.shape[0])
-    
-    
+    def metrics_accumulator(self) -> ClfMetricsAccumulator:
+        return ClfMetricsAccumulator()
+
     def loader_metrics(self, y_pred: torch.Tensor, y_true: torch.Tensor) -> List[ClfMetrics]:
-        
-        result: List[ClfMetrics] = []
-        for col in range(y_pred.shape[1]):
-            col_metrics = self.one_col_metrics(y_pred[:, col], y_true)
-            result.append(col_metrics)
-            
-        return result
+        """Calculates metrics of all alpha columns at once, AUC is rank-based and computed in torch"""
+        y = y_true.unsqueeze(1).expand_as(y_pred)
+        losses = binary_cross_entropy_with_logits(y_pred, y, reduction='none').mean(dim=0)
+        accuracies = ((y_pred > 0.5).float() == y).float().mean(dim=0)
+        aucs = roc_auc(y_pred, y_true)
+        epoch, samples = self.fl_current_epoch(), y_true.shape[0]
+        return [ClfMetrics(loss, accuracy, auc, epoch, samples)
+                for loss, accuracy, auc in zip(losses.tolist(), accuracies.tolist(), aucs.tolist())]
+
+
+class BatchedLinear(Module):
+    def __init__(self, members: int, in_features: int, out_features: int) -> None:
+        """{members} independent linear layers, each of them is applied to its own input, with one batched matmul.
+        Weight of member m is weight[m] with shape (in_features, out_features).
+
+        Args:
+            members (int): Number of linear layers
+            in_features (int): Size of input of every layer
+            out_features (int): Size of output of every layer
+        """
+        super().__init__()
+        self.weight = Parameter(torch.empty(members, in_features, out_features))
+        self.bias = Parameter(torch.empty(members, out_features))
+        # the same distribution as default initialization of Linear
+        bound = 1 / math.sqrt(in_features)
+        init_uniform_(self.weight, a=-bound, b=bound)
+        init_uniform_(self.bias, a=-bound, b=bound)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        """Maps {x} with shape (members, n, in_features) to outputs with shape (members, n, out_features)"""
+        return torch.baddbmm(self.bias.unsqueeze(1), x, self.weight)
+
+
+def _member_uniform_(weight: torch.Tensor, bounds: torch.Tensor, mask: Optional[torch.Tensor] = None) -> torch.Tensor:
+    # weights of member m are weight[m], they are uniform in (-bounds[m], bounds[m]) and zero outside of mask
+    weight.uniform_(-1, 1).mul_(bounds.view((-1,) + (1,) * (weight.dim() - 1)))
+    return weight if mask is None else weight.mul_(mask)
+
+
+class MLPEnsemble(BaseNet):
+    MEMBER_KEYS = ['lr', 'l1', 'hidden_size', 'hidden_size2', 'feature_count']
+
+    def __init__(self, input_size: int, members: List[Dict[str, Any]], hidden_size: int, hidden_size2: int, output_size: int,
+                 optim_params: Dict, scheduler_params: Dict, loss, l1: float = 0.0, cov_count: int = 0) -> None:
+        """Independent MLPs with two hidden layers, which are trained together in one forward and backward pass
+        over shared batches, e.g. a grid of hyperparameters. The first layers of all members are one SparseLinear layer,
+        the other ones are BatchedLinear layers. Member m predicts column m of outputs.
+        Base class for MLPEnsembleRegressor and MLPEnsembleClassifier, should not be used directly.
+
+        Members have the widest hidden layers of the ensemble, units above hidden sizes of a member and weights
+        of its unused SNPs are zero. Zero units get no gradient, gradient of unused SNPs is zeroed after backward.
+        Learning rate of a member scales its gradients, which gives the same steps as the learning rate itself
+        for SGD, so other optimizers do not support member learning rates.
+
+        Args:
+            input_size (int): Number of features, SNPs followed by {cov_count} covariates
+            members (List[Dict[str, Any]]): Hyperparameters of every member from MEMBER_KEYS: 'lr', 'l1',
+                'hidden_size', 'hidden_size2' and 'feature_count', the number of the first SNPs used by the member.
+                Missing ones are the same as for the whole model.
+            hidden_size (int): Default size of the first hidden layer
+            hidden_size2 (int): Default size of the second hidden layer
+            output_size (int): Number of outputs of every member
+            loss: Loss function with reduction argument
+            l1 (float, optional): Default L1 penalty of the first layer weights. Defaults to 0.0.
+            cov_count (int, optional): Number of covariates, they are used by all members. Defaults to 0.
+        """
+        super().__init__(input_size, optim_params, scheduler_params)
+        for member in members:
+            unknown = set(member.keys()) - set(self.MEMBER_KEYS)
+            if unknown:
+                raise ValueError(f'unknown hyperparameters {unknown} of ensemble member, they should be from {self.MEMBER_KEYS}')
+        snp_count = input_size - cov_count
+        self.members = [{'lr': optim_params['lr'], 'l1': l1, 'hidden_size': hidden_size, 'hidden_size2': hidden_size2,
+                         'feature_count': snp_count, **member} for member in members]
+        self.member_count = len(self.members)
+        self.input_size = input_size
+        self.cov_count = cov_count
+        self.output_size = output_size
+        self.loss = loss
+        self.hidden_size = max(member['hidden_size'] for member in self.members)
+        self.hidden_size2 = max(member['hidden_size2'] for member in self.members)
+
+        self.input = SparseLinear(input_size, self.member_count * self.hidden_size)
+        self.hidden = BatchedLinear(self.member_count, self.hidden_size, self.hidden_size2)
+        self.output = BatchedLinear(self.member_count, self.hidden_size2, output_size)
+
+        hidden_sizes, hidden_sizes2, feature_counts = [torch.tensor([member[key] for member in self.members], dtype=torch.float32)
+                                                       for key in ['hidden_size', 'hidden_size2', 'feature_count']]
+        if (feature_counts > snp_count).any():
+            raise ValueError(f'feature_count of ensemble members should be not greater than {snp_count} SNPs')
+        units = torch.arange(self.hidden_size) < hidden_sizes.unsqueeze(1)
+        units2 = torch.arange(self.hidden_size2) < hidden_sizes2.unsqueeze(1)
+        features = torch.arange(input_size) < feature_counts.unsqueeze(1)
+        features[:, snp_count:] = True
+        # members are initialized like standalone MLPs of their sizes
+        with torch.no_grad():
+            input_bounds = 1 / (feature_counts + cov_count).sqrt()
+            _member_uniform_(self.input.weight.view(self.member_count, self.hidden_size, input_size), input_bounds,
+                             units.unsqueeze(2) & features.unsqueeze(1))
+            _member_uniform_(self.input.bias.view(self.member_count, self.hidden_size), input_bounds, units)
+            _member_uniform_(self.hidden.weight, 1 / hidden_sizes.sqrt(), units.unsqueeze(2) & units2.unsqueeze(1))
+            _member_uniform_(self.hidden.bias, 1 / hidden_sizes.sqrt(), units2)
+            _member_uniform_(self.output.weight, 1 / hidden_sizes2.sqrt(), units2.unsqueeze(2))
+            _member_uniform_(self.output.bias, 1 / hidden_sizes2.sqrt())
+
+        # masks and scales are not a part of state_dict, None means that they are the same for all members
+        self.register_buffer('feature_mask', features.float() if not features.all() else None, persistent=False)
+        lr_scales = torch.tensor([member['lr'] / optim_params['lr'] for member in self.members], dtype=torch.float32)
+        if (lr_scales != 1).any() and optim_params['name'] != 'sgd':
+            raise ValueError('learning rates of ensemble members are supported only by sgd optimizer')
+        self.register_buffer('lr_scales', lr_scales if (lr_scales != 1).any() else None, persistent=False)
+        l1s = torch.tensor([member['l1'] for member in self.members], dtype=torch.float32)
+        self.register_buffer('l1s', l1s if (l1s != 0).any() else None, persistent=False)
+
+        # mlflow runs of members, their epoch metrics are logged to them if they are set
+        self.member_run_ids: Optional[List[str]] = None
+        self.best_val_losses = [float('inf')] * self.member_count
+        self.best_epochs = [-1] * self.member_count
+        self.best_state: Optional[Dict[str, torch.Tensor]] = None
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        """Returns outputs with shape (n, members) or (n, output_size, members) if output_size is greater than 1"""
+        x = selu(self.input(x)).view(x.shape[0], self.member_count, self.hidden_size).transpose(0, 1)
+        x = selu(self.hidden(x))
+        x = self.output(x).permute(1, 2, 0)
+        return x.squeeze(1) if self.output_size == 1 else x
+
+    def member_regularization(self) -> torch.Tensor:
+        if self.l1s is None:
+            return torch.zeros(self.member_count, device=self.input.weight.device)
+        return self.l1s * torch.norm(self.input.weight.view(self.member_count, -1), p=1, dim=1)
+
+    def regularization(self) -> torch.Tensor:
+        return self.member_regularization().sum()
+
+    def member_losses(self, y_hat: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+        y = y.unsqueeze(1).expand(y.shape[0], self.member_count)
+        return self.loss(y_hat, y, reduction='none').mean(dim=0)
+
+    def calculate_loss(self, y_hat: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+        # members are independent, so the gradient of the sum of their losses is the gradient of every member
+        return self.member_losses(y_hat, y).sum()
+
+    def training_step(self, batch: Tuple[torch.Tensor, torch.Tensor], batch_idx: int) -> Dict[str, Any]:
+        x, y = batch
+        raw_losses = self.member_losses(self(x), y)
+        regs = self.member_regularization()
+        loss = raw_losses.sum() + regs.sum()
+        return {'loss': loss, 'raw_loss': raw_losses.sum().detach(), 'reg': regs.sum().detach(),
+                'losses': (raw_losses + regs).detach(), 'batch_len': x.shape[0]}
+
+    def validation_step(self, batch: Tuple[torch.Tensor, torch.Tensor], batch_idx: int) -> Dict[str, Any]:
+        x, y = batch
+        losses = self.member_losses(self(x), y)
+        return {'val_loss': losses.sum(), 'val_losses': losses, 'batch_len': x.shape[0]}
+
+    def calculate_avg_member_metric(self, outputs: List[Dict[str, Any]], metric_name: str) -> List[float]:
+        total_len = sum(out['batch_len'] for out in outputs)
+        return (sum(out[metric_name] * out['batch_len'] for out in outputs) / total_len).tolist()
+
+    def _add_to_member_histories(self, name: str, values: List[float], step: int):
+        if self.member_run_ids is None:
+            return
+        for run_id, value in zip(self.member_run_ids, values):
+            self.metrics_sink.log_metric(name, value, step, run_id=run_id)
+
+    def on_after_backward(self) -> None:
+        if self.feature_mask is not None:
+            self.input.weight.grad.view(self.member_count, self.hidden_size, -1).mul_(self.feature_mask.unsqueeze(1))
+        if self.lr_scales is not None:
+            # SGD step with weight decay is lr * (grad + weight_decay * weight), it becomes lr * scale * (grad + weight_decay * weight)
+            weight_decay = self.optim_params.get('weight_decay', 0)
+            scales = self.lr_scales.unsqueeze(1)
+            for param in self.parameters():
+                grad = param.grad.view(self.member_count, -1)
+                grad.mul_(scales)
+                if weight_decay:
+                    grad.add_(param.detach().view(self.member_count, -1) * (scales - 1) * weight_decay)
+        return super().on_after_backward()
+
+    def training_epoch_end(self, outputs: List[Dict[str, Any]]) -> None:
+        super().training_epoch_end(outputs)
+        self._add_to_member_histories('train_loss', self.calculate_avg_member_metric(outputs, 'losses'), self.fl_current_epoch())
+
+    def validation_epoch_end(self, outputs: List[Dict[str, Any]]) -> None:
+        losses = self.calculate_avg_member_metric(outputs, 'val_losses')
+        step = self.fl_current_epoch()
+        self._add_to_member_histories('val_loss', losses, step)
+        self.update_best_members(losses, step)
+        # sum of the best losses of members decreases while any of them improves, so early stopping waits
+        # for the last improving member; diverged members have no finite loss and do not stop the others
+        val_loss = sum(loss for loss in self.best_val_losses if math.isfinite(loss))
+        self._add_to_history('val_loss', val_loss, step=step)
+        if self._trainer is not None:
+            self.log('val_loss', val_loss, prog_bar=True)
+
+    def update_best_members(self, losses: List[float], epoch: int):
+        """Copies weights of members whose validation {losses} are the best so far to cpu"""
+        improved = [m for m, loss in enumerate(losses) if loss < self.best_val_losses[m]]
+        if len(improved) == 0:
+            return
+        if self.best_state is None:
+            self.best_state = {name: param.detach().cpu().clone() for name, param in self.named_parameters()}
+        index = torch.tensor(improved)
+        for name, param in self.named_parameters():
+            member_weights = param.detach().view(self.member_count, -1)
+            self.best_state[name].view(self.member_count, -1)[index] = member_weights[index.to(param.device)].cpu()
+        for m in improved:
+            self.best_val_losses[m], self.best_epochs[m] = losses[m], epoch
+
+    def restore_best_members(self):
+        """Loads the best weights of every member, after that members are as if they were trained separately with checkpoints"""
+        if self.best_state is None:
+            return
+        with torch.no_grad():
+            for name, param in self.named_parameters():
+                param.copy_(self.best_state[name])
+
+    def evaluate(self, loader: DataLoader) -> List[DatasetMetrics]:
+        """Calculates metrics of all members"""
+        return self.stream_metrics(loader)
+
+    def predict_and_eval(self, datamodule: DataModule, test=False) -> LassoNetModelMetrics:
+        train_loader, val_loader, test_loader = datamodule.predict_dataloader()
+        train_metrics = self.evaluate(train_loader)
+        val_metrics = self.evaluate(val_loader)
+        test_metrics = self.evaluate(test_loader) if test else None
+        return LassoNetModelMetrics(train_metrics, val_metrics, test_metrics)
+
+
+class MLPEnsembleRegressor(MLPEnsemble):
+    def __init__(self, input_size: int, members: List[Dict[str, Any]], hidden_size: int, optim_params: Dict, scheduler_params: Dict,
+                 l1: float = 0.0, cov_count: int = 0, loss = mse_loss) -> None:
+        """Ensemble of MLPPredictor-like members, both hidden layers of a member have its hidden_size"""
+        members = [{**member, 'hidden_size2': member.get('hidden_size', hidden_size)} for member in members]
+        super().__init__(input_size, members, hidden_size, hidden_size, 1, optim_params, scheduler_params, loss, l1, cov_count)
+
+    def metrics_accumulator(self) -> RegMetricsAccumulator:
+        return RegMetricsAccumulator()
+
+
+class MLPEnsembleClassifier(MLPEnsemble):
+    def __init__(self, input_size: int, members: List[Dict[str, Any]], nclass: int, optim_params: Dict, scheduler_params: Dict,
+                 hidden_size: int = 800, hidden_size2: int = 200, l1: float = 0.0, cov_count: int = 0) -> None:
+        """Ensemble of MLPClassifier-like members. Binary members have one logit output, the others have {nclass} logits."""
+        binary = nclass == 2
+        loss = binary_cross_entropy_with_logits if binary else cross_entropy
+        super().__init__(input_size, members, hidden_size, hidden_size2, 1 if binary else nclass,
+                         optim_params, scheduler_params, loss, l1, cov_count)
+        self.binary = binary
+
+    def member_losses(self, y_hat: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+        return super().member_losses(y_hat, y.float() if self.binary else y.long())
+
+    def metrics_accumulator(self):
+        return ClfMetricsAccumulator() if self.binary else MulticlassMetricsAccumulator()
@@ -0,0 +1,30 @@
+import numpy
+import torch
+from torch.nn.functional import binary_cross_entropy_with_logits, cross_entropy
+from torch.utils.data import DataLoader, TensorDataset
+
+from nn.models import LinearClassifier, MLPClassifier
+
+
+def test_classifier_stream_metrics():
+    generator = torch.Generator().manual_seed(0)
+    x = torch.randn(100, 5, generator=generator)
+    labels = torch.randint(0, 3, (100,), generator=generator)
+    torch.manual_seed(0)
+
+    model = MLPClassifier(nclass=3, nfeat=5, optim_params=None, scheduler_params={'epochs_in_round': 1},
+                          loss=cross_entropy)
+    metrics = model.evaluate(DataLoader(TensorDataset(x, labels), batch_size=32))
+    with torch.no_grad():
+        logits = model(x)
+    assert metrics.samples == 100
+    assert numpy.isclose(metrics.loss, cross_entropy(logits, labels).item(), rtol=1e-5)
+    assert numpy.isclose(metrics.accuracy, (logits.argmax(dim=1) == labels).float().mean().item())
+
+    model = LinearClassifier(5, l1=0.0, lr=0.1, momentum=0.0, epochs=1)
+    cases = (labels == 0).float()
+    metrics = model.evaluate(DataLoader(TensorDataset(x, cases), batch_size=32))
+    with torch.no_grad():
+        logits = model(x)
+    assert metrics.samples == 100
+    assert numpy.isclose(metrics.loss, binary_cross_entropy_with_logits(logits.squeeze(1), cases).item(), rtol=1e-5)
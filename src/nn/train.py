@@ -1,5 +1,8 @@
 import os
-from pytorch_lightning.callbacks import EarlyStopping, ModelCheckpoint, LearningRateMonitor
+from typing import Dict, Optional, Type
+import pytorch_lightning
+from pytorch_lightning.callbacks import Checkpoint, EarlyStopping, LearningRateMonitor
+from pytorch_lightning.core import LightningModule
 from pytorch_lightning.loggers import TensorBoardLogger
 from pytorch_lightning.trainer import Trainer
 
@@ -7,14 +10,82 @@ import torch
 from torch.utils.data import TensorDataset, DataLoader
 
 
-def prepare_trainer(model_dir, log_dir, nn_type_name, version, gpus=1, max_epochs=50, patience=3, **kwargs):
-    checkpoint_callback = ModelCheckpoint(
-        dirpath=os.path.join(model_dir, nn_type_name, 'v' + version) + '/',
-        filename='e{epoch}-vl{val_loss:.4f}',
-        save_top_k=2,
-        verbose=False,
+class BestStateCheckpoint(Checkpoint):
+    """Keeps a cpu copy of state_dict of the model with the best {monitor} value instead of writing a checkpoint
+    on every improvement. The best state is restored without reading it from disk and, if {dirpath} is set,
+    it is written once at the end of training as a checkpoint which can be loaded with load_from_checkpoint.
+    Like ModelCheckpoint, it is returned by trainer.checkpoint_callback and has best_model_path.
+    """
+    def __init__(self, monitor: str = 'val_loss', mode: str = 'min', dirpath: Optional[str] = None) -> None:
+        if mode not in ['min', 'max']:
+            raise ValueError(f'mode should be min or max, got {mode}')
+        super().__init__()
+        self.monitor = monitor
+        self.mode = mode
+        self.dirpath = dirpath
+        self.best_state: Optional[Dict[str, torch.Tensor]] = None
+        self.best_model_score: Optional[float] = None
+        self.best_epoch: Optional[int] = None
+        self.best_model_path = ''
+
+    def _is_better(self, score: float) -> bool:
+        if self.best_model_score is None:
+            return True
+        return score < self.best_model_score if self.mode == 'min' else score > self.best_model_score
+
+    def on_validation_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        score = trainer.callback_metrics.get(self.monitor)
+        if trainer.sanity_checking or score is None or not self._is_better(float(score)):
+            return
+        self.best_model_score = float(score)
+        self.best_epoch = trainer.current_epoch
+        self.best_state = {name: value.detach().to('cpu', copy=True) for name, value in pl_module.state_dict().items()}
+
+    def restore(self, model: LightningModule):
+        """Loads the best state into {model}, it is left as is if there was no validation"""
+        if self.best_state is not None:
+            model.load_state_dict(self.best_state)
+
+    def on_train_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        if self.dirpath is None or self.best_state is None:
+            return
+        os.makedirs(self.dirpath, exist_ok=True)
+        self.best_model_path = os.path.join(self.dirpath, f'e{self.best_epoch}-vl{self.best_model_score:.4f}.ckpt')
+        torch.save({'epoch': self.best_epoch, 'state_dict': self.best_state,
+                    'pytorch-lightning_version': pytorch_lightning.__version__}, self.best_model_path)
+
+
+class MemberBestStateCheckpoint(BestStateCheckpoint):
+    """BestStateCheckpoint for ensembles which keep the best weights of every member themselves,
+    e.g. MLPEnsembleRegressor. Nothing is copied on validation, members are restored with restore_best_members
+    and the checkpoint written at the end of training has the best weights of every member, i.e. the evaluated model.
+    best_epoch is the last epoch at which some member improved.
+    """
+    def on_validation_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        pass
+
+    def restore(self, model: LightningModule):
+        model.restore_best_members()
+
+    def on_train_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        if pl_module.best_state is None:
+            return
+        self.best_epoch = max(pl_module.best_epochs)
+        self.best_model_score = min(pl_module.best_val_losses)
+        if self.dirpath is None:
+            return
+        self.restore(pl_module)
+        self.best_state = {name: value.detach().to('cpu', copy=True) for name, value in pl_module.state_dict().items()}
+        super().on_train_end(trainer, pl_module)
+
+
+def prepare_trainer(model_dir, log_dir, nn_type_name, version, gpus=1, max_epochs=50, patience=3, save_best=True,
+                    checkpoint_class: Type[BestStateCheckpoint] = BestStateCheckpoint, **kwargs):
+    # the best model is kept in memory and written once after training, if {save_best} is set
+    checkpoint_callback = checkpoint_class(
         monitor='val_loss',
-        mode='min'
+        mode='min',
+        dirpath=os.path.join(model_dir, nn_type_name, 'v' + version) if save_best else None
     )
 
     early_stop = EarlyStopping(
@@ -0,0 +1,105 @@
+import torch
+from pytorch_lightning import LightningModule
+from pytorch_lightning.trainer import Trainer
+from torch.utils.data import DataLoader, TensorDataset
+
+from nn.train import BestStateCheckpoint, MemberBestStateCheckpoint
+
+
+class _Regressor(LightningModule):
+    def __init__(self) -> None:
+        super().__init__()
+        self.layer = torch.nn.Linear(4, 1)
+        self.val_states = []
+
+    def training_step(self, batch, batch_idx):
+        x, y = batch
+        return torch.nn.functional.mse_loss(self.layer(x).squeeze(1), y)
+
+    def validation_step(self, batch, batch_idx):
+        x, y = batch
+        return torch.nn.functional.mse_loss(self.layer(x).squeeze(1), y)
+
+    def validation_epoch_end(self, outputs):
+        loss = torch.stack(outputs).mean()
+        self.val_states.append((loss.item(), {name: value.clone() for name, value in self.state_dict().items()}))
+        self.log('val_loss', loss)
+
+    def configure_optimizers(self):
+        # large learning rate makes validation loss go up and down
+        return torch.optim.SGD(self.parameters(), lr=0.9)
+
+
+def test_BestStateCheckpoint(tmp_path):
+    generator = torch.Generator().manual_seed(0)
+    x = torch.randn(64, 4, generator=generator)
+    y = x @ torch.tensor([1.0, -2.0, 0.5, 0.0]) + 0.1 * torch.randn(64, generator=generator)
+    loader = DataLoader(TensorDataset(x, y), batch_size=16)
+    model = _Regressor()
+    checkpoint = BestStateCheckpoint(dirpath=str(tmp_path))
+    trainer = Trainer(max_epochs=6, callbacks=[checkpoint], logger=False, enable_progress_bar=False,
+                      enable_model_summary=False, num_sanity_val_steps=0)
+    trainer.fit(model, train_dataloaders=loader, val_dataloaders=loader)
+
+    assert trainer.checkpoint_callback is checkpoint
+    best_loss, best_state = min(model.val_states, key=lambda loss_state: loss_state[0])
+    assert checkpoint.best_model_score == best_loss
+    checkpoint.restore(model)
+    for name, value in model.state_dict().items():
+        assert torch.equal(value, best_state[name])
+    # the best state is written once, as a checkpoint loadable by Lightning
+    assert [path.name for path in tmp_path.iterdir()] == [checkpoint.best_model_path.split('/')[-1]]
+    loaded = _Regressor.load_from_checkpoint(checkpoint.best_model_path)
+    assert torch.equal(loaded.layer.weight, best_state['layer.weight'])
+
+
+class _Ensemble(_Regressor):
+    """Two linear regressors which keep the best weights of every member like MLPEnsembleRegressor"""
+    def __init__(self) -> None:
+        super().__init__()
+        self.layer = torch.nn.Linear(4, 2)
+        self.best_val_losses, self.best_epochs, self.best_state = [float('inf')] * 2, [-1] * 2, None
+
+    def training_step(self, batch, batch_idx):
+        x, y = batch
+        return torch.nn.functional.mse_loss(self.layer(x), y[:, None].expand(-1, 2))
+
+    def validation_step(self, batch, batch_idx):
+        x, y = batch
+        return ((self.layer(x) - y[:, None]) ** 2).mean(dim=0)
+
+    def validation_epoch_end(self, outputs):
+        losses = torch.stack(outputs).mean(dim=0)
+        if self.best_state is None:
+            self.best_state = {name: param.detach().clone() for name, param in self.named_parameters()}
+        for m, loss in enumerate(losses.tolist()):
+            if loss < self.best_val_losses[m]:
+                self.best_val_losses[m], self.best_epochs[m] = loss, self.current_epoch
+                for name, param in self.named_parameters():
+                    self.best_state[name][m] = param.detach()[m]
+        self.log('val_loss', losses.mean())
+
+    def restore_best_members(self):
+        with torch.no_grad():
+            for name, param in self.named_parameters():
+                param.copy_(self.best_state[name])
+
+
+def test_MemberBestStateCheckpoint(tmp_path):
+    generator = torch.Generator().manual_seed(0)
+    x = torch.randn(64, 4, generator=generator)
+    y = x @ torch.tensor([1.0, -2.0, 0.5, 0.0]) + 0.1 * torch.randn(64, generator=generator)
+    loader = DataLoader(TensorDataset(x, y), batch_size=16)
+    model = _Ensemble()
+    checkpoint = MemberBestStateCheckpoint(dirpath=str(tmp_path))
+    trainer = Trainer(max_epochs=6, callbacks=[checkpoint], logger=False, enable_progress_bar=False,
+                      enable_model_summary=False, num_sanity_val_steps=0)
+    trainer.fit(model, train_dataloaders=loader, val_dataloaders=loader)
+
+    assert checkpoint.best_epoch == max(model.best_epochs)
+    # the written checkpoint has the best weights of every member, not a state of one epoch
+    saved = torch.load(checkpoint.best_model_path)['state_dict']
+    for name, value in model.best_state.items():
+        assert torch.equal(saved[name], value)
+    checkpoint.restore(model)
+    assert torch.equal(model.layer.weight, model.best_state['layer.weight'])
@@ -6,6 +6,7 @@ import pandas as pd
 import scipy.sparse.linalg as linalg
 
 from utils.plink import run_plink
+from fl.datasets.view import get_sample_count, plink_pfile_args
 
 
 class FederatedPCASimulationRunner:
@@ -16,6 +17,8 @@ class FederatedPCASimulationRunner:
     1. Each node has serveral fold subsets: train, test, validation.
     2. Federated PCA is computed using only train subset of each node.
     3. Result projection is applied to all three subsets: train, test, validation.
+
+    Subsets can be plink 2.0 datasets or SampleView manifests of the node dataset.
     """
 
     # Results of federated PCA aggegation are stored for the <node identifier = ALL> on the filesystem
@@ -74,8 +77,7 @@ class FederatedPCASimulationRunner:
                 pfile = os.path.join(self.source_folder, node, self.train_foldname_template % fold)
                 output = os.path.join(self.result_folder, node, self.train_foldname_template % fold)
 
-                run_plink(args_list=[
-                    '--pfile', pfile,
+                run_plink(args_list=plink_pfile_args(pfile) + [
                     '--extract', self.variant_ids_file,
                     '--freq', 'counts',
                     '--out', output
@@ -130,9 +132,8 @@ class FederatedPCASimulationRunner:
             self.result_folder, self.ALL, self.train_foldname_template % fold + '.acount'
         )
 
-        n_samples = len(pd.read_csv(client_pfile + '.psam', sep='\t', header=0))
-        run_plink(args_list=[
-            '--pfile', client_pfile,
+        n_samples = get_sample_count(client_pfile)
+        run_plink(args_list=plink_pfile_args(client_pfile) + [
             '--extract', self.variant_ids_file,
             '--read-freq', allele_frequencies_file,
             '--pca', 'allele-wts', str(n_samples - 1),
@@ -258,8 +259,7 @@ class FederatedPCASimulationRunner:
             pfile = os.path.join(self.source_folder, node, part % fold)
             sscore_file = os.path.join(self.result_folder, node, part % fold + '_projections.csv.eigenvec')
 
-            run_plink(args_list=[
-                '--pfile', pfile,
+            run_plink(args_list=plink_pfile_args(pfile) + [
                 '--extract', self.variant_ids_file,
                 '--read-freq', allele_frequencies_file,
                 '--score', server_allele_file, '2', '5',
@@ -8,6 +8,7 @@ from preprocess.qc import QC
 from preprocess.splitter_tg import SplitTG
 from utils.plink import run_plink
 from utils.split import Split
+from fl.datasets.view import SampleView, plink_pfile_args
 from preprocess.train_val_split import CVSplitter
 from configs import pruning_config
 from configs.global_config import TG_BFILE_PATH, SPLIT_DIR, SPLIT_GENO_DIR, FEDERATED_PCA_DIR, SPLIT_ID_DIR, PCA_DIR
@@ -161,17 +162,11 @@ if __name__ == '__main__':
                 for part_name in ['train', 'val', 'test']:
                     ids_path = superpop_split.get_ids_path(node=node, fold_index=fold_index, part_name=part_name)
 
-                    # Extract and save genotypes
-                    run_plink(
-                        args_dict={
-                            '--pfile': superpop_split.get_source_pfile_path(node=node),
-                            '--keep': ids_path,
-                            '--out':  superpop_split.get_pfile_path(
-                                node=node, fold_index=fold_index, part_name=part_name
-                            )
-                        },
-                        args_list=['--make-pgen']
-                    )
+                    # Genotypes are not copied, the part is a manifest of sample indices in the node dataset
+                    SampleView.from_iids(
+                        superpop_split.get_source_pfile_path(node=node),
+                        pd.read_csv(ids_path, sep='\t')['IID'].values
+                    ).save(superpop_split.get_pfile_path(node=node, fold_index=fold_index, part_name=part_name))
 
                     # write ancestries aka phenotypes
                     relevant_ids = ancestry_df['IID'].isin(pd.read_csv(ids_path, sep='\t')['IID'])
@@ -213,10 +208,9 @@ if __name__ == '__main__':
             logger.info(f'Projecting train, test, and val parts for each node for fold {fold_index}...')
             for node in nodes + ['ALL']:
                 for part_name in ['train', 'val', 'test']:
-                    plink_arguments = [
-                        '--pfile', superpop_split.get_pfile_path(
-                            node=node, fold_index=fold_index, part_name=part_name
-                        ),
+                    plink_arguments = plink_pfile_args(superpop_split.get_pfile_path(
+                        node=node, fold_index=fold_index, part_name=part_name
+                    )) + [
                         '--read-freq', superpop_split.get_pca_path(
                             node='ALL', fold_index=fold_index, part='train', ext='.acount'
                         ),
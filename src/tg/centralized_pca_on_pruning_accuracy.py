@@ -8,6 +8,7 @@ from pytorch_lightning.trainer import Trainer
 from pytorch_lightning.callbacks import EarlyStopping, LearningRateMonitor, ModelCheckpoint
 
 from utils.plink import run_plink
+from fl.datasets.view import plink_pfile_args
 from nn.models import MLPClassifier
 from configs.split_config import FOLDS_NUMBER
 from preprocess.pruning import PlinkPruningRunner
@@ -84,6 +85,33 @@ def get_variants_number(fold):
     return allele['ID'].unique().shape[0]
 
 
+def get_pca_arguments(fold):
+    """
+    Plink arguments of centralized PCA on the ALL train part of {fold}. Fold parts are sample views
+    of ALL_filtered dataset, so they are passed to plink as --pfile of the source dataset and --keep file.
+    """
+    return plink_pfile_args(f'{SPLIT_DIRECTORY}/genotypes/ALL/fold_{fold}_train') + [
+        '--extract', f'{SPLIT_DIRECTORY}/genotypes/ALL.prune.in',
+        '--freq', 'counts',
+        '--out',  f'{SPLIT_DIRECTORY}/pca/ALL/fold_{fold}_train_projections',
+        '--pca', 'allele-wts', '20'
+    ]
+
+
+def get_projection_arguments(fold, part):
+    """
+    Plink arguments which project {part} of ALL on principal components of {fold} train part.
+    """
+    return plink_pfile_args(f'{SPLIT_DIRECTORY}/genotypes/ALL/fold_{fold}_{part}') + [
+        '--extract', f'{SPLIT_DIRECTORY}/genotypes/ALL.prune.in',
+        '--read-freq', f'{SPLIT_DIRECTORY}/pca/ALL/fold_{fold}_train_projections.acount',
+        '--score', f'{SPLIT_DIRECTORY}/pca/ALL/fold_{fold}_train_projections.eigenvec.allele',
+            '2', '5', 'header-read', 'no-mean-imputation', 'variance-standardize',
+        '--score-col-nums', '6-25',
+        '--out', f'{SPLIT_DIRECTORY}/pca/ALL/fold_{fold}_{part}_projections.csv.eigenvec'
+    ]
+
+
 def run_experiment(pruning_threshold):
     """
     Performs pruning, then runs cetralized PCA and compute model accuracy.
@@ -106,29 +134,11 @@ def run_experiment(pruning_threshold):
 
     # Run Centralized PCA
     for fold in range(FOLDS_NUMBER):
-        plink_arguments = [
-            '--pfile', f'{SPLIT_DIRECTORY}/genotypes/ALL/fold_{fold}_train',
-            '--extract', f'{SPLIT_DIRECTORY}/genotypes/ALL.prune.in',
-            '--freq', 'counts',
-            '--out',  f'{SPLIT_DIRECTORY}/pca/ALL/fold_{fold}_train_projections',
-            '--pca', 'allele-wts', '20'
-        ]
-
-        run_plink(args_list=plink_arguments)
+        run_plink(args_list=get_pca_arguments(fold))
 
         # Project ALL only
         for part in ['train', 'val', 'test']:
-            plink_arguments = [
-                '--pfile', f'{SPLIT_DIRECTORY}/genotypes/ALL/fold_{fold}_{part}',
-                '--extract', f'{SPLIT_DIRECTORY}/genotypes/ALL.prune.in',
-                '--read-freq', f'{SPLIT_DIRECTORY}/pca/ALL/fold_{fold}_train_projections.acount',
-                '--score', f'{SPLIT_DIRECTORY}/pca/ALL/fold_{fold}_train_projections.eigenvec.allele',
-                    '2', '5', 'header-read', 'no-mean-imputation', 'variance-standardize',
-                '--score-col-nums', '6-25',
-                '--out', f'{SPLIT_DIRECTORY}/pca/ALL/fold_{fold}_{part}_projections.csv.eigenvec'
-            ]
-
-            run_plink(args_list=plink_arguments)
+            run_plink(args_list=get_projection_arguments(fold, part))
 
         # Fit model and log accuracy
         _, y_train = data_provider.load_train_data('ALL', fold)
@@ -0,0 +1,22 @@
+import os
+import pandas
+from fl.datasets.view import SampleView
+from tg import centralized_pca_on_pruning_accuracy as centralized_pca
+
+
+def test_plink_arguments_of_sample_views(tmp_path, monkeypatch):
+    monkeypatch.setattr(centralized_pca, 'SPLIT_DIRECTORY', str(tmp_path))
+    genotypes = os.path.join(tmp_path, 'genotypes')
+    os.makedirs(os.path.join(genotypes, 'ALL'))
+    source_path = os.path.join(genotypes, 'ALL_filtered')
+    pandas.DataFrame({'#CHROM': [1, 1], 'POS': [10, 20], 'ID': ['rs1', 'rs2'], 'REF': ['A'] * 2, 'ALT': ['G'] * 2})\
+        .to_csv(source_path + '.pvar', sep='\t', index=False)
+    pandas.DataFrame({'#IID': [1001, 1002, 1003], 'SEX': [1, 2, 1]}).to_csv(source_path + '.psam', sep='\t', index=False)
+    for part, iids in [('train', [1001, 1003]), ('val', [1002])]:
+        SampleView.from_iids(source_path, iids).save(os.path.join(genotypes, 'ALL', f'fold_0_{part}'))
+
+    # fold parts have no .pgen of their own, plink reads the source dataset restricted to --keep samples
+    for part, arguments in [('train', centralized_pca.get_pca_arguments(0)),
+                            ('val', centralized_pca.get_projection_arguments(0, 'val'))]:
+        assert arguments[:4] == ['--pfile', source_path, '--keep', os.path.join(genotypes, 'ALL', f'fold_0_{part}.keep')]
+        assert arguments.count('--pfile') == 1
@@ -1,8 +1,8 @@
 import os
-import pandas as pd
 import numpy as np
 
 from utils.loaders import X, Y
+from fl.datasets.tables import read_table
 from nn.lightning import DataModule
 
 
@@ -51,9 +51,9 @@ class DataProvider:
         """
 
         # Drop 2nd (ALLELE_CT) and 3rd (NAMED_ALLELE_DOSAGE_SUM), columns of the plink PCs file
-        X = pd.read_csv(self.get_pca_file(node, fold, part), sep='\t', header=0)
+        X = read_table(self.get_pca_file(node, fold, part))
         X = X.drop(X.columns[1:3], axis=1).rename(columns={'#IID': 'IID'}).set_index('IID')
-        y = pd.read_csv(self.get_ancestry_file(node, fold, part), sep='\t', header=0).set_index('IID')
+        y = read_table(self.get_ancestry_file(node, fold, part)).set_index('IID')
 
         # Ensure that the order of ids is consistent
         assert len(X) == len(y)
@@ -64,7 +64,7 @@ def log(num_components, accuracy_train, accuracy_validation, accuracy_test):
 def run_experiment(num_components):
     """
     Runs training using the specified number of principal componenets and logs accuracy metrics
-    to the file.
+    to the file. The whole sweep can be trained as one model by local/experiment.py with model=mlp_classifier_ensemble.
     """
 
     data_provider = DataProvider(
@@ -1,12 +1,20 @@
 from dataclasses import dataclass
-from typing import Tuple, Any
+from typing import Optional, Tuple, Any
 from omegaconf import DictConfig
 import numpy
+import scipy.sparse
 import logging
 import omegaconf
 import pandas as pd
 
-from fl.datasets.memory import load_covariates, load_phenotype, load_from_pgen, get_sample_indices
+from fl.datasets.memory import load_covariates, load_phenotype, load_from_pgen, load_splits_from_pgen, get_sample_indices, get_variant_ids
+from fl.datasets.cache import GenotypeCache
+from fl.datasets.tables import read_table
+from fl.datasets.standardize import Standardization, feature_moments, load_acount_moments
+from fl.datasets.impute import MISSING_GENOTYPE, hardcall_means, impute_means, load_acount_means
+from fl.datasets.stream import GenotypeStream
+from fl.datasets.sweep import SnpCountSweep
+from fl.datasets.view import get_variant_count
 from configs.phenotype_config import MEAN_PHENO_DICT, PHENO_TYPE_DICT, PHENO_NUMPY_DICT, TYPE_LOSS_DICT, \
     TYPE_METRIC_DICT
 
@@ -17,6 +25,13 @@ class X:
     val: numpy.ndarray
     test: numpy.ndarray
 
+    def astype(self, new_type):
+        return X(
+            train=self.train.astype(new_type),
+            val=self.val.astype(new_type),
+            test=self.test.astype(new_type)
+        )
+
 @dataclass
 class Y:
     train: numpy.ndarray
@@ -39,9 +54,22 @@ class SampleIndex:
 
 
 class ExperimentDataLoader:
-    def __init__(self, cfg: DictConfig) -> None:
+    def __init__(self, cfg: DictConfig, snp_sweep: Optional[SnpCountSweep] = None) -> None:
         self.cfg = cfg
         self.logger = logging.getLogger()
+        self.genotype_cache = self._create_genotype_cache()
+        # gwas path and snp count of loaded genotypes, they define IDs of genotype columns
+        self.genotype_selection = None
+        # genotypes of the largest experiment.snp_counts value, which are reused for all smaller ones
+        self.snp_sweep = snp_sweep
+        # exact SNP means which replace missing genotypes for data.missing 'mean', they are kept as -9 in int8 genotypes
+        self.genotype_means = None
+
+    def _create_genotype_cache(self) -> GenotypeCache:
+        cache_cfg = self.cfg.data.get('genotype_cache', None)
+        if cache_cfg is None or cache_cfg.get('dir', None) is None:
+            return None
+        return GenotypeCache(cache_cfg.dir, cache_cfg.get('max_size_gb', 64.0))
 
     def _load_phenotype(self, path: str) -> numpy.ndarray:
         phenotype = load_phenotype(path, out_type=PHENO_NUMPY_DICT.get(self.cfg.data.phenotype.name, numpy.float32), encode=(self.cfg.study == 'tg'))
@@ -56,7 +84,30 @@ class ExperimentDataLoader:
             return phenotype
 
     def load(self) -> Tuple[X, Y]:
+        """Loads features as one matrix per part. Genotypes and covariates are concatenated, 
+        which upcasts genotypes to float16. Use load_blocks to keep them separate.
+        Missing genotypes are imputed with exact means for data.missing 'mean', which converts genotypes to float32.
+        """
+        x, x_cov, y = self.load_blocks()
+        if self.genotype_means is not None and not scipy.sparse.issparse(x.train):
+            x = X(*[impute_means(part, self.genotype_means) for part in [x.train, x.val, x.test]])
+        if x_cov is not None:
+            x = X(*[self._hstack(x_part, cov_part.astype(numpy.float16)) 
+                    for x_part, cov_part in zip([x.train, x.val, x.test], [x_cov.train, x_cov.val, x_cov.test])])
+        return x, y
+
+    def _hstack(self, x_part, cov_part: numpy.ndarray):
+        if scipy.sparse.issparse(x_part):
+            return scipy.sparse.hstack((x_part, cov_part), format='csr')
+        return numpy.hstack((x_part, cov_part))
 
+    def load_blocks(self) -> Tuple[X, Optional[X], Y]:
+        """Loads features as separate typed blocks: int8 genotypes and float32 covariates
+
+        Returns:
+            Tuple[X, Optional[X], Y]: Main features (genotypes, covariates or PCs), covariates if they are loaded 
+                in addition to genotypes or None, and phenotypes
+        """
         y_train = self._load_phenotype(self.cfg.data.phenotype.train)
         y_val = self._load_phenotype(self.cfg.data.phenotype.val)
         y_test = self._load_phenotype(self.cfg.data.phenotype.test)
@@ -65,10 +116,11 @@ class ExperimentDataLoader:
 
         assert self.cfg.experiment.include_genotype or self.cfg.experiment.include_covariates
 
+        x_cov = None
         if self.cfg.study == 'ukb':
             sample_index = self._load_sample_indices()
             if self.cfg.experiment.include_genotype and self.cfg.experiment.include_covariates:
-                x = self._load_genotype_and_covariates(sample_index)
+                x, x_cov = self._load_genotype_and_covariates(sample_index)
             elif self.cfg.experiment.include_genotype:
                 x = self._load_genotype(sample_index)
             else:
@@ -80,14 +132,12 @@ class ExperimentDataLoader:
         else:
             raise ValueError('Please define the study in config! See src/configs/default.yaml')
 
-        return x, y
+        return x, x_cov, y
 
     def _get_snp_count(self):
-        pvar_path = self.cfg.data.genotype + '.pvar'
-        pvar = pd.read_table(pvar_path)
-        return pvar.shape[0]
+        return get_variant_count(self.cfg.data.genotype)
 
-    def _load_genotype_and_covariates(self, sample_index: SampleIndex) -> X:
+    def _load_genotype_and_covariates(self, sample_index: SampleIndex) -> Tuple[X, X]:
         load_strategy = self.cfg.data.get('load_strategy', 'default')
         if load_strategy == 'default':
             gwas_path = self.cfg.data.gwas
@@ -100,41 +150,159 @@ class ExperimentDataLoader:
         else:
             raise ValueError(f'load_strategy should be one of ["default", "union"]')
 
-        test_samples_limit = self.cfg.experiment.get('test_samples_limit', None)
-        X_train = numpy.hstack((load_from_pgen(self.cfg.data.genotype,
-                                               gwas_path,
-                                               snp_count=snp_count,
-                                               sample_indices=sample_index.train),
-                               load_covariates(self.cfg.data.covariates.train).astype(numpy.float16)))
-        X_val = numpy.hstack((load_from_pgen(self.cfg.data.genotype,
-                                             gwas_path,
-                                             snp_count=snp_count,
-                                             sample_indices=sample_index.val),
-                               load_covariates(self.cfg.data.covariates.val).astype(numpy.float16)))
-        X_test = numpy.hstack((load_from_pgen(self.cfg.data.genotype,
-                                              gwas_path,
-                                              snp_count=snp_count,
-                                              sample_indices=sample_index.test),
-                               load_covariates(self.cfg.data.covariates.test)[:test_samples_limit, :].astype(numpy.float16)))
-
-        return X(X_train, X_val, X_test)
+        genotype = self._load_split_genotypes(sample_index, gwas_path, snp_count)
+        return genotype, self.load_covariates().astype(numpy.float32)
 
 
     def _load_genotype(self, sample_index: SampleIndex) -> X:
-        X_train = load_from_pgen(self.cfg.data.genotype,
-                                      gwas_path=self.cfg.data.get('gwas', None),
-                                      snp_count=self.cfg.experiment.get('snp_count', None),
-                                      sample_indices=sample_index.train)
-        X_val = load_from_pgen(self.cfg.data.genotype,
-                                    gwas_path=self.cfg.data.get('gwas', None),
-                                    snp_count=self.cfg.experiment.get('snp_count', None),
-                                    sample_indices=sample_index.val)
-        X_test = load_from_pgen(self.cfg.data.genotype,
-                                     gwas_path=self.cfg.data.get('gwas', None),
-                                     snp_count=self.cfg.experiment.get('snp_count', None),
-                                     sample_indices=sample_index.test)
+        return self._load_split_genotypes(sample_index,
+                                          gwas_path=self.cfg.data.get('gwas', None),
+                                          snp_count=self.cfg.experiment.get('snp_count', None))
+
+    def _load_split_genotypes(self, sample_index: SampleIndex, gwas_path: str, snp_count: int) -> X:
+        """Loads train, val and test genotypes either in one pass over .pgen (default)
+        or with a separate load_from_pgen call for each part if data.genotype_loading is 'per_split'.
+        If data.genotype_loading is 'streaming', GenotypeStream descriptions are returned and genotypes
+        are decoded block by block during training, which is supported only by NN models.
+        If data.genotype_format is 'packed', genotypes are kept as 2-bit PackedGenotypes,
+        if it is 'sparse', they are converted to scipy.sparse.csr_matrix.
+        Missing genotypes are filled according to data.missing. For 'mean' strategy they stay -9 in int8 genotypes
+        and exact means are kept in genotype_means, see _load_genotype_means. Sparse genotypes are imputed right away.
+        If experiment.snp_counts is set, genotypes of top max(snp_counts) SNPs are loaded only once with columns ordered
+        by significance and top {snp_count} SNPs are returned as views of their first columns.
+        """
+        self.genotype_selection = (gwas_path, snp_count)
+        genotype_format = self.cfg.data.get('genotype_format', 'int8')
+        if genotype_format not in ['int8', 'packed', 'sparse']:
+            raise ValueError(f'genotype_format should be one of ["int8", "packed", "sparse"]')
+        packed = genotype_format == 'packed'
+        missing = self.cfg.data.get('missing', 'zero')
+        genotype_loading = self.cfg.data.get('genotype_loading', 'single_pass')
+        snp_counts = self.cfg.experiment.get('snp_counts', None)
+        if snp_counts is not None and gwas_path is not None:
+            if genotype_format == 'sparse' or genotype_loading == 'streaming':
+                raise ValueError('snp_counts sweep requires int8 or packed genotypes loaded into memory')
+            if self.snp_sweep is None:
+                self.snp_sweep = SnpCountSweep.from_pgen(self.cfg.data.genotype,
+                                                         gwas_path,
+                                                         max(snp_counts),
+                                                         [sample_index.train, sample_index.val, sample_index.test],
+                                                         packed=packed,
+                                                         cache=self.genotype_cache,
+                                                         threads=self.cfg.data.get('genotype_threads', 1),
+                                                         missing=missing)
+            self.logger.info(f'top {snp_count} SNPs are taken from the sweep of {self.snp_sweep.max_snp_count} SNPs')
+            x = X(*self.snp_sweep.top(snp_count))
+            self.genotype_means = self._load_genotype_means(x.train) if missing == 'mean' else None
+            return x
+        if genotype_loading == 'single_pass':
+            X_train, X_val, X_test = load_splits_from_pgen(self.cfg.data.genotype,
+                                                           gwas_path,
+                                                           snp_count=snp_count,
+                                                           split_sample_indices=[sample_index.train, sample_index.val, sample_index.test],
+                                                           cache=self.genotype_cache,
+                                                           packed=packed,
+                                                           threads=self.cfg.data.get('genotype_threads', 1),
+                                                           missing=missing)
+        elif genotype_loading == 'per_split':
+            X_train, X_val, X_test = [load_from_pgen(self.cfg.data.genotype,
+                                                     gwas_path,
+                                                     snp_count=snp_count,
+                                                     sample_indices=indices,
+                                                     cache=self.genotype_cache,
+                                                     packed=packed,
+                                                     threads=self.cfg.data.get('genotype_threads', 1),
+                                                     missing=missing)
+                                      for indices in [sample_index.train, sample_index.val, sample_index.test]]
+        elif genotype_loading == 'streaming':
+            if genotype_format != 'int8':
+                raise ValueError('streamed genotypes are decoded to int8 blocks, genotype_format should be "int8"')
+            stream_cfg = self.cfg.data.get('genotype_stream', {})
+            X_train, X_val, X_test = [GenotypeStream.from_pgen(self.cfg.data.genotype,
+                                                               gwas_path,
+                                                               snp_count=snp_count,
+                                                               sample_indices=indices,
+                                                               block_size=stream_cfg.get('block_size', 8192),
+                                                               prefetch_blocks=stream_cfg.get('prefetch_blocks', 1),
+                                                               missing=missing)
+                                      for indices in [sample_index.train, sample_index.val, sample_index.test]]
+        else:
+            raise ValueError(f'genotype_loading should be one of ["single_pass", "per_split", "streaming"]')
+        self.genotype_means = self._load_genotype_means(X_train) if missing == 'mean' else None
+        if genotype_format == 'sparse':
+            # most genotypes are homozygous reference, i.e. zero, so only nonzero calls are kept
+            X_train, X_val, X_test = [self._to_sparse(part) for part in [X_train, X_val, X_test]]
+            self.logger.info(f'sparse genotypes have {X_train.nnz / numpy.prod(X_train.shape):.3f} density in train')
         return X(X_train, X_val, X_test)
 
+    def _load_genotype_means(self, x_train) -> numpy.ndarray:
+        """Mean genotypes which replace missing ones: doubled ALT frequencies from data.allele_counts if it is set,
+        e.g. federated counts give the same imputation to all nodes, otherwise means of observed train genotypes
+        """
+        acount_path = self.cfg.data.get('allele_counts', None)
+        if acount_path is not None:
+            return load_acount_means(acount_path, self._genotype_variant_ids())
+        if isinstance(x_train, GenotypeStream):
+            raise ValueError('mean imputation of streamed genotypes requires data.allele_counts')
+        return hardcall_means(x_train)
+
+    def _to_sparse(self, part: numpy.ndarray) -> scipy.sparse.csr_matrix:
+        if self.genotype_means is None:
+            return scipy.sparse.csr_matrix(part)
+        # missing genotypes are nonzero -9 entries, they are replaced with means of their SNPs
+        part = scipy.sparse.csr_matrix(part, dtype=numpy.float32)
+        missing = part.data == MISSING_GENOTYPE
+        part.data[missing] = self.genotype_means[part.indices[missing]]
+        return part
+
+    def load_standardization(self, x: X, x_cov: Optional[X] = None) -> Optional[Standardization]:
+        """Computes shift and scale of features for standardization of batches, which replaces
+        input batch normalization of models. If data.standardization is 'train', means and standard deviations
+        of genotypes are calculated from train genotypes of the node. If it is 'allele_counts', they are derived
+        from data.allele_counts, which gives all nodes the same standardization if the counts are federated.
+        Covariates are always standardized with train statistics. For data.missing 'mean' the result also imputes
+        missing int8 or packed genotypes with genotype_means, even if standardization is disabled.
+
+        Args:
+            x (X): Genotypes returned by load_blocks
+            x_cov (Optional[X], optional): Covariates returned by load_blocks. Defaults to None.
+
+        Returns:
+            Optional[Standardization]: Standardization of genotypes followed by covariates or None if it is disabled
+        """
+        standardization = self.cfg.data.get('standardization', None)
+        # sparse genotypes are imputed during loading
+        fill = self.genotype_means if not scipy.sparse.issparse(x.train) else None
+        if standardization is None:
+            if fill is None:
+                return None
+            cov_count = x_cov.train.shape[1] if x_cov is not None else 0
+            return Standardization.identity(x.train.shape[1] + cov_count, fill)
+        if self.genotype_selection is None:
+            raise ValueError('standardization is supported only for genotype features')
+        if standardization == 'train':
+            if isinstance(x.train, GenotypeStream) or scipy.sparse.issparse(x.train):
+                raise ValueError('train standardization requires int8 or packed genotypes in memory, use "allele_counts"')
+            means, stds = feature_moments(x.train, fill=fill)
+        elif standardization == 'allele_counts':
+            acount_path = self.cfg.data.get('allele_counts', None)
+            if acount_path is None:
+                raise ValueError('allele_counts standardization requires data.allele_counts')
+            means, stds = load_acount_moments(acount_path, self._genotype_variant_ids())
+        else:
+            raise ValueError(f'standardization should be one of [null, "train", "allele_counts"]')
+        result = Standardization.from_moments(means, stds, fill)
+        if x_cov is not None:
+            result = result.concatenate(Standardization.from_moments(*feature_moments(x_cov.train)))
+        self.logger.info(f'{len(result)} features will be standardized with {standardization} statistics')
+        return result
+
+    def _genotype_variant_ids(self) -> numpy.ndarray:
+        gwas_path, snp_count = self.genotype_selection
+        if self.snp_sweep is not None and gwas_path is not None:
+            return self.snp_sweep.top_variant_ids(snp_count)
+        return get_variant_ids(self.cfg.data.genotype, gwas_path, snp_count)
+
     def load_covariates(self) -> X:
         test_samples_limit = self.cfg.experiment.get('test_samples_limit', None)
         X_train = load_covariates(self.cfg.data.covariates.train)
@@ -167,7 +335,7 @@ class ExperimentDataLoader:
         return SampleIndex(si_train, si_val, si_test)
 
     def _sample_weights(self, pheno_file: str) -> numpy.ndarray:
-        sw_frame = pd.read_table(pheno_file + '.sw')
+        sw_frame = read_table(pheno_file + '.sw')
         return sw_frame.sample_weight.values
 
     def load_sample_weights(self) -> Y:
@@ -196,10 +364,10 @@ def calculate_sample_weights(populations_frame: pd.DataFrame, pheno_frame: pd.Da
 def load_plink_pcs(path, order_as_in_file=None):
     """ Loads PLINK's eigenvector matrix (e.g. to be used as X for TG). If @order_as_in_file is not None,
      reorder rows of the matrix to match (IID-wise) rows of the file """
-    df = pd.read_csv(path, sep='\t').rename(columns={'#IID': 'IID'}).set_index('IID').iloc[:, 2:]
+    df = read_table(path).rename(columns={'#IID': 'IID'}).set_index('IID').iloc[:, 2:]
 
     if order_as_in_file is not None:
-        y = pd.read_csv(order_as_in_file, sep='\t').set_index('IID')
+        y = read_table(order_as_in_file).set_index('IID')
         assert len(df) == len(y)
         df = df.reindex(y.index)
 